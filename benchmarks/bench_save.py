@@ -0,0 +1,68 @@
+"""
+Measures file size and save time of the output pdfs for every save preset,
+on synthetic patterns with compressed and uncompressed ("raw") streams.
+
+    $ python -m benchmarks.bench_save --repeat 5
+"""
+
+import argparse
+import pathlib
+import statistics
+import tempfile
+import time
+from typing import List, Tuple
+
+import pikepdf
+
+from benchmarks import patterngen
+from nobubo.disassembly import SAVE_PRESETS, SaveOptions
+from nobubo.init_nobubo import parse_cli_input_data, parse_cli_output_data
+
+
+# content of the pattern pages, and whether their streams are compressed
+PATTERNS = [("vector", True), ("vector", False), ("image", True)]
+
+
+def time_save(
+    chops: pikepdf.Pdf, options: SaveOptions, path: pathlib.Path, repeat: int
+) -> Tuple[float, int]:
+    timings: List[float] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        options.save(chops, path)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), path.stat().st_size
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5, help="saves per preset")
+    parser.add_argument("--size", default="20x15", help="COLUMNSxROWS of the pattern")
+    args = parser.parse_args()
+    columns, rows = (int(number) for number in args.size.split("x"))
+    variants = {**SAVE_PRESETS, "linearized": SaveOptions(linearize=True)}
+
+    print(f"{'pattern':<14} {'preset':<10} {'size':>10} {'save':>10}")
+    with tempfile.TemporaryDirectory() as td:
+        work = pathlib.Path(td)
+        for content, compress in PATTERNS:
+            label = content if compress else f"{content} (raw)"
+            pattern = patterngen.generate_pattern(
+                work / "pattern.pdf", columns, rows, content=content, compress=compress
+            )
+            nobubo_input = parse_cli_input_data([(1, columns, rows)], False, str(pattern))
+            nobubo_output = parse_cli_output_data("a0", None, str(work / "out.pdf"))
+            with pikepdf.open(pattern) as source:
+                # tiled directly, so the streams of the pattern reach the output unchanged
+                tiles = nobubo_output.tile_overview(
+                    source, nobubo_input.pagesize, nobubo_input.layout[0], False
+                )
+                for name, options in variants.items():
+                    seconds, size = time_save(tiles, options, work / f"{name}.pdf", args.repeat)
+                    print(
+                        f"{label:<14} {name:<10} {size / 1024:>7.0f} kB {seconds * 1000:>7.1f} ms"
+                    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Measures how much TeX startup time the precompiled format saves per overview.
+
+Requires pdflatex with the pdfpages package.
+
+    $ python benchmarks/bench_texformat.py --repeat 5
+"""
+
+import argparse
+import pathlib
+import statistics
+import tempfile
+import time
+
+from nobubo import texformat
+from nobubo.init_nobubo import parse_cli_input_data
+
+TESTDATA = pathlib.Path(__file__).parent.parent / "tests" / "testdata"
+
+
+def time_assembly(repeat: int, use_format: bool) -> list[float]:
+    nobubo_input = parse_cli_input_data(
+        [(2, 8, 4)], False, str(TESTDATA / "mockpattern_oneoverview_8x4.pdf"), "pdflatex"
+    )
+    nobubo_input.tex_format_path = texformat.ensure_format() if use_format else None
+    if use_format and nobubo_input.tex_format_path is None:
+        raise SystemExit("The TeX format could not be built.")
+    timings = []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as td:
+            start = time.perf_counter()
+            nobubo_input._assemble(pathlib.Path(td), nobubo_input.layout[0])
+            timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=5, help="runs per variant")
+    args = parser.parse_args()
+
+    full = statistics.median(time_assembly(args.repeat, use_format=False))
+    precompiled = statistics.median(time_assembly(args.repeat, use_format=True))
+    print(f"full preamble:      {full * 1000:8.1f} ms per overview")
+    print(f"precompiled format: {precompiled * 1000:8.1f} ms per overview")
+    print(f"saved:              {(full - precompiled) * 1000:8.1f} ms per overview")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Generates synthetic pattern pdfs for benchmarks and tests.
+
+    $ python -m benchmarks.patterngen --columns 20 --rows 15 --overview pattern.pdf
+"""
+
+import argparse
+import pathlib
+import random
+from typing import Tuple
+
+import pikepdf
+
+A4 = (595.3, 841.89)
+LETTER = (612.0, 792.0)
+
+
+def generate_pattern(
+    path: pathlib.Path,
+    columns: int,
+    rows: int,
+    page_size: Tuple[float, float] = A4,
+    content: str = "vector",
+    overview: bool = False,
+    image_size: int = 256,
+    seed: int = 0,
+    compress: bool = True,
+) -> pathlib.Path:
+    """
+    Write a pattern pdf with columns x rows pattern pages.
+    :param path: Where the pdf is saved.
+    :param columns: Columns of the pattern.
+    :param rows: Rows of the pattern.
+    :param page_size: Width and height of a pattern page in user space units.
+    :param content: "vector" draws lines and labels, "image" additionally places
+    a noise image of image_size x image_size pixels on every page.
+    :param overview: Add a landscape overview page in front of the pattern pages,
+    so the pattern starts on page 2.
+    :param image_size: Width and height of the images in pixels.
+    :param seed: Seed for the pseudo-random pattern lines and images.
+    :param compress: Compress the streams, as most pattern pdfs do.
+    :return: The path to the pdf.
+    """
+    if content not in ("vector", "image"):
+        raise ValueError(f"Unknown content {content}, use vector or image.")
+    rng = random.Random(seed)
+    pdf = pikepdf.new()
+    font = pdf.make_indirect(
+        pikepdf.Dictionary(
+            Type=pikepdf.Name.Font,
+            Subtype=pikepdf.Name.Type1,
+            BaseFont=pikepdf.Name.Helvetica,
+        )
+    )
+    if overview:
+        _add_overview_page(pdf, font, columns, rows)
+
+    width, height = page_size
+    for number in range(1, columns * rows + 1):
+        page = pdf.add_blank_page(page_size=page_size)
+        page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font))
+        label = f"{chr(ord('A') + (number - 1) // columns % 26)}{(number - 1) % columns + 1}"
+        ops = [f"0.5 w 0 0 {width:.2f} {height:.2f} re S"]
+        for _ in range(12):
+            points = " ".join(
+                f"{rng.uniform(0, width):.2f} {rng.uniform(0, height):.2f}" for _ in range(4)
+            )
+            x0, y0, x1, y1, x2, y2, x3, y3 = points.split()
+            ops.append(f"{x0} {y0} m {x1} {y1} {x2} {y2} {x3} {y3} c S")
+        if content == "image":
+            image = pikepdf.Stream(pdf, rng.randbytes(image_size * image_size * 3))
+            image.Type = pikepdf.Name.XObject
+            image.Subtype = pikepdf.Name.Image
+            image.Width = image_size
+            image.Height = image_size
+            image.ColorSpace = pikepdf.Name.DeviceRGB
+            image.BitsPerComponent = 8
+            page.Resources.XObject = pikepdf.Dictionary(Im1=image)
+            ops.append(f"q {width / 2:.2f} 0 0 {height / 2:.2f} {width / 4:.2f} 0 cm /Im1 Do Q")
+        ops.append(f"BT /F1 72 Tf {width / 2 - 60:.2f} {height / 2:.2f} Td ({label}) Tj ET")
+        ops.append(f"BT /F1 24 Tf 20 20 Td ({number}) Tj ET")
+        page.Contents = pdf.make_stream("\n".join(ops).encode())
+
+    pdf.save(path, compress_streams=compress)
+    return path
+
+
+def _add_overview_page(pdf: pikepdf.Pdf, font: pikepdf.Object, columns: int, rows: int) -> None:
+    # landscape A4, so it differs in size from the pattern pages
+    width, height = A4[1], A4[0]
+    page = pdf.add_blank_page(page_size=(width, height))
+    page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font))
+    cell = min((width - 40) / columns, (height - 80) / rows)
+    ops = [f"BT /F1 18 Tf 20 {height - 30:.2f} Td (Overview {columns} x {rows}) Tj ET"]
+    for row in range(rows):
+        for column in range(columns):
+            x = 20 + column * cell
+            y = height - 60 - (row + 1) * cell
+            ops.append(f"{x:.2f} {y:.2f} {cell:.2f} {cell:.2f} re S")
+    page.Contents = pdf.make_stream("\n".join(ops).encode())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--columns", type=int, required=True)
+    parser.add_argument("--rows", type=int, required=True)
+    parser.add_argument("--page-size", choices=["a4", "letter"], default="a4")
+    parser.add_argument("--content", choices=["vector", "image"], default="vector")
+    parser.add_argument("--overview", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("output", type=pathlib.Path)
+    args = parser.parse_args()
+    generate_pattern(
+        args.output,
+        args.columns,
+        args.rows,
+        page_size=A4 if args.page_size == "a4" else LETTER,
+        content=args.content,
+        overview=args.overview,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    main()
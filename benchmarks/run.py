@@ -0,0 +1,154 @@
+"""
+Times the stages of nobubo on synthetic patterns and compares them with a baseline.
+
+Every stage is measured in a fresh process, so that the peak RSS belongs to the
+stage and the stages before it, but not to earlier measurements.
+
+    $ python -m benchmarks.run                    # compare with benchmarks/baseline.json
+    $ python -m benchmarks.run --update-baseline  # store the current numbers
+
+Exits with status 1 if a stage is slower or needs more memory than the baseline
+allows, see --tolerance.
+"""
+
+import argparse
+import json
+import multiprocessing
+import pathlib
+import resource
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from benchmarks import patterngen
+
+BASELINE = pathlib.Path(__file__).parent / "baseline.json"
+STAGES = ["parse", "assemble_collage", "create_output_files", "write_collage"]
+DEFAULT_SIZES = ["4x4", "8x4", "20x15", "40x30"]
+CONTENTS = ["vector", "image"]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def measure_stage(stage: str, pattern: str, layout: Tuple[int, int, int], work_dir: str) -> dict:
+    """
+    Runs the stages up to the given one and measures the given one.
+    Runs in a child process.
+    """
+    from nobubo.init_nobubo import parse_cli_input_data, parse_cli_output_data
+
+    work = pathlib.Path(work_dir)
+    timings: Dict[str, float] = {}
+    start = time.perf_counter()
+    nobubo_input = parse_cli_input_data([layout], False, pattern)
+    timings["parse"] = time.perf_counter() - start
+    if stage != "parse":
+        nobubo_output = parse_cli_output_data(
+            "a0" if stage == "create_output_files" else None, None, str(work / "out.pdf")
+        )
+        start = time.perf_counter()
+        collage_paths = nobubo_input.assemble_collage(work)
+        timings["assemble_collage"] = time.perf_counter() - start
+        start = time.perf_counter()
+        if stage == "create_output_files":
+            nobubo_output.create_output_files(collage_paths, nobubo_input)
+            timings[stage] = time.perf_counter() - start
+        elif stage == "write_collage":
+            nobubo_output.write_collage(collage_paths)
+            timings[stage] = time.perf_counter() - start
+    return {"seconds": round(timings[stage], 4), "peak_rss_mb": round(peak_rss_mb(), 1)}
+
+
+def run(sizes: List[str], contents: List[str], repeat: int) -> Dict[str, dict]:
+    results: Dict[str, dict] = {}
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as td:
+        for content, size in [(content, size) for content in contents for size in sizes]:
+            columns, rows = (int(number) for number in size.split("x"))
+            pattern = patterngen.generate_pattern(
+                pathlib.Path(td) / f"pattern_{content}_{size}.pdf",
+                columns,
+                rows,
+                content=content,
+                overview=True,
+            )
+            for stage in STAGES:
+                measurements = []
+                for number in range(repeat):
+                    work_dir = pathlib.Path(td) / f"{content}_{size}_{stage}_{number}"
+                    work_dir.mkdir()
+                    with context.Pool(1) as pool:
+                        measurements.append(
+                            pool.apply(
+                                measure_stage, (stage, str(pattern), (2, columns, rows), work_dir)
+                            )
+                        )
+                # the fastest run is the least disturbed by other processes
+                best = min(measurements, key=lambda m: m["seconds"])
+                results[f"{content}/{size}/{stage}"] = best
+                print(
+                    f"{content:>6} {size:>6} {stage:<20} {best['seconds']:8.3f}s "
+                    f"{best['peak_rss_mb']:8.1f} MB",
+                    flush=True,
+                )
+    return results
+
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> List[str]:
+    """
+    :return: One message per regression.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            print(f"No baseline for {key}, run with --update-baseline to add it.")
+            continue
+        expected = baseline[key]
+        # absolute slack, so that tiny stages do not fail on noise
+        if result["seconds"] > expected["seconds"] * (1 + tolerance) + 0.05:
+            regressions.append(
+                f"{key}: {result['seconds']:.3f}s, baseline {expected['seconds']:.3f}s"
+            )
+        if result["peak_rss_mb"] > expected["peak_rss_mb"] * (1 + tolerance) + 5:
+            regressions.append(
+                f"{key}: {result['peak_rss_mb']:.1f} MB, baseline {expected['peak_rss_mb']:.1f} MB"
+            )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", default=",".join(DEFAULT_SIZES), help="comma separated COLUMNSxROWS"
+    )
+    parser.add_argument(
+        "--contents", default=",".join(CONTENTS), help="comma separated: vector, image"
+    )
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best counts")
+    parser.add_argument("--baseline", type=pathlib.Path, default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=0.5, help="allowed relative slowdown")
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    results = run(args.sizes.split(","), args.contents.split(","), args.repeat)
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    if args.update_baseline:
+        baseline.update(results)
+        args.baseline.write_text(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+        print(f"Baseline written to {args.baseline}.")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nREGRESSIONS:\n" + "\n".join(regressions))
+        sys.exit(1)
+    print("\nNo regressions.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Library API for programs that embed nobubo, e.g. web services.
+
+    result = await nobubo.api.convert("pattern.pdf", "pattern_a0.pdf", [(2, 8, 4)], "a0")
+    result.output_paths  # [PosixPath('pattern_a0_1.pdf')]
+
+Unlike the command line, the API neither configures logging nor prints or exits:
+it returns a ConversionResult and raises errors.Error subclasses. pdflatex runs
+as an asyncio subprocess, and the pikepdf steps run in an executor, so the event
+loop is never blocked. Cancelling convert() kills a running pdflatex and stops
+before the next step; a pikepdf step that has already started finishes in the
+executor, its files are discarded.
+
+convert_bytes() takes the pattern as bytes or a file object and returns the
+outputs as streams, keeping everything in memory as long as it is small enough.
+
+stream_sheets() hands out the output pages in batches as soon as they are ready,
+e.g. to a print spooler that starts printing while the rest is still produced:
+
+    async for sheets in nobubo.api.stream_sheets("pattern.pdf", "pattern_a0.pdf", output_layout="a0"):
+        spool(sheets.path)
+
+Scripts without an event loop use convert_sync() with the same arguments as convert().
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import pathlib
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, BinaryIO, Callable, List, Optional, Tuple, TypeVar, Union
+
+from nobubo import assembly, errors, memory, texformat
+from nobubo.assembly import Layout, NobuboInput
+from nobubo.disassembly import SheetBatch
+from nobubo.init_nobubo import (
+    parse_cli_input_data,
+    parse_cli_output_data,
+    parse_cli_outputs,
+    parse_save_options,
+)
+
+T = TypeVar("T")
+
+
+@dataclass
+class ConversionResult:
+    """
+    Outcome of a conversion.
+
+    layouts: The input layouts, as given or as detected.
+    output_paths: The written pdfs, per output layout in the order of the overviews,
+    followed by the shared sheets if the output pages are packed.
+    """
+
+    input_path: pathlib.Path
+    layouts: List[Layout]
+    output_paths: List[pathlib.Path]
+    seconds: float
+
+
+async def convert(
+    input_path: Union[str, pathlib.Path],
+    output_path: Union[str, pathlib.Path],
+    input_layout: Optional[List[Tuple[int, int, int]]] = None,
+    output_layout: Union[None, str, List[str]] = None,
+    print_margin: Union[None, int, List[int]] = None,
+    reverse_assembly: bool = False,
+    engine: str = "pikepdf",
+    tex_format: bool = True,
+    save_preset: str = "default",
+    subset: bool = False,
+    direct: bool = False,
+    orientation: str = "given",
+    pack: bool = False,
+    combine: bool = False,
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> ConversionResult:
+    """
+    Convert a pattern pdf, with the same options as the command line.
+    :param input_path: The pattern pdf.
+    :param output_path: Where the output is saved, the overview number is appended.
+    :param input_layout: First page, columns and rows of every overview, None detects them.
+    :param output_layout: a0, us, mmxmm, a list of them, or None for a collage.
+    :param print_margin: Print margin in mm, once for all output layouts or once per layout.
+    :param reverse_assembly: Assemble from bottom left to top right.
+    :param engine: The engine that assembles the collage, one of assembly.ENGINES.
+    :param tex_format: pdflatex engine only: use the cached precompiled preamble.
+    :param save_preset: How the output pdfs are saved, one of SAVE_PRESETS.
+    :param subset: Every output page only contains the pattern pages visible on it.
+    :param direct: Build the output pages without assembling a collage first.
+    :param orientation: Whether output pages may be turned, one of disassembly.ORIENTATIONS.
+    :param pack: Put the partly filled output pages of all overviews on shared sheets.
+    :param combine: Write all overviews to one pdf at output_path.
+    :param executor: Runs the pikepdf steps, default: the event loop's thread pool.
+    :return: The layouts and the written files.
+    """
+    start = time.perf_counter()
+    _check_engine(engine)
+    nobubo_input = await _run(
+        executor,
+        parse_cli_input_data,
+        input_layout,
+        reverse_assembly,
+        str(input_path),
+        engine,
+        tex_format,
+    )
+    outputs = parse_cli_outputs(
+        _as_list(output_layout),
+        _as_list(print_margin),
+        str(output_path),
+        parse_save_options(save_preset),
+        subset,
+        orientation,
+        pack,
+        combine,
+    )
+    tiled = all(output.output_pagesize is not None for output in outputs)
+    # a step that is still running after a cancellation may leave files behind
+    with tempfile.TemporaryDirectory(ignore_cleanup_errors=True) as td:
+        if direct and tiled:
+            for output in outputs:
+                await _run(executor, output.create_direct_output_files, nobubo_input)
+        else:
+            collages = await _assemble(nobubo_input, pathlib.Path(td), executor)
+            for output in outputs:
+                if tiled:
+                    await _run(executor, output.create_output_files, collages, nobubo_input)
+                else:
+                    await _run(executor, output.write_collage, collages)
+    return ConversionResult(
+        input_path=pathlib.Path(input_path),
+        layouts=nobubo_input.layout,
+        output_paths=[
+            path for output in outputs for path in output.written_paths(len(nobubo_input.layout))
+        ],
+        seconds=round(time.perf_counter() - start, 3),
+    )
+
+
+async def convert_bytes(
+    data: Union[bytes, BinaryIO],
+    input_layout: Optional[List[Tuple[int, int, int]]] = None,
+    output_layout: Union[None, str, List[str]] = None,
+    print_margin: Union[None, int, List[int]] = None,
+    reverse_assembly: bool = False,
+    engine: str = "pikepdf",
+    tex_format: bool = True,
+    save_preset: str = "default",
+    subset: bool = False,
+    direct: bool = False,
+    orientation: str = "given",
+    name: str = "pattern.pdf",
+    spill_threshold: int = memory.SPILL_THRESHOLD,
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> List[memory.OutputStream]:
+    """
+    Convert a pattern from bytes or a binary file object to output streams,
+    without touching the filesystem unless the pattern is larger than spill_threshold
+    or the engine is pdflatex. The other arguments are the same as for convert().
+    :param name: The name of the input, from which the names of the outputs are derived.
+    :param spill_threshold: Size in bytes above which temporary files are used.
+    :return: One stream per output layout and overview. Temporary files among them
+    are removed when they are closed.
+    """
+    _check_engine(engine)
+    outputs = parse_cli_outputs(
+        _as_list(output_layout),
+        _as_list(print_margin),
+        name,
+        parse_save_options(save_preset),
+        subset,
+        orientation,
+    )
+    return await _run(
+        executor,
+        memory.convert_in_memory,
+        data,
+        input_layout,
+        outputs,
+        reverse_assembly,
+        engine,
+        tex_format,
+        direct,
+        spill_threshold,
+    )
+
+
+async def stream_sheets(
+    input_path: Union[str, pathlib.Path],
+    output_path: Union[str, pathlib.Path],
+    input_layout: Optional[List[Tuple[int, int, int]]] = None,
+    output_layout: str = "a0",
+    print_margin: Optional[int] = None,
+    reverse_assembly: bool = False,
+    engine: str = "pikepdf",
+    tex_format: bool = True,
+    save_preset: str = "default",
+    subset: bool = False,
+    orientation: str = "given",
+    batch: int = 1,
+    in_memory: bool = False,
+    executor: Optional[concurrent.futures.Executor] = None,
+) -> AsyncIterator[SheetBatch]:
+    """
+    Convert a pattern pdf to one output layout, and hand out every batch of output
+    pages as its own pdf as soon as it is ready. The other arguments are the same
+    as for convert().
+    :param output_path: The batches are named after it, e.g. pattern_a0_1_sheet001.pdf.
+    :param batch: How many output pages go into one pdf.
+    :param in_memory: Hand out the pdfs as bytes instead of writing them.
+    :return: The batches, in the order of the overviews and their output pages.
+    """
+    _check_engine(engine)
+    if batch < 1:
+        raise errors.UsageError(f"A batch needs at least one output page, not {batch}.")
+    nobubo_input = await _run(
+        executor,
+        parse_cli_input_data,
+        input_layout,
+        reverse_assembly,
+        str(input_path),
+        engine,
+        tex_format,
+    )
+    output = parse_cli_output_data(
+        output_layout,
+        print_margin,
+        str(output_path),
+        parse_save_options(save_preset),
+        subset,
+        orientation,
+    )
+    sheets = output.iter_sheets(nobubo_input, batch, in_memory)
+    try:
+        while True:
+            # every batch is produced in the executor, one after the other
+            sheet_batch = await _run(executor, next, sheets, None)
+            if sheet_batch is None:
+                return
+            yield sheet_batch
+    finally:
+        sheets.close()
+
+
+def convert_sync(*args: Any, **kwargs: Any) -> ConversionResult:
+    """
+    Run convert() to completion, for callers without an event loop.
+    """
+    return asyncio.run(convert(*args, **kwargs))
+
+
+async def run_command(command: List[str]) -> str:
+    """
+    Run a command without blocking the event loop. The command is killed
+    if the calling task is cancelled.
+    :param command: The program and its arguments.
+    :return: The combined stdout and stderr of the command.
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *command, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT
+        )
+    except FileNotFoundError as e:
+        raise errors.UsageError(f"{command[0]} was not found:\n{e}")
+    try:
+        output, _ = await process.communicate()
+    except asyncio.CancelledError:
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        raise
+    text = output.decode(errors="replace")
+    if process.returncode:
+        raise errors.UsageError(
+            f"Error: {command[0]} exited with status {process.returncode}:\n{text[-2000:]}"
+        )
+    return text
+
+
+async def _assemble(
+    nobubo_input: NobuboInput,
+    temp_output_dir: pathlib.Path,
+    executor: Optional[concurrent.futures.Executor],
+) -> List[pathlib.Path]:
+    if nobubo_input.engine == "pdflatex" and nobubo_input.tex_format:
+        nobubo_input.tex_format_path = await _run(executor, texformat.ensure_format)
+    collages: List[pathlib.Path] = []
+    for counter, layout in enumerate(nobubo_input.layout):
+        assembly.check_page_range(layout, nobubo_input.number_of_pages)
+        workspace = temp_output_dir / f"overview_{counter + 1}"
+        workspace.mkdir()
+        if nobubo_input.engine == "pdflatex":
+            command, collage_path = await _run(
+                executor, nobubo_input.pdflatex_command, workspace, layout
+            )
+            try:
+                await run_command(command)
+            except errors.UsageError as e:
+                raise errors.UsageError(f"Overview {counter + 1} could not be assembled:\n{e}")
+            collages.append(collage_path)
+        else:
+            collages.append(
+                await _run(executor, nobubo_input.assemble_with_pikepdf, workspace, layout)
+            )
+    return collages
+
+
+async def _run(
+    executor: Optional[concurrent.futures.Executor], function: Callable[..., T], *args: Any
+) -> T:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(function, *args))
+
+
+def _check_engine(engine: str) -> None:
+    if engine not in assembly.ENGINES:
+        raise errors.UsageError(
+            f"Unknown engine {engine}, use one of {', '.join(assembly.ENGINES)}."
+        )
+
+
+def _as_list(value: Union[None, T, List[T]]) -> List[T]:
+    if value is None:
+        return []
+    return value if isinstance(value, list) else [value]
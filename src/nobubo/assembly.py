@@ -19,19 +19,26 @@
 Contains functions for various output layouts.
 """
 
+import concurrent.futures
+import contextlib
 import logging
 import pathlib
 import random
 import string
 import subprocess
 from dataclasses import dataclass
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple
 
-from nobubo import errors
+import pikepdf
+
+from nobubo import cache, dedup, errors, geometry, profiling, texformat
 
 
 logger = logging.getLogger(__name__)
 
+# pikepdf assembles the collage natively, pdflatex uses the pdfpages package
+ENGINES = ("pikepdf", "pdflatex")
+
 
 @dataclass
 class PageSize:
@@ -70,6 +77,9 @@ class NobuboInput:
         pagesize: PageSize,
         layout: List[Layout],
         reverse_assembly: bool = False,
+        engine: str = "pikepdf",
+        tex_format: bool = True,
+        page_index: Optional[geometry.PageIndex] = None,
     ):
         """
         Holds all information concerning the input pdf and is responsible
@@ -80,12 +90,21 @@ class NobuboInput:
         :param layout: layout of the pdfs
         :param reverse_assembly: False: assemble pdf from top left to bottom right,
         True: assemble pdf from bottom left to top right.
+        :param engine: the engine that assembles the collage, one of ENGINES.
+        :param tex_format: pdflatex engine only: load the fixed preamble from a precompiled
+        format that is built once and cached.
+        :param page_index: Sizes of all pages of the pdf. If given, every layout uses
+        the size that most of its pages have instead of pagesize.
         """
         self.input_filepath = input_filepath
         self.number_of_pages = number_of_pages
         self.pagesize = pagesize
         self.layout = layout
         self.reverse_assembly = reverse_assembly
+        self.engine = engine
+        self.tex_format = tex_format
+        self.tex_format_path: Optional[pathlib.Path] = None
+        self.page_index = page_index
 
     def __repr__(self):
         return (
@@ -94,32 +113,246 @@ class NobuboInput:
             f"number_of_pages: '{self.number_of_pages}', "
             f"pagesize: '{self.pagesize}', "
             f"layout: '{self.layout}', "
-            f"reverse_assembly: '{self.reverse_assembly}'>"
+            f"reverse_assembly: '{self.reverse_assembly}', "
+            f"engine: '{self.engine}'>"
         )
 
-    def assemble_collage(self, temp_output_dir: pathlib.Path) -> List[pathlib.Path]:
+    def layout_pagesize(self, layout: Layout) -> PageSize:
+        """
+        :param layout: One of the layouts of the pdf.
+        :return: The size of a pattern page of the layout in user space units.
+        """
+        if self.page_index is None:
+            return self.pagesize
+        last_page = layout.first_page + layout.columns * layout.rows - 1
+        width, height = self.page_index.common_size(layout.first_page, last_page)
+        return PageSize(width=width, height=height)
+
+    def assemble_collage(
+        self,
+        temp_output_dir: pathlib.Path,
+        jobs: int = 1,
+        collage_cache: Optional[cache.CollageCache] = None,
+    ) -> List[pathlib.Path]:
         """
         Takes a pattern pdf where one page equals a part of the pattern and
         assembles it to one huge collage.
         The default assembles it from top left to the bottom right.
         :param temp_output_dir: The temporary path where all calculations should happen.
+        :param jobs: How many overviews are assembled at the same time.
+        :param collage_cache: Optional cache from which already assembled collages are taken.
         :return A list of all the path to the collages, each with all pattern pages
                 assembled on one single page.
 
         """
+        # every overview gets its own workspace, so that several can be assembled at once
+        workspaces: List[pathlib.Path] = []
+        for counter in range(len(self.layout)):
+            workspace = temp_output_dir / f"overview_{counter + 1}"
+            workspace.mkdir(exist_ok=True)
+            workspaces.append(workspace)
+
+        all_collages_paths: List[Optional[pathlib.Path]] = [None] * len(self.layout)
+        cache_keys: List[str] = []
+        if collage_cache is not None:
+            with profiling.stage("cache_lookup"):
+                input_hash = cache.file_hash(self.input_filepath)
+                for counter, current_layout in enumerate(self.layout):
+                    key = collage_cache.key(
+                        input_hash, current_layout, self.reverse_assembly, self.engine
+                    )
+                    cache_keys.append(key)
+                    all_collages_paths[counter] = collage_cache.get(key, workspaces[counter])
+                    if all_collages_paths[counter] is not None:
+                        logger.info(f"Taking overview {counter + 1} from the collage cache\n")
+        missing = [counter for counter, path in enumerate(all_collages_paths) if path is None]
+
+        if missing and self.engine == "pdflatex" and self.tex_format:
+            # built before the workers start, so that all of them can load it
+            with profiling.stage("tex_format"):
+                self.tex_format_path = texformat.ensure_format()
+
+        if jobs > 1 and len(missing) > 1:
+            assembled = self._assemble_parallel(workspaces, missing, jobs)
+        else:
+            assembled = []
+            for counter in missing:
+                logger.info(f"Assembling overview {counter + 1} of {len(self.layout)}\n")
+                logger.info("Creating collage...")
+                with profiling.stage("assemble", counter + 1):
+                    assembled.append(self._assemble(workspaces[counter], self.layout[counter]))
+
+        for counter, collage_path in zip(missing, assembled):
+            all_collages_paths[counter] = collage_path
+            if collage_cache is not None:
+                collage_cache.put(cache_keys[counter], collage_path)
+        if collage_cache is not None:
+            collage_cache.log_statistics()
+        return [path for path in all_collages_paths if path is not None]
+
+    def _assemble_parallel(
+        self, workspaces: List[pathlib.Path], overviews: List[int], jobs: int
+    ) -> List[pathlib.Path]:
+        workers = min(jobs, len(overviews))
+        logger.info(f"Assembling {len(overviews)} overviews with {workers} jobs\n")
         all_collages_paths: List[pathlib.Path] = []
-        for counter, current_layout in enumerate(self.layout):
-            logging.info(f"Assembling overview {counter + 1} of {len(self.layout)}\n")
-            logging.info("Creating collage...")
-            all_collages_paths.append(self._assemble(temp_output_dir, current_layout))
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                profiling.submit(
+                    executor,
+                    "assemble",
+                    counter + 1,
+                    self._assemble,
+                    workspaces[counter],
+                    self.layout[counter],
+                )
+                for counter in overviews
+            ]
+            # collect in submission order, so the collages keep the order of the overviews
+            for counter, future in zip(overviews, futures):
+                try:
+                    all_collages_paths.append(profiling.result(future))
+                except (errors.Error, concurrent.futures.process.BrokenProcessPool) as e:
+                    executor.shutdown(cancel_futures=True)
+                    raise errors.UsageError(
+                        f"Overview {counter + 1} of {len(self.layout)} could not be assembled:\n{e}"
+                    )
+                logger.info(f"Assembled overview {counter + 1} of {len(self.layout)}")
         return all_collages_paths
 
     def _assemble(self, temp_output_dir: pathlib.Path, current_layout: Layout) -> pathlib.Path:
-        collage_width = self.pagesize.width * current_layout.columns
-        collage_height = self.pagesize.height * current_layout.rows
+        check_page_range(current_layout, self.number_of_pages)
+        if self.engine == "pdflatex":
+            return self.assemble_with_pdflatex(temp_output_dir, current_layout)
+        return self.assemble_with_pikepdf(temp_output_dir, current_layout)
+
+    def assemble_with_pikepdf(
+        self, temp_output_dir: pathlib.Path, current_layout: Layout
+    ) -> pathlib.Path:
+        """
+        Assembles the collage without pdflatex and saves it.
+        :param temp_output_dir: The temporary path where the collage is saved.
+        :param current_layout: The layout of the pattern pages to assemble.
+        :return: The path to the collage.
+        """
+        output_path = temp_output_dir / f"output_{random_string()}.pdf"
+        try:
+            with pikepdf.open(self.input_filepath) as source:
+                collage = self.build_collage(source, current_layout)
+                with profiling.stage("save_collage"):
+                    collage.save(output_path)
+        except OSError as e:
+            raise errors.UsageError(f"An error occurred while assembling the collage:\n{e}")
+        return output_path
+
+    def build_collage(self, source: pikepdf.Pdf, current_layout: Layout) -> pikepdf.Pdf:
+        """
+        Assembles the collage in memory: every pattern page is turned into
+        a Form XObject and placed onto one single page with a translation matrix.
+        Blank pattern pages are left out, identical ones share one Form XObject.
+        The collage reads the streams of the pattern pages from source when it is
+        saved, so source must stay open until then.
+        :param source: The opened input pdf.
+        :param current_layout: The layout of the pattern pages to assemble.
+        :return: A pdf with the collage as its only page.
+        """
+        pagesize = self.layout_pagesize(current_layout)
+        collage = pikepdf.new()
+        collage_page = add_page(
+            collage, pagesize.width * current_layout.columns, pagesize.height * current_layout.rows
+        )
+        grid = page_grid(current_layout, self.reverse_assembly)
+        shared_pages = dedup.find_shared_pages(source, [number for number, _, _ in grid])
+        shared_pages.log()
+        formxs: Dict[int, pikepdf.Object] = {}
+        content: List[bytes] = []
+        for page_number, column, row in grid:
+            # blank pages are left out, repeated pages drawn with the first one
+            first = shared_pages.representatives[page_number]
+            if first is None:
+                continue
+            if first not in formxs:
+                formxs[first] = collage.copy_foreign(source.pages[first - 1].as_form_xobject())
+            cell = pikepdf.Rectangle(
+                column * pagesize.width,
+                row * pagesize.height,
+                (column + 1) * pagesize.width,
+                (row + 1) * pagesize.height,
+            )
+            content.append(place_form_xobject(collage_page, formxs[first], cell))
+        collage_page.obj.Contents = collage.make_stream(b"\n".join(content))
+        return collage
+
+    def open_collage(
+        self,
+        source: pikepdf.Pdf,
+        current_layout: Layout,
+        temp_output_dir: Optional[pathlib.Path],
+        stack: contextlib.ExitStack,
+    ) -> pikepdf.Pdf:
+        """
+        Assembles a collage and opens it: in memory with the pikepdf engine,
+        in a temporary directory with pdflatex.
+        :param source: The opened input pdf.
+        :param current_layout: The layout of the pattern pages to assemble.
+        :param temp_output_dir: Where pdflatex works, only needed for pdflatex.
+        :param stack: Keeps the collage of pdflatex open until it is closed.
+        :return: A pdf with the collage as its only page.
+        """
+        if self.engine != "pdflatex":
+            return self.build_collage(source, current_layout)
+        assert temp_output_dir is not None
+        if self.tex_format and self.tex_format_path is None:
+            with profiling.stage("tex_format"):
+                self.tex_format_path = texformat.ensure_format()
+        temp_output_dir.mkdir(parents=True, exist_ok=True)
+        collage_path = self.assemble_with_pdflatex(temp_output_dir, current_layout)
+        try:
+            return stack.enter_context(pikepdf.open(collage_path))
+        except (OSError, pikepdf.PdfError) as e:
+            raise errors.UsageError(f"Could not open the collage of pdflatex:\n{e}")
+
+    def assemble_with_pdflatex(
+        self, temp_output_dir: pathlib.Path, current_layout: Layout
+    ) -> pathlib.Path:
+        command, output_path = self.pdflatex_command(temp_output_dir, current_layout)
+        logger.debug("Sending command to pdflatex")
+        try:
+            with profiling.stage("pdflatex"):
+                subprocess.check_output(command, stderr=subprocess.STDOUT)
+        except subprocess.CalledProcessError as e:
+            raise errors.UsageError(
+                "Error: pdflatex encountered a problem while "
+                f"assembling the collage and had to abort:\n{e}"
+            )
+        except FileNotFoundError as e:
+            raise errors.UsageError(f"pdflatex or the output file was not found:\n{e}")
+        return output_path
+
+    def pdflatex_command(
+        self, temp_output_dir: pathlib.Path, current_layout: Layout
+    ) -> Tuple[List[str], pathlib.Path]:
+        """
+        Write the LaTeX file that assembles the collage of a layout with pdfpages.
+        :param temp_output_dir: The directory of the LaTeX file and the collage.
+        :param current_layout: The layout of the pattern pages to assemble.
+        :return: The pdflatex command to run, and the path of the collage it creates.
+        """
+        pagesize = self.layout_pagesize(current_layout)
+        collage_width = pagesize.width * current_layout.columns
+        collage_height = pagesize.height * current_layout.rows
+
+        input_filepath = self.input_filepath
+        if current_layout.columns * current_layout.rows < self.number_of_pages:
+            with profiling.stage("extract_pages"):
+                input_filepath = self.extract_pages(temp_output_dir, current_layout)
+            # the pattern pages are numbered from 1 in the extracted pdf
+            current_layout = Layout(
+                first_page=1, columns=current_layout.columns, rows=current_layout.rows
+            )
 
         if self.reverse_assembly:
-            logging.debug("Reverse assembly chosen")
+            logger.debug("Reverse assembly chosen")
             start, end, step = reverse_pagerange(current_layout)
             page_range_for_pdflatex = list(
                 reversed([(x, x + current_layout.columns - 1) for x in range(start, end, step)])
@@ -132,16 +365,23 @@ class NobuboInput:
             end = current_layout.first_page + end_of_section - 1
             page_range = f"{begin}-{end}"
 
+        if self.tex_format_path is not None:
+            # the precompiled format already contains the fixed preamble
+            preamble = [f"\\geometry{{papersize={{{collage_width}bp,{collage_height}bp}}}}\n"]
+        else:
+            preamble = [
+                "\\documentclass[a4paper,]{article}\n",
+                f"\\usepackage[papersize={{{collage_width}bp,{collage_height}bp}}]{{geometry}}\n",
+                "\\usepackage[utf8]{inputenc}\n",
+                "\\usepackage{pdfpages}\n",
+            ]
         file_content = [
             "\\batchmode\n",
-            "\\documentclass[a4paper,]{article}\n",
-            f"\\usepackage[papersize={{{collage_width}pt,{collage_height}pt}}]{{geometry}}\n",
-            "\\usepackage[utf8]{inputenc}\n",
-            "\\usepackage{pdfpages}\n",
+            *preamble,
             "\\begin{document}\n",
             f"\\includepdfmerge[nup={current_layout.columns}x{current_layout.rows}, "
             f"noautoscale=true, scale=1.0]"
-            f"{{{str(self.input_filepath)},{page_range} }}\n",
+            f"{{{str(input_filepath)},{page_range} }}\n",
             "\\end{document}\n",
         ]
 
@@ -153,24 +393,112 @@ class NobuboInput:
 
         command = [
             "pdflatex",
+            *([f"-fmt={self.tex_format_path}"] if self.tex_format_path is not None else []),
             "-interaction=nonstopmode",
             f"-jobname={output_filename}",
             f"-output-directory={temp_output_dir}",
             str(input_filepath),
         ]
 
-        logging.debug("Sending command to pdflatex")
+        return command, temp_output_dir / pathlib.Path(output_filename).with_suffix(".pdf")
+
+    def extract_pages(self, temp_output_dir: pathlib.Path, current_layout: Layout) -> pathlib.Path:
+        """
+        Copy the pattern pages of a layout into a slim pdf, so that pdflatex does not
+        parse the instructions and the other overviews. Resources that the pages share,
+        such as fonts, are copied once.
+        :param temp_output_dir: Where the slim pdf is saved.
+        :param current_layout: The layout whose pattern pages are copied.
+        :return: The path to the slim pdf.
+        """
+        last_page = current_layout.first_page + current_layout.columns * current_layout.rows - 1
+        output_path = temp_output_dir / f"pages_{random_string()}.pdf"
         try:
-            subprocess.check_output(command, stderr=subprocess.STDOUT)
-        except subprocess.CalledProcessError as e:
-            raise errors.UsageError(
-                "Error: pdflatex encountered a problem while "
-                f"assembling the collage and had to abort:\n{e}"
-            )
-        except FileNotFoundError as e:
-            raise errors.UsageError(f"pdflatex or the output file was not found:\n{e}")
+            with pikepdf.open(self.input_filepath) as source:
+                slim = pikepdf.new()
+                for page in source.pages[current_layout.first_page - 1 : last_page]:
+                    # links and article threads point to other pages, which would be
+                    # copied along with them, and pdfpages drops them anyway
+                    for key in ("/Annots", "/B"):
+                        if key in page.obj:
+                            del page.obj[key]
+                    slim.pages.append(page)
+                slim.save(output_path)
+        except OSError as e:
+            raise errors.UsageError(f"An error occurred while extracting the pattern pages:\n{e}")
+        return output_path
 
-        return temp_output_dir / pathlib.Path(output_filename).with_suffix(".pdf")
+
+def page_grid(layout: Layout, reverse_assembly: bool) -> List[Tuple[int, int, int]]:
+    """
+    Calculate where each pattern page of a layout lies on the collage.
+    :param layout: The layout of the pattern pages.
+    :param reverse_assembly: False: pages run from top left to bottom right,
+    True: pages run from bottom left to top right.
+    :return: A list of (page number, column, row), ordered like pdfpages places them:
+    from the top left to the bottom right of the collage. Row 0 is the bottom row
+    of the collage, since the pdf origin is at the bottom left.
+    """
+    grid: List[Tuple[int, int, int]] = []
+    for row in reversed(range(layout.rows)):
+        rows_before = row if reverse_assembly else layout.rows - 1 - row
+        for column in range(layout.columns):
+            grid.append((layout.first_page + rows_before * layout.columns + column, column, row))
+    return grid
+
+
+def add_page(pdf: pikepdf.Pdf, width: float, height: float) -> pikepdf.Page:
+    """
+    Append an empty page to a pdf. Unlike pikepdf's add_blank_page, this allows
+    pages larger than 14400 units (200 inches), which large collages need.
+    :param pdf: The pdf to which the page is appended.
+    :param width: Width of the page in user space units.
+    :param height: Height of the page in user space units.
+    :return: The new page.
+    """
+    page_dict = pikepdf.Dictionary(
+        Type=pikepdf.Name.Page,
+        MediaBox=[0, 0, width, height],
+        Contents=pdf.make_stream(b""),
+        Resources=pikepdf.Dictionary(),
+    )
+    pdf.pages.append(pikepdf.Page(page_dict))
+    return pdf.pages[-1]
+
+
+def place_form_xobject(page: pikepdf.Page, formx: pikepdf.Object, cell: pikepdf.Rectangle) -> bytes:
+    """
+    Add a Form XObject to the resources of a page and calculate the content stream
+    instructions that draw it into a cell of the page, unscaled.
+    :param page: The page that the Form XObject is placed on.
+    :param formx: The Form XObject, already part of the pdf that contains the page.
+    :param cell: The area on the page where the Form XObject is placed.
+    :return: The content stream instructions that draw the Form XObject.
+    """
+    name = page.add_resource(formx, pikepdf.Name.XObject, prefix="P")
+    return page.calc_form_xobject_placement(
+        formx,
+        name,
+        cell,
+        invert_transformations=True,
+        allow_shrink=False,
+        allow_expand=False,
+    )
+
+
+def check_page_range(layout: Layout, number_of_pages: int) -> None:
+    if layout.first_page < 1:
+        raise errors.UsageError(
+            f"The layout {layout.columns}x{layout.rows} starts at page {layout.first_page}, "
+            "but the pages of a pdf are numbered from 1."
+        )
+    last_page = layout.first_page + layout.columns * layout.rows - 1
+    if last_page > number_of_pages:
+        raise errors.UsageError(
+            f"The layout {layout.columns}x{layout.rows} starting at page {layout.first_page} "
+            f"needs pages {layout.first_page}-{last_page}, "
+            f"but the pdf only has {number_of_pages} pages."
+        )
 
 
 def reverse_pagerange(layout: Layout) -> Tuple[int, int, int]:
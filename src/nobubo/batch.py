@@ -0,0 +1,244 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Processes a manifest of many patterns with one worker pool.
+"""
+
+import concurrent.futures
+import csv
+import json
+import logging
+import pathlib
+import time
+import tomllib
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from nobubo import assembly, errors
+from nobubo.disassembly import SAVE_PRESETS
+from nobubo.init_nobubo import (
+    OUTPUT_LAYOUT_PATTERN,
+    parse_cli_input_data,
+    parse_cli_output_data,
+    parse_save_options,
+    run_conversion,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BatchJob:
+    """
+    One row of a manifest, with the same parameters as the nobubo command.
+    """
+
+    input_path: str
+    output_path: str
+    input_layout: Optional[List[Tuple[int, int, int]]]
+    output_layout: Optional[str] = None
+    print_margin: Optional[int] = None
+    reverse_assembly: bool = False
+    engine: str = "pikepdf"
+    save_preset: str = "default"
+
+
+@dataclass
+class BatchResult:
+    """
+    Outcome of one job of a manifest.
+    """
+
+    job_number: int
+    input_path: str
+    output_path: str
+    status: str
+    seconds: float
+    error: str = ""
+
+
+def read_manifest(manifest_path: pathlib.Path) -> List[BatchJob]:
+    """
+    Read the jobs of a manifest. Supported formats are csv, json and toml,
+    chosen by the file suffix. Relative paths are relative to the manifest.
+
+    csv: one row per job with the columns input, il, ol, margin, reverse, output
+    (and optionally engine and save). Several input layouts are separated by ";", e.g. "2 8 4; 35 7 3".
+    json: a list of jobs or an object with a "jobs" list, each job with the same keys.
+    il is either a string as in csv or a list of [first page, columns, rows].
+    In every format, il "auto" detects the input layouts from the pdf.
+    toml: one [[jobs]] table per job, with the same keys as json.
+    :param manifest_path: The path to the manifest.
+    :return: The jobs in the order of the manifest.
+    """
+    suffix = manifest_path.suffix.lower()
+    try:
+        if suffix == ".csv":
+            with manifest_path.open(newline="") as f:
+                rows: List[Dict[str, Any]] = list(csv.DictReader(f))
+        elif suffix == ".json":
+            with manifest_path.open() as f:
+                data = json.load(f)
+            rows = data["jobs"] if isinstance(data, dict) else data
+        elif suffix == ".toml":
+            with manifest_path.open("rb") as f:
+                rows = tomllib.load(f)["jobs"]
+        else:
+            raise errors.UsageError(
+                f"Unknown manifest format {suffix}. Use a csv, json or toml file."
+            )
+    except (OSError, KeyError, ValueError) as e:
+        raise errors.UsageError(f"While reading the manifest, this error occurred:\n{e}")
+
+    base_dir = manifest_path.parent
+    return [parse_job(row, number + 1, base_dir) for number, row in enumerate(rows)]
+
+
+def run_batch(jobs: List[BatchJob], workers: int) -> List[BatchResult]:
+    """
+    Runs all jobs on a bounded worker pool. A failing job does not stop the others.
+    :param jobs: The jobs of the manifest.
+    :param workers: The maximum number of jobs that run at the same time.
+    :return: The results in the order of the jobs.
+    """
+    results: List[BatchResult] = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_job, job, number + 1) for number, job in enumerate(jobs)]
+        for number, (job, future) in enumerate(zip(jobs, futures)):
+            try:
+                result = future.result()
+            except concurrent.futures.process.BrokenProcessPool as e:
+                result = BatchResult(
+                    job_number=number + 1,
+                    input_path=job.input_path,
+                    output_path=job.output_path,
+                    status="failed",
+                    seconds=0.0,
+                    error=f"The worker process died: {e}",
+                )
+            logger.info(
+                f"Job {result.job_number} of {len(jobs)}: {result.status} "
+                f"after {result.seconds:.2f}s ({result.input_path})"
+            )
+            results.append(result)
+    return results
+
+
+def run_job(job: BatchJob, job_number: int) -> BatchResult:
+    """
+    Runs a single job. All errors are caught and turned into a failed result.
+    :param job: The job to run.
+    :param job_number: The position of the job in the manifest.
+    :return: The result of the job.
+    """
+    start = time.perf_counter()
+    status, error = "ok", ""
+    try:
+        nobubo_input = parse_cli_input_data(
+            job.input_layout, job.reverse_assembly, job.input_path, job.engine
+        )
+        nobubo_output = parse_cli_output_data(
+            job.output_layout,
+            job.print_margin,
+            job.output_path,
+            parse_save_options(job.save_preset),
+        )
+        run_conversion(nobubo_input, nobubo_output)
+    except Exception as e:  # a single broken pattern must not stop the batch
+        status, error = "failed", str(e) or e.__class__.__name__
+    return BatchResult(
+        job_number=job_number,
+        input_path=job.input_path,
+        output_path=job.output_path,
+        status=status,
+        seconds=round(time.perf_counter() - start, 3),
+        error=error,
+    )
+
+
+def write_summary(results: List[BatchResult], summary_path: pathlib.Path) -> None:
+    try:
+        with summary_path.open("w") as f:
+            json.dump([asdict(result) for result in results], f, indent=2)
+    except OSError as e:
+        raise errors.UsageError(f"An error occurred while writing the summary:\n{e}")
+
+
+def format_summary(results: List[BatchResult]) -> str:
+    lines = [f"{'job':>4}  {'status':<6}  {'seconds':>8}  input"]
+    for result in results:
+        line = f"{result.job_number:>4}  {result.status:<6}  {result.seconds:>8.2f}  "
+        line += result.input_path
+        if result.error:
+            line += f"\n{'':>22}{result.error}"
+        lines.append(line)
+    failed = sum(1 for result in results if result.status != "ok")
+    lines.append(f"{len(results) - failed} of {len(results)} jobs succeeded.")
+    return "\n".join(lines)
+
+
+def parse_job(row: Dict[str, Any], job_number: int, base_dir: pathlib.Path) -> BatchJob:
+    """
+    Parse and validate one job of a manifest.
+    :param row: The keys input, il, ol, margin, reverse, output and optionally engine and save.
+    :param job_number: The position of the job, used in error messages.
+    :param base_dir: The directory that relative paths are relative to.
+    :return: The validated job.
+    """
+    try:
+        input_layout = _parse_input_layout(row["il"])
+        output_layout = row.get("ol") or None
+        if output_layout is not None and not OUTPUT_LAYOUT_PATTERN.match(str(output_layout)):
+            raise ValueError(f"output layout {output_layout} does not exist")
+        margin = row.get("margin")
+        engine = row.get("engine") or "pikepdf"
+        if engine not in assembly.ENGINES:
+            raise ValueError(f"engine {engine} does not exist")
+        save_preset = row.get("save") or "default"
+        if save_preset not in SAVE_PRESETS:
+            raise ValueError(f"save preset {save_preset} does not exist")
+        return BatchJob(
+            input_path=str(base_dir / row["input"]),
+            output_path=str(base_dir / row["output"]),
+            input_layout=input_layout,
+            output_layout=str(output_layout) if output_layout is not None else None,
+            print_margin=int(margin) if margin not in (None, "") else None,
+            reverse_assembly=_parse_bool(row.get("reverse", False)),
+            engine=engine,
+            save_preset=save_preset,
+        )
+    except (KeyError, TypeError, ValueError) as e:
+        raise errors.UsageError(f"Job {job_number} of the manifest is invalid: {e}")
+
+
+def _parse_input_layout(value: Any) -> Optional[List[Tuple[int, int, int]]]:
+    if isinstance(value, str) and value.strip().lower() == "auto":
+        return None  # detected from the pdf
+    if isinstance(value, str):
+        value = [part.split() for part in value.split(";") if part.strip()]
+    layouts = [tuple(int(number) for number in layout) for layout in value]
+    if not layouts or any(len(layout) != 3 for layout in layouts):
+        raise ValueError("il needs FIRSTPAGE COLUMNS ROWS for every overview")
+    return [(layout[0], layout[1], layout[2]) for layout in layouts]
+
+
+def _parse_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return bool(value)
@@ -0,0 +1,157 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+On-disk cache for assembled collages.
+"""
+
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+from typing import TYPE_CHECKING, Optional
+
+from nobubo import errors
+
+if TYPE_CHECKING:
+    from nobubo.assembly import Layout
+
+
+logger = logging.getLogger(__name__)
+
+# part of every key, increased whenever the assembly produces different collages,
+# e.g. since blank pattern pages are left out and repeated ones are shared
+CACHE_FORMAT = 2
+
+
+class CollageCache:
+    """
+    Stores assembled collages in a directory, keyed by the content of the input pdf
+    and the layout. The least recently used collages are removed
+    as soon as the cache grows beyond its maximum size.
+    """
+
+    def __init__(self, directory: pathlib.Path, max_size: int):
+        """
+        :param directory: The directory in which the collages are stored.
+        :param max_size: The maximum size of the cache in bytes.
+        """
+        self.directory = directory
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            raise errors.UsageError(f"Could not create the cache directory:\n{e}")
+
+    def __repr__(self):
+        return (
+            f"<class '{self.__class__.__name__}': "
+            f"directory: '{self.directory}', "
+            f"max_size: '{self.max_size}'>"
+        )
+
+    def key(self, input_hash: str, layout: "Layout", reverse_assembly: bool, engine: str) -> str:
+        """
+        :param input_hash: The content hash of the input pdf, see file_hash.
+        :param layout: The layout of the collage.
+        :param reverse_assembly: Whether the collage is assembled from the bottom left.
+        :param engine: The engine that assembles the collage.
+        :return: The key under which the collage is stored.
+        """
+        direction = "reverse" if reverse_assembly else "normal"
+        return (
+            f"v{CACHE_FORMAT}_{engine}_{input_hash}_"
+            f"{layout.first_page}-{layout.columns}-{layout.rows}_{direction}"
+        )
+
+    def get(self, key: str, destination: pathlib.Path) -> Optional[pathlib.Path]:
+        """
+        Copy a cached collage into the workspace of the current run.
+        :param key: The key of the collage.
+        :param destination: The directory into which the collage is copied.
+        :return: The path to the copied collage, or None if it is not cached.
+        """
+        cached = self._path(key)
+        try:
+            os.utime(cached)  # mark as recently used
+            collage_path = destination / cached.name
+            shutil.copyfile(cached, collage_path)
+        except OSError:
+            self.misses += 1
+            logger.debug(f"Collage cache miss for {key}")
+            return None
+        self.hits += 1
+        logger.debug(f"Collage cache hit for {key}")
+        return collage_path
+
+    def put(self, key: str, collage_path: pathlib.Path) -> None:
+        """
+        Store a collage and evict the least recently used collages if necessary.
+        :param key: The key of the collage.
+        :param collage_path: The path to the assembled collage.
+        """
+        cached = self._path(key)
+        partial = cached.with_suffix(".part")
+        try:
+            shutil.copyfile(collage_path, partial)
+            os.replace(partial, cached)
+        except OSError as e:
+            # a cache that cannot be written must not stop the conversion
+            logger.warning(f"Could not store the collage in the cache:\n{e}")
+            return
+        self._evict()
+
+    def log_statistics(self) -> None:
+        logger.info(f"Collage cache: {self.hits} hit(s), {self.misses} miss(es).")
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.directory / f"{key}.pdf"
+
+    def _evict(self) -> None:
+        entries = []
+        for path in self.directory.glob("*.pdf"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # removed in the meantime
+            entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logger.debug(f"Removing {path.name} from the collage cache")
+            path.unlink(missing_ok=True)
+            total_size -= size
+
+
+def file_hash(path: pathlib.Path) -> str:
+    """
+    Calculate the SHA-256 hash of a file's content.
+    :param path: The path to the file.
+    :return: The hexadecimal hash.
+    """
+    sha = hashlib.sha256()
+    try:
+        with path.open("rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(block)
+    except OSError as e:
+        raise errors.UsageError(f"While reading the input pdf file, this error occurred:\n{e}")
+    return sha.hexdigest()
@@ -15,53 +15,113 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
 import logging
+import os
 import pathlib
-import re
 import sys
 import tempfile
 from typing import List
 
 import click
 
-from nobubo import errors
-from nobubo.init_nobubo import parse_cli_input_data, parse_cli_output_data
+from nobubo import assembly, batch, cache, errors, plan, profiling, service
+from nobubo.disassembly import OBJECT_STREAM_MODES, ORIENTATIONS, SAVE_PRESETS
+from nobubo.init_nobubo import (
+    OUTPUT_LAYOUT_PATTERN,
+    parse_cli_input_data,
+    parse_cli_outputs,
+    parse_save_options,
+    run_conversion,
+)
 
 
 logger = logging.getLogger(__name__)
 
 
 def validate_output_layout(ctx, param, value):
-    p = re.compile(r"(a0)|(us)|(\d+[x]\d+)")
-    try:
-        assert value is None or p.match(value)
-        return value
-    except AssertionError:
-        raise click.BadParameter(
-            f"Output layout {value} does not exist. "
-            "Have you chosen a0, us or a custom layout, "
-            "such as 222x444?"
-        )
+    # --ol can be given several times, so value is a tuple of output layouts
+    for output_layout in value:
+        if not OUTPUT_LAYOUT_PATTERN.match(output_layout):
+            raise click.BadParameter(
+                f"Output layout {output_layout} does not exist. "
+                "Have you chosen a0, us or a custom layout, "
+                "such as 222x444?"
+            )
+    return value
+
+
+class DefaultCommandGroup(click.Group):
+    """
+    Group that runs the convert command if no other command is given,
+    so that `nobubo --il ... INPUT_PATH OUTPUT_PATH` keeps working.
+    """
+
+    default_command = "convert"
+
+    def parse_args(self, ctx, args):
+        if args and args[0] not in self.commands and args[0] not in ctx.help_option_names:
+            args = [self.default_command, *args]
+        return super().parse_args(ctx, args)
+
+
+class ConvertCommand(click.Command):
+    """
+    Command that accepts `--il auto` although --il otherwise takes three numbers:
+    it is turned into the hidden --auto-layout flag before parsing.
+    """
+
+    def parse_args(self, ctx, args):
+        rewritten: List[str] = []
+        for arg in args:
+            if arg == "auto" and rewritten and rewritten[-1] == "--il":
+                rewritten[-1] = "--auto-layout"
+            elif arg == "--il=auto":
+                rewritten.append("--auto-layout")
+            else:
+                rewritten.append(arg)
+        return super().parse_args(ctx, rewritten)
+
+
+@click.group(cls=DefaultCommandGroup)
+def main():
+    """
+    Creates a collage from digital pattern pages
+    and then chops it up into a desired output layout.
+
+    Without a command, the arguments are passed to the convert command:
+
+    $ nobubo --il 2 8 4 --ol a0 "myfolder/mypattern.pdf" "test_collage.pdf"
+
+    See the readme for further information: https://github.com/bytinbit/nobubo
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(message)s",
+    )
 
 
-@click.command()
+@main.command(cls=ConvertCommand)
 @click.option(
     "--il",
     "input_layout_cli",
     nargs=3,
     type=click.INT,
     multiple=True,
-    required=True,
-    help="Input layout of the pdf. Can be used multiple times.",
-    metavar="FIRSTPAGE COLUMNS ROWS",
+    help="Input layout of the pdf. Can be used multiple times. "
+    "`--il auto` detects the layouts from the page sizes, the overview sheets "
+    "and the labels of the pattern pages.",
+    metavar="FIRSTPAGE COLUMNS ROWS | auto",
 )
+@click.option("--auto-layout", "auto_layout", is_flag=True, hidden=True)
 @click.option(
     "--ol",
     "output_layout_cli",
     nargs=1,
     type=click.STRING,
+    multiple=True,
     callback=validate_output_layout,
     help="Output layout. Supported formats: a0, us, custom. No output "
-    "layout provided creates a huge collage.",
+    "layout provided creates a huge collage. Can be used multiple times, "
+    "the collage is then assembled once and chopped up into every output layout.",
     metavar="a0 | us | mmxmm",
 )
 @click.option(
@@ -69,7 +129,9 @@ def validate_output_layout(ctx, param, value):
     "print_margin",
     nargs=1,
     type=click.INT,
-    help="Define an optional print margin in mm.",
+    multiple=True,
+    help="Define an optional print margin in mm. "
+    "Give it once for all output layouts or once per --ol.",
     metavar="mm",
 )
 @click.option(
@@ -79,13 +141,174 @@ def validate_output_layout(ctx, param, value):
     help="With reverse flag: collage is assembled from bottom left to top right. "
     "No flag: collage is assembled from top left to bottom right. ",
 )
+@click.option(
+    "--engine",
+    "engine",
+    type=click.Choice(assembly.ENGINES),
+    default="pikepdf",
+    show_default=True,
+    help="Engine that assembles the collage. pikepdf needs no TeX installation, "
+    "pdflatex requires pdflatex and the pdfpages package.",
+)
+@click.option(
+    "--tex-format/--no-tex-format",
+    "tex_format",
+    default=True,
+    show_default=True,
+    help="pdflatex engine only: load the fixed preamble from a precompiled TeX format "
+    "that is built once and cached in the user cache directory.",
+)
+@click.option(
+    "--jobs",
+    "jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    show_default=True,
+    help="Number of overviews that are assembled, and of output layouts that are "
+    "written, at the same time. With one --ol, large collages are chopped up "
+    "by N processes.",
+    metavar="N",
+)
+@click.option(
+    "--direct",
+    "direct",
+    is_flag=True,
+    help="Build every output page directly from the pattern pages "
+    "without writing a collage first. Only used together with --ol.",
+)
+@click.option(
+    "--cache-dir",
+    "cache_dir",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    help="Directory in which assembled collages are cached and reused.",
+    metavar="PATH",
+)
+@click.option(
+    "--cache-size",
+    "cache_size",
+    type=click.IntRange(min=0),
+    default=500,
+    show_default=True,
+    help="Maximum size of the collage cache in MB.",
+    metavar="MB",
+)
+@click.option(
+    "--subset/--no-subset",
+    "subset",
+    default=False,
+    show_default=True,
+    help="Every output page only contains the pattern pages that are visible on it, "
+    "instead of the whole collage, cropped.",
+)
+@click.option(
+    "--orientation",
+    "orientation",
+    type=click.Choice(ORIENTATIONS),
+    default="given",
+    show_default=True,
+    help="best: turn all output pages by 90 degrees if fewer of them are needed. "
+    "mixed: turn the output pages row by row, whatever needs the fewest.",
+)
+@click.option(
+    "--pack",
+    "pack",
+    is_flag=True,
+    help="Put the partly filled output pages of all overviews together on shared sheets, "
+    "written to OUTPUT_PATH with _shared appended to the name.",
+)
+@click.option(
+    "--combine",
+    "combine",
+    is_flag=True,
+    help="Write all overviews to one pdf at OUTPUT_PATH, with a bookmark per overview, "
+    "instead of one pdf per overview.",
+)
+@click.option(
+    "--stream",
+    "stream",
+    type=click.IntRange(min=1),
+    help="Write every N output pages to their own pdf as soon as they are ready, "
+    "e.g. OUTPUT_PATH_1_sheet001.pdf, so that printing can start before the last "
+    "overview is done. Needs one --ol, --jobs, --direct and --cache-dir are not used.",
+    metavar="N",
+)
+@click.option(
+    "--save-preset",
+    "save_preset",
+    type=click.Choice(list(SAVE_PRESETS)),
+    default="default",
+    show_default=True,
+    help="How the output pdfs are saved. small: object streams and maximum compression, "
+    "for slow links. fast: no object streams and no extra compression.",
+)
+@click.option(
+    "--object-streams",
+    "object_streams",
+    type=click.Choice(list(OBJECT_STREAM_MODES)),
+    help="Preserve, disable or generate object streams. Overrides the preset.",
+)
+@click.option(
+    "--compression-level",
+    "compression_level",
+    type=click.IntRange(min=0, max=9),
+    help="Recompress all streams with this zlib level. Overrides the preset.",
+    metavar="0-9",
+)
+@click.option(
+    "--linearize/--no-linearize",
+    "linearize",
+    default=None,
+    help="Write linearized pdfs (fast web view), whose first page can be shown "
+    "before the whole file has arrived. Overrides the preset.",
+)
+@click.option(
+    "--plan",
+    "dry_run",
+    is_flag=True,
+    help="Only print the output sheets of every overview with their crop boxes, "
+    "coverage and estimated file size, without creating any file.",
+)
+@click.option(
+    "--plan-format",
+    "plan_format",
+    type=click.Choice(["text", "json"]),
+    default="text",
+    show_default=True,
+    help="Format of the plan printed by --plan.",
+)
+@click.option(
+    "--profile",
+    "profile_file",
+    type=click.File("w", lazy=True),
+    help="Write wall time, CPU time and peak memory of every stage as json to this file.",
+    metavar="PATH",
+)
 @click.argument("input_path", type=click.STRING)
 @click.argument("output_path", type=click.STRING)
-def main(
+def convert(
     input_layout_cli,
+    auto_layout,
     output_layout_cli,
     print_margin,
     reverse_assembly,
+    engine,
+    tex_format,
+    jobs,
+    direct,
+    cache_dir,
+    cache_size,
+    subset,
+    orientation,
+    pack,
+    combine,
+    stream,
+    save_preset,
+    object_streams,
+    compression_level,
+    linearize,
+    dry_run,
+    plan_format,
+    profile_file,
     input_path,
     output_path,
 ):
@@ -107,6 +330,9 @@ def main(
 
     $ nobubo --il 2 8 4 -il 35 7 3 --ol a0 "myfolder/mypattern.pdf" "test_collage.pdf"
 
+    With `--il auto`, nobubo detects the overviews itself and logs how sure it is.
+    Check the result with --plan before printing.
+
     See the readme for further information: https://github.com/bytinbit/nobubo
 
     Arguments:
@@ -116,25 +342,172 @@ def main(
     OUTPUT_PATH: Where the output should be saved.
 
     """
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(message)s",
-    )
+    if bool(input_layout_cli) == auto_layout:
+        raise click.UsageError("Give either --il FIRSTPAGE COLUMNS ROWS or --il auto.")
+    profiler = profiling.Profiler(enabled=profile_file is not None)
     try:
-        nobubo_input = parse_cli_input_data(input_layout_cli, reverse_assembly, input_path)
-        nobubo_output = parse_cli_output_data(output_layout_cli, print_margin, output_path)
-        with tempfile.TemporaryDirectory() as td:
-            temp_output_dir = pathlib.Path(td)
-            temp_collage_paths: List[pathlib.Path] = nobubo_input.assemble_collage(temp_output_dir)
-            logger.info(f"Successfully assembled collage from {input_path}.\n")
-            if nobubo_output.output_pagesize is not None:
-                nobubo_output.create_output_files(temp_collage_paths, nobubo_input)
-            else:  # default: no output_layout specified, print collage pdf
-                nobubo_output.write_collage(
-                    temp_collage_paths,
+        with profiler:
+            nobubo_input = parse_cli_input_data(
+                None if auto_layout else list(input_layout_cli),
+                reverse_assembly,
+                input_path,
+                engine,
+                tex_format,
+            )
+            save_options = parse_save_options(
+                save_preset, object_streams, compression_level, linearize
+            )
+            nobubo_outputs = parse_cli_outputs(
+                list(output_layout_cli),
+                list(print_margin),
+                output_path,
+                save_options,
+                subset,
+                orientation,
+                pack,
+                combine,
+            )
+            if dry_run:
+                plans = [
+                    overview_plan
+                    for nobubo_output in nobubo_outputs
+                    for overview_plan in plan.plan_conversion(nobubo_input, nobubo_output)
+                ]
+                print(
+                    plan.plans_as_json(plans) if plan_format == "json" else plan.format_plan(plans)
+                )
+                return
+            if stream:
+                if len(nobubo_outputs) != 1 or nobubo_outputs[0].output_pagesize is None:
+                    raise errors.UsageError("--stream needs exactly one output layout.")
+                # every batch is written and logged while it is handed out
+                for _ in nobubo_outputs[0].iter_sheets(nobubo_input, stream):
+                    pass
+            else:
+                collage_cache = (
+                    cache.CollageCache(cache_dir, cache_size * 1024 * 1024) if cache_dir else None
                 )
-            print("All done, enjoy your sewing! :)")
+                run_conversion(nobubo_input, nobubo_outputs, jobs, direct, collage_cache)
+        print("All done, enjoy your sewing! :)")
 
     except (errors.UsageError, click.BadParameter) as e:
         print(e)
         sys.exit(1)
+    finally:
+        # also written for failed conversions, to show the stage that failed
+        if profile_file is not None:
+            profiler.write_report(profile_file)
+
+
+@main.command(name="batch")
+@click.option(
+    "--workers",
+    "workers",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default="number of CPUs",
+    help="Maximum number of patterns that are processed at the same time.",
+    metavar="N",
+)
+@click.option(
+    "--summary",
+    "summary_path",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="Write the per-job summary as json to this file.",
+    metavar="PATH",
+)
+@click.argument("manifest_path", type=click.Path(dir_okay=False, path_type=pathlib.Path))
+def batch_command(workers, summary_path, manifest_path):
+    """
+    Processes many patterns listed in a manifest with one worker pool.
+
+    The manifest is a csv, json or toml file with one job per row:
+    input, il, ol, margin, reverse, output (and optionally engine).
+    Failing jobs do not stop the batch. A summary with status and timing
+    of every job is printed at the end.
+
+    Example manifest.csv:
+
+    \b
+    input,il,ol,margin,reverse,output
+    jacket.pdf,2 6 5,a0,,true,jacket_a0.pdf
+    dress.pdf,2 8 4; 35 7 3,us,10,false,dress_us.pdf
+
+    Arguments:
+
+    MANIFEST_PATH: Path to the manifest.
+    """
+    try:
+        jobs = batch.read_manifest(manifest_path)
+        logger.info(f"Processing {len(jobs)} job(s) with up to {workers} worker(s).\n")
+        results = batch.run_batch(jobs, workers)
+        print(batch.format_summary(results))
+        if summary_path is not None:
+            batch.write_summary(results, summary_path)
+        if any(result.status != "ok" for result in results):
+            sys.exit(1)
+    except errors.UsageError as e:
+        print(e)
+        sys.exit(1)
+
+
+@main.command(name="serve")
+@click.option("--host", "host", default="127.0.0.1", show_default=True, help="Host to listen on.")
+@click.option(
+    "--port", "port", type=click.IntRange(min=0), default=8090, show_default=True, help="Port."
+)
+@click.option(
+    "--socket",
+    "socket_path",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    help="Listen on this Unix socket instead of a TCP port.",
+    metavar="PATH",
+)
+@click.option(
+    "--workers",
+    "workers",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    show_default="number of CPUs",
+    help="Maximum number of jobs that run at the same time.",
+    metavar="N",
+)
+@click.option(
+    "--max-upload",
+    "max_upload",
+    type=click.IntRange(min=1),
+    default=512,
+    show_default=True,
+    help="Maximum size of an uploaded pdf in MB.",
+    metavar="MB",
+)
+def serve_command(host, port, socket_path, workers, max_upload):
+    """
+    Runs nobubo as a local service with a job queue.
+
+    Upload a pdf with the same parameters as the convert command:
+
+    \b
+    $ curl --data-binary @pattern.pdf "localhost:8090/jobs?il=2,8,4&ol=a0&reverse=true"
+    $ curl localhost:8090/jobs/ID
+    $ curl -o pattern_a0.pdf "localhost:8090/jobs/ID/result?file=1"
+    $ curl -X DELETE localhost:8090/jobs/ID
+    """
+    try:
+        with tempfile.TemporaryDirectory() as td:
+            queue = service.JobQueue(pathlib.Path(td), workers)
+            server = service.create_server(queue, max_upload * 1024 * 1024, host, port, socket_path)
+            logger.info(
+                f"Serving on {service.server_address(server)} with {workers} worker(s). "
+                "Stop with Ctrl+C."
+            )
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                logger.info("Shutting down...")
+            finally:
+                server.server_close()
+                queue.shutdown()
+    except errors.UsageError as e:
+        print(e)
+        sys.exit(1)
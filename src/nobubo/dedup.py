@@ -0,0 +1,255 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Merges identical objects in the contents and resources of the pages of a pdf, and finds
+blank and repeated pattern pages.
+
+Pages that are copied from several pdfs into one, e.g. the chunks of a
+parallel disassembly, bring their own copies of content streams, fonts, images and Form XObjects,
+even if the copies came from the same object originally. Two indirect objects
+are identical if they have the same type, the same dictionary and the same raw
+stream data, and if the objects they refer to are identical in turn.
+"""
+
+import hashlib
+import logging
+import re
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import pikepdf
+
+logger = logging.getLogger(__name__)
+
+ObjGen = Tuple[int, int]
+
+# keys that point back up the document tree instead of down into the resources
+_BACK_REFERENCES = {"/Parent", "/P"}
+
+# entries of a page that are merged, the copies of a page share its content streams
+_PAGE_KEYS = ("/Contents", "/Resources")
+
+# operators that paint something, a page without them is blank. Matches in strings
+# or inline images only make a blank page count as not blank.
+_PAINTING_OPERATOR = re.compile(
+    rb"(?:^|(?<=[\s()<>\[\]{}/%]))(?:f\*|B\*|b\*|sh|Do|Tj|TJ|EI|[SsfFBb'\"])(?=[\s()<>\[\]{}/%]|$)"
+)
+
+
+@dataclass
+class SharedPages:
+    """
+    The blank and repeated pages among the pattern pages of an overview.
+
+    representatives: For every pattern page number, the first page with the same
+    content, or None if the page is blank.
+    saved_bytes: The size of the content streams of the pages that are left out
+    or drawn with the Form XObject of an identical page.
+    """
+
+    representatives: Dict[int, Optional[int]]
+    saved_bytes: int
+
+    @property
+    def blank(self) -> int:
+        return sum(1 for first in self.representatives.values() if first is None)
+
+    @property
+    def repeated(self) -> int:
+        return sum(
+            1
+            for page_number, first in self.representatives.items()
+            if first is not None and first != page_number
+        )
+
+    def log(self) -> None:
+        if not self.blank and not self.repeated:
+            return
+        pages = len(self.representatives)
+        numbers = f"{min(self.representatives)}-{max(self.representatives)}"
+        logger.info(
+            f"Pattern pages {numbers}: {self.blank} blank pattern pages are left out, {self.repeated} "
+            f"repeat an earlier page. {pages - self.blank - self.repeated} Form XObjects "
+            f"are drawn instead of {pages}, {self.saved_bytes / 1024:.0f} kB of content less."
+        )
+
+
+def find_shared_pages(pdf: pikepdf.Pdf, page_numbers: Iterable[int]) -> SharedPages:
+    """
+    Compare pattern pages by their content, resources and page boxes.
+    :param pdf: The input pdf.
+    :param page_numbers: The 1-based numbers of the pattern pages.
+    :return: The blank pages and the first page with the same content of the others.
+    """
+    digests: Dict[ObjGen, bytes] = {}
+    # pages with the same content and boxes, with the digest of their resources once
+    # it is needed, so that the resources of unique pages, e.g. their images, are not read
+    candidates: Dict[bytes, List[Tuple[int, Optional[bytes]]]] = {}
+    representatives: Dict[int, Optional[int]] = {}
+    saved_bytes = 0
+    for page_number in page_numbers:
+        page = pdf.pages[page_number - 1]
+        content = _content(page)
+        if not _PAINTING_OPERATOR.search(content):
+            representatives[page_number] = None
+            saved_bytes += len(content)
+            continue
+        h = hashlib.sha256(content)
+        # the boxes and the rotation may be inherited from the page tree
+        for box in (page.mediabox, page.cropbox, page.trimbox):
+            h.update(box.unparse())
+        h.update(b"%d" % page.rotation)
+        same_content = candidates.setdefault(h.digest(), [])
+        representatives[page_number] = page_number
+        if not same_content:
+            same_content.append((page_number, None))
+            continue
+        resources = _resources_digest(page, digests)
+        for index, (first, first_resources) in enumerate(same_content):
+            if first_resources is None:
+                first_resources = _resources_digest(pdf.pages[first - 1], digests)
+                same_content[index] = (first, first_resources)
+            if first_resources == resources:
+                representatives[page_number] = first
+                saved_bytes += len(content)
+                break
+        else:
+            same_content.append((page_number, resources))
+    return SharedPages(representatives, saved_bytes)
+
+
+def _resources_digest(page: pikepdf.Page, digests: Dict[ObjGen, bytes]) -> bytes:
+    # the resources may be inherited from the page tree as well
+    return _describe(page.resources, digests, set()) + _describe(
+        page.obj.get("/Group"), digests, set()
+    )
+
+
+def _content(page: pikepdf.Page) -> bytes:
+    contents = page.obj.get("/Contents")
+    if contents is None:
+        return b""
+    streams = contents if isinstance(contents, pikepdf.Array) else [contents]
+    return b"\n".join(stream.read_bytes() for stream in streams)
+
+
+def deduplicate(pdf: pikepdf.Pdf) -> int:
+    """
+    Replace every object in the contents and resources of the pages by the first
+    identical object, so that it is saved only once.
+    :param pdf: The pdf, changed in place.
+    :return: The number of objects that were replaced.
+    """
+    digests: Dict[ObjGen, bytes] = {}
+    for page in pdf.pages:
+        for key in _PAGE_KEYS:
+            if key in page.obj:
+                _digest(page.obj[key], digests, set())
+
+    first: Dict[bytes, pikepdf.Object] = {}
+    replacements: Dict[ObjGen, pikepdf.Object] = {}
+    for objgen, digest in digests.items():
+        if digest in first:
+            replacements[objgen] = first[digest]
+        else:
+            first[digest] = pdf.get_object(objgen)
+    if replacements:
+        visited: Set[ObjGen] = set()
+        for page in pdf.pages:
+            for key in _PAGE_KEYS:
+                if key not in page.obj:
+                    continue
+                value = page.obj[key]
+                if value.is_indirect and value.objgen in replacements:
+                    page.obj[key] = replacements[value.objgen]
+                else:
+                    _replace(value, replacements, visited)
+    logger.debug(f"Replaced {len(replacements)} duplicate objects")
+    return len(replacements)
+
+
+def _digest(obj: pikepdf.Object, digests: Dict[ObjGen, bytes], pending: Set[ObjGen]) -> bytes:
+    # digests of the indirect objects are memoized, objects on a cycle are only
+    # identical to themselves
+    if obj.is_indirect:
+        objgen = obj.objgen
+        if objgen in digests:
+            return digests[objgen]
+        if objgen in pending:
+            return b"cycle %d %d" % objgen
+        pending.add(objgen)
+    h = hashlib.sha256()
+    if isinstance(obj, pikepdf.Array):
+        h.update(b"[")
+        for item in obj:
+            h.update(_describe(item, digests, pending))
+    elif isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+        h.update(b"stream<<" if isinstance(obj, pikepdf.Stream) else b"<<")
+        for key in sorted(obj.keys()):
+            if key in _BACK_REFERENCES or (key == "/Length" and isinstance(obj, pikepdf.Stream)):
+                continue
+            h.update(key.encode())
+            h.update(_describe(obj[key], digests, pending))
+        if isinstance(obj, pikepdf.Stream):
+            h.update(obj.read_raw_bytes())
+    else:
+        h.update(obj.unparse())
+    digest = h.digest()
+    if obj.is_indirect:
+        pending.discard(obj.objgen)
+        digests[obj.objgen] = digest
+    return digest
+
+
+def _describe(value: object, digests: Dict[ObjGen, bytes], pending: Set[ObjGen]) -> bytes:
+    # pikepdf hands out numbers and booleans as python objects
+    if isinstance(value, pikepdf.Object):
+        if value.is_indirect or isinstance(
+            value, (pikepdf.Array, pikepdf.Dictionary, pikepdf.Stream)
+        ):
+            return b"(" + _digest(value, digests, pending) + b")"
+        return value.unparse() + b" "
+    return repr(value).encode() + b" "
+
+
+def _replace(
+    obj: pikepdf.Object, replacements: Dict[ObjGen, pikepdf.Object], visited: Set[ObjGen]
+) -> None:
+    if obj.is_indirect:
+        if obj.objgen in visited:
+            return
+        visited.add(obj.objgen)
+    if isinstance(obj, pikepdf.Array):
+        for index, item in enumerate(obj):
+            if isinstance(item, pikepdf.Object) and item.is_indirect:
+                if item.objgen in replacements:
+                    obj[index] = replacements[item.objgen]
+                    continue
+            if isinstance(item, (pikepdf.Array, pikepdf.Dictionary, pikepdf.Stream)):
+                _replace(item, replacements, visited)
+    elif isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+        for key in list(obj.keys()):
+            if key in _BACK_REFERENCES:
+                continue
+            item = obj[key]
+            if isinstance(item, pikepdf.Object) and item.is_indirect:
+                if item.objgen in replacements:
+                    obj[key] = replacements[item.objgen]
+                    continue
+            if isinstance(item, (pikepdf.Array, pikepdf.Dictionary, pikepdf.Stream)):
+                _replace(item, replacements, visited)
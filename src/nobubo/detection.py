@@ -0,0 +1,404 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Detects the input layouts of a pattern pdf, so that --il can be left to nobubo.
+
+Pattern pages are found as runs of pages of the same size, separated by pages
+of a different size or by overview sheets. The columns and rows of a run are
+guessed from the grid of page numbers on the overview sheet in front of it and
+from grid labels such as "A1" or "B-3" on the pattern pages themselves.
+"""
+
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+import pikepdf
+
+from nobubo import geometry
+from nobubo.assembly import Layout
+
+logger = logging.getLogger(__name__)
+
+# a page number or grid label, e.g. "7", "12A", "A1", "B-3"
+LABEL_PATTERN = re.compile(r"^([A-Z]{0,2})[\s\-/.]?(\d{1,3})[\s\-/.]?([A-Z]{0,2})$")
+
+# an overview sheet shows at least this many distinct labels, including 1 and 2
+MIN_OVERVIEW_LABELS = 6
+
+# confidence that a candidate gets for a matching overview grid or grid labels,
+# on top of a small preference for square collages
+OVERVIEW_GRID_CONFIDENCE = 0.7
+PAGE_LABEL_CONFIDENCE = 0.7
+SHAPE_CONFIDENCE = 0.2
+
+
+@dataclass
+class TextChunk:
+    """
+    A piece of text shown on a page, with the position of its start in user space.
+    """
+
+    x: float
+    y: float
+    size: float
+    text: str
+
+
+@dataclass
+class LayoutCandidate:
+    """
+    A possible input layout for one run of pattern pages.
+
+    confidence: Between 0 and 1, higher is more likely.
+    reasons: What the confidence is based on.
+    """
+
+    layout: Layout
+    confidence: float
+    reasons: List[str] = field(default_factory=list)
+
+
+def detect_layouts(pdf: pikepdf.Pdf, page_index: geometry.PageIndex) -> List[List[LayoutCandidate]]:
+    """
+    Find the runs of pattern pages of a pdf and suggest layouts for each of them.
+    :param pdf: The input pdf.
+    :param page_index: The sizes of the pages of the pdf.
+    :return: One list of candidates per run of pattern pages, in page order,
+    each ranked by confidence with the most likely candidate first.
+    """
+    labels = [page_labels(page) for page in pdf.pages]
+    overviews = {
+        number for number, page_chunks in enumerate(labels, start=1) if _is_overview(page_chunks)
+    }
+    suggestions: List[List[LayoutCandidate]] = []
+    for first_page, last_page in _pattern_runs(page_index, overviews, labels):
+        overview_grid = None
+        if first_page - 1 in overviews:
+            overview_grid = grid_shape(labels[first_page - 2], last_page - first_page + 1)
+        label_grid = _label_grid(labels[first_page - 1 : last_page])
+        suggestions.append(
+            rank_candidates(first_page, last_page - first_page + 1, overview_grid, label_grid)
+        )
+    return suggestions
+
+
+def rank_candidates(
+    first_page: int,
+    pages: int,
+    overview_grid: Optional[Tuple[int, int]],
+    label_grid: Optional[Tuple[int, int]],
+) -> List[LayoutCandidate]:
+    """
+    Score every columns x rows split of a run of pattern pages.
+    :param first_page: The first pattern page of the run.
+    :param pages: The number of pattern pages in the run.
+    :param overview_grid: Columns and rows of the page numbers on the overview sheet, if any.
+    :param label_grid: Columns and rows given by grid labels on the pattern pages, if any.
+    :return: The candidates, most likely first.
+    """
+    candidates: List[LayoutCandidate] = []
+    for columns in range(1, pages + 1):
+        if pages % columns:
+            continue
+        rows = pages // columns
+        candidate = LayoutCandidate(
+            layout=Layout(first_page=first_page, columns=columns, rows=rows),
+            # a slight preference for square collages, then for landscape ones
+            confidence=SHAPE_CONFIDENCE * min(columns, rows) / max(columns, rows)
+            + (0.01 if columns >= rows else 0),
+        )
+        if overview_grid == (columns, rows):
+            candidate.confidence += OVERVIEW_GRID_CONFIDENCE
+            candidate.reasons.append("page numbers on the overview sheet")
+        if label_grid == (columns, rows):
+            candidate.confidence += PAGE_LABEL_CONFIDENCE
+            candidate.reasons.append("grid labels on the pattern pages")
+        candidate.confidence = round(min(candidate.confidence, 1.0), 2)
+        candidates.append(candidate)
+    return sorted(candidates, key=lambda candidate: -candidate.confidence)
+
+
+def best_layouts(pdf: pikepdf.Pdf, page_index: geometry.PageIndex) -> List[Layout]:
+    """
+    Detect the layouts of a pdf, log the ranked candidates and pick the most likely ones.
+    :return: The most likely layout of every run of pattern pages.
+    """
+    layouts: List[Layout] = []
+    for counter, candidates in enumerate(detect_layouts(pdf, page_index)):
+        best = candidates[0]
+        last_page = best.layout.first_page + best.layout.columns * best.layout.rows - 1
+        alternatives = ", ".join(
+            f"{candidate.layout.columns} x {candidate.layout.rows} ({candidate.confidence})"
+            for candidate in candidates[1:4]
+        )
+        logger.info(
+            f"Detected overview {counter + 1}: pages {best.layout.first_page}-{last_page} "
+            f"as {best.layout.columns} x {best.layout.rows} "
+            f"(confidence {best.confidence}"
+            f"{': ' + ', '.join(best.reasons) if best.reasons else ''})"
+            f"{'; alternatives: ' + alternatives if alternatives else ''}"
+        )
+        if not best.reasons:
+            logger.warning(
+                f"Overview {counter + 1}: the columns and rows are a guess, "
+                "check them with --plan or give --il explicitly."
+            )
+        layouts.append(best.layout)
+    return layouts
+
+
+def page_labels(page: pikepdf.Page) -> List[TextChunk]:
+    """
+    Find the page numbers and grid labels shown on a page.
+    :param page: A pdf page.
+    :return: The text chunks that look like a label.
+    """
+    return [chunk for chunk in page_text(page) if LABEL_PATTERN.match(chunk.text)]
+
+
+def page_text(page: pikepdf.Page) -> List[TextChunk]:
+    """
+    Read the text of a page with its position, without laying out glyphs:
+    text shown after one positioning operator is one chunk, and chunks that
+    follow each other closely on the same line are joined, so that "1" and "A"
+    placed separately become "1A".
+    :param page: A pdf page.
+    :return: The text chunks in the order of the content stream.
+    """
+    decoders: Dict[str, Dict[bytes, str]] = {}
+    fonts = page.resources.get("/Font", pikepdf.Dictionary())
+    chunks: List[TextChunk] = []
+    ctm = pikepdf.Matrix()
+    stack: List[pikepdf.Matrix] = []
+    line = text_matrix = pikepdf.Matrix()
+    leading = font_size = 0.0
+    decoder: Dict[bytes, str] = {}
+    positioned = True
+    try:
+        instructions = pikepdf.parse_content_stream(page, "q Q cm BT Tf Td TD Tm T* TL Tj TJ ' \"")
+    except pikepdf.PdfError:
+        return []
+    for instruction in instructions:
+        operands = instruction.operands
+        operator = str(instruction.operator)
+        if operator == "q":
+            stack.append(ctm)
+        elif operator == "Q":
+            ctm = stack.pop() if stack else pikepdf.Matrix()
+        elif operator == "cm":
+            ctm = pikepdf.Matrix(*(float(value) for value in operands)) @ ctm
+        elif operator == "BT":
+            line = text_matrix = pikepdf.Matrix()
+            positioned = True
+        elif operator == "Tf":
+            name = str(operands[0])
+            font_size = float(operands[1])
+            if name not in decoders:
+                decoders[name] = _decoder(fonts.get(name))
+            decoder = decoders[name]
+        elif operator == "TL":
+            leading = float(operands[0])
+        elif operator in ("Td", "TD", "Tm", "T*"):
+            if operator == "Tm":
+                line = pikepdf.Matrix(*(float(value) for value in operands))
+            else:
+                if operator == "T*":
+                    tx, ty = 0.0, -leading
+                else:
+                    tx, ty = float(operands[0]), float(operands[1])
+                if operator == "TD":
+                    leading = -ty
+                line = pikepdf.Matrix(1, 0, 0, 1, tx, ty) @ line
+            text_matrix = line
+            positioned = True
+        else:
+            if operator in ("'", '"'):
+                line = pikepdf.Matrix(1, 0, 0, 1, 0, -leading) @ line
+                text_matrix = line
+                positioned = True
+            shown = operands[-1]
+            strings = shown if isinstance(shown, pikepdf.Array) else [shown]
+            text = "".join(
+                _decode(bytes(string), decoder)
+                for string in strings
+                if isinstance(string, pikepdf.String)
+            )
+            if not positioned and chunks:
+                chunks[-1].text += text
+                continue
+            placement = text_matrix @ ctm
+            size = abs(font_size * (placement.d or placement.b)) or 1.0
+            chunks.append(TextChunk(x=placement.e, y=placement.f, size=size, text=text))
+            positioned = False
+    return _join_chunks(chunks)
+
+
+def grid_shape(labels: List[TextChunk], pages: int) -> Optional[Tuple[int, int]]:
+    """
+    Read the columns and rows of a pattern from the page numbers on its overview sheet.
+    :param labels: The labels on the overview sheet.
+    :param pages: The number of pattern pages that the overview belongs to.
+    :return: Columns and rows, or None if the labels do not form a grid of that size.
+    """
+    numbered: Dict[str, TextChunk] = {}
+    for chunk in labels:
+        number = _label_number(chunk.text)
+        if number is not None and 1 <= number <= pages:
+            numbered.setdefault(chunk.text, chunk)
+    if len(numbered) < MIN_OVERVIEW_LABELS:
+        return None
+    chunks = list(numbered.values())
+    tolerance = min(chunk.size for chunk in chunks)
+    columns = _clusters([chunk.x for chunk in chunks], tolerance)
+    rows = _clusters([chunk.y for chunk in chunks], tolerance)
+    if columns * rows != pages:
+        return None
+    return columns, rows
+
+
+def _is_overview(labels: List[TextChunk]) -> bool:
+    numbers = {_label_number(chunk.text) for chunk in labels}
+    distinct = {chunk.text for chunk in labels}
+    return len(distinct) >= MIN_OVERVIEW_LABELS and {1, 2} <= numbers
+
+
+def _pattern_runs(
+    page_index: geometry.PageIndex, overviews: Set[int], labels: List[List[TextChunk]]
+) -> List[Tuple[int, int]]:
+    # runs of at least two pages of the same size that are no overview sheets
+    runs: List[Tuple[int, int]] = []
+    first_page: Optional[int] = None
+    for number in range(1, len(page_index) + 2):
+        continues = (
+            first_page is not None
+            and number <= len(page_index)
+            and number not in overviews
+            and not page_index.differing_pages(number, number, page_index.size(first_page))
+        )
+        if continues:
+            continue
+        if first_page is not None and number - first_page >= 2:
+            runs.append(_trim_unlabeled(first_page, number - 1, labels))
+        first_page = number if number <= len(page_index) and number not in overviews else None
+    return runs
+
+
+def _trim_unlabeled(
+    first_page: int, last_page: int, labels: List[List[TextChunk]]
+) -> Tuple[int, int]:
+    # if most pages of a run carry a label, the unlabeled pages at its ends
+    # are instructions of the same size as the pattern pages
+    labeled = [number for number in range(first_page, last_page + 1) if labels[number - 1]]
+    if len(labeled) * 2 > last_page - first_page + 1:
+        return labeled[0], labeled[-1]
+    return first_page, last_page
+
+
+def _label_grid(labels: List[List[TextChunk]]) -> Optional[Tuple[int, int]]:
+    # labels like A1 ... C8 give the rows as letters and the columns as numbers
+    letters = set()
+    columns = 0
+    for page_labels in labels:
+        grid_labels = [
+            match
+            for match in (LABEL_PATTERN.match(chunk.text) for chunk in page_labels)
+            if match and bool(match.group(1)) != bool(match.group(3))
+        ]
+        if len(grid_labels) != 1:
+            return None
+        match = grid_labels[0]
+        letters.add(match.group(1) or match.group(3))
+        columns = max(columns, int(match.group(2)))
+    if len(letters) < 2 or len(letters) * columns != len(labels):
+        return None
+    return columns, len(letters)
+
+
+def _label_number(text: str) -> Optional[int]:
+    match = LABEL_PATTERN.match(text)
+    return int(match.group(2)) if match else None
+
+
+def _clusters(values: List[float], tolerance: float) -> int:
+    values = sorted(values)
+    return 1 + sum(1 for a, b in zip(values, values[1:]) if b - a > tolerance)
+
+
+def _join_chunks(chunks: List[TextChunk]) -> List[TextChunk]:
+    joined: List[TextChunk] = []
+    for chunk in chunks:
+        chunk.text = chunk.text.strip()
+        if not chunk.text:
+            continue
+        previous = joined[-1] if joined else None
+        if (
+            previous is not None
+            and abs(chunk.y - previous.y) < 0.2 * previous.size
+            and 0 < chunk.x - previous.x <= previous.size * len(previous.text)
+        ):
+            previous.text += chunk.text
+        else:
+            joined.append(chunk)
+    return joined
+
+
+def _decoder(font: Optional[pikepdf.Object]) -> Dict[bytes, str]:
+    # maps character codes to text via the ToUnicode CMap of a font, if it has one
+    if font is None or "/ToUnicode" not in font:
+        return {}
+    try:
+        cmap = font.ToUnicode.read_bytes().decode("latin-1")
+    except (pikepdf.PdfError, AttributeError):
+        return {}
+    mapping: Dict[bytes, str] = {}
+    for section in re.findall(r"beginbfchar(.*?)endbfchar", cmap, re.S):
+        for code, text in re.findall(r"<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]*)>", section):
+            mapping[bytes.fromhex(code)] = _utf16(text)
+    for section in re.findall(r"beginbfrange(.*?)endbfrange", cmap, re.S):
+        for start, end, text in re.findall(
+            r"<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]+)>\s*<([0-9A-Fa-f]+)>", section
+        ):
+            first, last, length = int(start, 16), int(end, 16), len(start) // 2
+            if len(text) > 4 and len(text) % 4:
+                continue  # not UTF-16
+            # the last UTF-16 code unit of the destination is incremented per code,
+            # e.g. <D835DC00> for the first code of a range of mathematical letters
+            head, unit = text[:-4], int(text[-4:], 16)
+            # the codes of a range only differ in their last byte, so a range has at
+            # most 256 of them, larger ones in broken CMaps are cut there
+            for offset in range(min(last - first, 255, 0xFFFF - unit) + 1):
+                decoded = _utf16(f"{head}{unit + offset:04x}")
+                if decoded:
+                    mapping[(first + offset).to_bytes(length, "big")] = decoded
+    return mapping
+
+
+def _decode(data: bytes, decoder: Dict[bytes, str]) -> str:
+    if not decoder:
+        return data.decode("latin-1")
+    width = len(next(iter(decoder)))
+    return "".join(decoder.get(data[i : i + width], "") for i in range(0, len(data), width))
+
+
+def _utf16(text: str) -> str:
+    try:
+        return bytes.fromhex(text).decode("utf-16-be")
+    except ValueError:
+        return ""
@@ -19,39 +19,298 @@
 Contains functions for various output layouts.
 """
 
+import array
+import concurrent.futures
+import contextlib
+import io
+import itertools
 import logging
 import math
 import pathlib
+import shutil
+import tempfile
+import threading
 from copy import copy
 from dataclasses import dataclass
-from typing import List, Tuple, Optional
+from typing import Any, BinaryIO, Dict, Generator, Iterable, Iterator, List, Tuple, Optional, Union
 
 import pikepdf
 
 from nobubo import errors
-from nobubo import assembly
+from nobubo import assembly, dedup, packing, profiling
 
 logger = logging.getLogger(__name__)
 
+# below this many output pages, starting worker processes takes longer than chopping
+PARALLEL_MIN_SHEETS = 200
+
 
 @dataclass
-class Point:
+class Factor:
     """
-    Point on a pdf page in user space units.
+    Factor class for multiplication.
     """
 
-    x: float
-    y: float
+    x: int
+    y: int
 
 
 @dataclass
-class Factor:
+class SaveOptions:
     """
-    Factor class for multiplication.
+    How the output pdfs are serialized.
+
+    object_streams: preserve, disable or generate object streams. Generated object
+    streams compress the pdf's objects, which makes files smaller.
+    compression_level: zlib level for compressed streams, 0-9, or None for zlib's default.
+    recompress: Recompress streams that are already compressed with the compression_level.
+    linearize: Write a linearized pdf ("fast web view"), whose first page can be
+    displayed before the whole file has been transferred.
     """
 
-    x: int
-    y: int
+    object_streams: str = "preserve"
+    compress_streams: bool = True
+    compression_level: Optional[int] = None
+    recompress: bool = False
+    linearize: bool = False
+
+    def save(self, pdf: pikepdf.Pdf, output_path: Union[pathlib.Path, BinaryIO]) -> None:
+        """
+        Save a pdf with these options. The compression level is a global setting of
+        qpdf, so saves that compress streams are serialized: a save in another thread,
+        e.g. of the library API, cannot change the level in the middle of this one.
+        :param pdf: The pdf to save.
+        :param output_path: A path or a binary stream.
+        """
+        if not self.compress_streams and not self.recompress:
+            self._save(pdf, output_path)
+            return
+        with _COMPRESSION_LOCK:
+            level = -1 if self.compression_level is None else self.compression_level
+            pikepdf.settings.set_flate_compression_level(level)  # type: ignore[arg-type]
+            try:
+                self._save(pdf, output_path)
+            finally:
+                # -1 is zlib's default level, which every other save expects
+                pikepdf.settings.set_flate_compression_level(-1)
+
+    def _save(self, pdf: pikepdf.Pdf, output_path: Union[pathlib.Path, BinaryIO]) -> None:
+        pdf.save(
+            output_path,
+            compress_streams=self.compress_streams,
+            object_stream_mode=OBJECT_STREAM_MODES[self.object_streams],
+            recompress_flate=self.recompress,
+            linearize=self.linearize,
+        )
+
+
+# held while a save uses qpdf's global compression level
+_COMPRESSION_LOCK = threading.Lock()
+
+
+OBJECT_STREAM_MODES = {
+    "preserve": pikepdf.ObjectStreamMode.preserve,
+    "disable": pikepdf.ObjectStreamMode.disable,
+    "generate": pikepdf.ObjectStreamMode.generate,
+}
+
+# small: for slow links to the printer, fast: for local printing
+SAVE_PRESETS = {
+    "default": SaveOptions(),
+    "small": SaveOptions(object_streams="generate", compression_level=9, recompress=True),
+    "fast": SaveOptions(object_streams="disable", compress_streams=False),
+}
+
+
+# given: the output pages as they are, best: all of them turned if that needs fewer,
+# mixed: every row of output pages turned or not, whatever needs the fewest
+ORIENTATIONS = ("given", "best", "mixed")
+
+
+class TilePlan:
+    """
+    The crop boxes of all output pages of one layout on its collage.
+
+    boxes: llx, lly, urx, ury of every output page, one after the other, ordered
+    row by row from the bottom left of the collage to the top right.
+    Output pages in the last column and row are smaller if the pattern pages
+    do not fill them.
+    bands: The n-up factor of every row of output pages from the bottom, and whether
+    the output pages of the row are turned by 90 degrees. The crop boxes of turned
+    output pages are landscape, the pages are not rotated in the output pdf.
+    rows: The number of rows of output pages.
+    turned: The indexes of the output pages that are turned.
+    given_sheets: The number of output pages in the given orientation, None if
+    a pattern page does not fit on it.
+    partial: The indexes of the output pages that the pattern pages do not fill,
+    in the last column and in the last row.
+    """
+
+    def __init__(
+        self,
+        layout: assembly.Layout,
+        input_pagesize: assembly.PageSize,
+        output_pagesize: assembly.PageSize,
+        orientation: str = "given",
+    ):
+        """
+        :param layout: The layout of the pattern pages on the collage.
+        :param input_pagesize: Size of a pattern page in user space units.
+        :param output_pagesize: Size of an output page in user space units.
+        :param orientation: One of ORIENTATIONS.
+        """
+        given = Factor(
+            x=int(output_pagesize.width // input_pagesize.width),
+            y=int(output_pagesize.height // input_pagesize.height),
+        )
+        options = [(given, False)]
+        if orientation != "given":
+            turned = Factor(
+                x=int(output_pagesize.height // input_pagesize.width),
+                y=int(output_pagesize.width // input_pagesize.height),
+            )
+            options.append((turned, True))
+        options = [(factor, turn) for factor, turn in options if factor.x >= 1 and factor.y >= 1]
+        if not options:
+            raise errors.UsageError(
+                "The output layout is smaller than a pattern page, "
+                "choose a larger output layout or a smaller margin."
+            )
+        self.given_sheets = (
+            _uniform_sheets(layout, given) if given.x >= 1 and given.y >= 1 else None
+        )
+        if orientation == "mixed":
+            self.bands = _row_bands(layout, options)
+        else:
+            # on a tie, the given orientation comes first
+            factor, turn = min(options, key=lambda option: _uniform_sheets(layout, option[0]))
+            self.bands = [(factor, turn)] * math.ceil(layout.rows / factor.y)
+        self.rows = len(self.bands)
+
+        self.boxes = array.array("d")
+        self.partial: List[int] = []
+        self.turned: List[int] = []
+        lly = 0
+        for factor, turn in self.bands:
+            columns = math.ceil(layout.columns / factor.x)
+            ury = min(lly + factor.y, layout.rows)
+            first = len(self.boxes) // 4
+            if turn:
+                self.turned.extend(range(first, first + columns))
+            if ury - lly < factor.y:
+                self.partial.extend(range(first, first + columns))
+            elif layout.columns % factor.x:
+                self.partial.append(first + columns - 1)
+            # borders between the output pages, the last one at the end of the collage
+            x_edges = array.array(
+                "d",
+                [
+                    min(column * factor.x, layout.columns) * input_pagesize.width
+                    for column in range(columns + 1)
+                ],
+            )
+            row = array.array("d", [0.0]) * (4 * columns)
+            row[0::4] = x_edges[:-1]
+            row[2::4] = x_edges[1:]
+            row[1::4] = array.array("d", [lly * input_pagesize.height]) * columns
+            row[3::4] = array.array("d", [ury * input_pagesize.height]) * columns
+            self.boxes.extend(row)
+            lly = ury
+
+    @property
+    def saved_sheets(self) -> int:
+        """
+        :return: How many output pages fewer than in the given orientation are needed.
+        """
+        return 0 if self.given_sheets is None else self.given_sheets - len(self)
+
+    def __len__(self) -> int:
+        return len(self.boxes) // 4
+
+    def __getitem__(self, index: int) -> Tuple[float, float, float, float]:
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+        start = 4 * (index % len(self))
+        llx, lly, urx, ury = self.boxes[start : start + 4]
+        return llx, lly, urx, ury
+
+    def __iter__(self) -> Iterator[Tuple[float, float, float, float]]:
+        return (self[index] for index in range(len(self)))
+
+    def __repr__(self):
+        return (
+            f"<class '{self.__class__.__name__}': "
+            f"bands: '{self.bands}', "
+            f"sheets: '{len(self)}', "
+            f"turned: '{len(self.turned)}'>"
+        )
+
+
+class CombinedOutput:
+    """
+    Collects the output pages of all overviews in one pdf, with a bookmark
+    at the first page of every overview.
+    """
+
+    def __init__(self):
+        self.pdf = pikepdf.new()
+        self.bookmarks: List[Tuple[str, int]] = []
+        # the added pages read their streams from the sources until the pdf is saved
+        self._sources: List[pikepdf.Pdf] = []
+
+    def __repr__(self):
+        return (
+            f"<class '{self.__class__.__name__}': "
+            f"pages: '{len(self.pdf.pages)}', "
+            f"bookmarks: '{len(self.bookmarks)}'>"
+        )
+
+    def add(self, title: str, pdf: pikepdf.Pdf) -> None:
+        """
+        Append all pages of a pdf under a new bookmark.
+        :param title: The title of the bookmark, e.g. Overview 1.
+        :param pdf: The pages, kept open until finish() is called.
+        """
+        if not pdf.pages:
+            return
+        self.bookmarks.append((title, len(self.pdf.pages)))
+        self.pdf.pages.extend(pdf.pages)
+        self._sources.append(pdf)
+
+    def finish(self) -> pikepdf.Pdf:
+        """
+        Store the resources that the overviews have in common, e.g. fonts and images,
+        only once, and add the bookmarks.
+        :return: The combined pdf, ready to write to disk.
+        """
+        with profiling.stage("deduplicate"):
+            merged = dedup.deduplicate(self.pdf)
+        logger.info(f"{merged} objects that several overviews share are stored only once.")
+        with self.pdf.open_outline() as outline:
+            outline.root.extend(
+                pikepdf.OutlineItem(title, page_number) for title, page_number in self.bookmarks
+            )
+        return self.pdf
+
+
+@dataclass
+class SheetBatch:
+    """
+    Output pages of an overview that are ready to be printed, see NobuboOutput.iter_sheets.
+
+    overview: The number of the overview, starting at 1.
+    first_sheet: The number of the first output page of the overview in this batch,
+    starting at 1.
+    sheets: How many output pages the batch has.
+    path: Where the batch was written, or the name it gets when data is kept in memory.
+    data: The pdf, if it is kept in memory instead of written to path.
+    """
+
+    overview: int
+    first_sheet: int
+    sheets: int
+    path: pathlib.Path
+    data: Optional[bytes] = None
 
 
 class NobuboOutput:
@@ -60,68 +319,378 @@ class NobuboOutput:
     the desired output pdf.
     """
 
-    def __init__(self, output_path: pathlib.Path, output_pagesize: Optional[assembly.PageSize]):
+    def __init__(
+        self,
+        output_path: pathlib.Path,
+        output_pagesize: Optional[assembly.PageSize],
+        save_options: Optional[SaveOptions] = None,
+        subset: bool = False,
+        orientation: str = "given",
+        pack: bool = False,
+        combine: bool = False,
+    ):
         """
         :param output_path: path where the output pdf should be saved.
         :param output_pagesize: The desired page size in user space units (can include
         user-defined print margin).
+        :param save_options: How the output pdfs are serialized, default: pikepdf's defaults.
+        :param subset: Every output page only contains the parts of the collage
+        that are visible on it, instead of the whole collage cropped.
+        :param orientation: Whether output pages may be turned to need fewer of them,
+        one of ORIENTATIONS.
+        :param pack: Move the partly filled output pages of all overviews onto shared
+        sheets, if that saves sheets.
+        :param combine: Write the output pages of all overviews to one pdf at output_path,
+        instead of one pdf per overview.
         """
         self.output_path = output_path
         self.output_pagesize = output_pagesize
+        self.save_options = save_options or SaveOptions()
+        self.subset = subset
+        self.orientation = orientation
+        self.pack = pack
+        self.combine = combine
 
     def __repr__(self):
         return (
             f"<class '{self.__class__.__name__}': "
             f"output_path: '{self.output_path}', "
-            f"output_pagesize: '{self.output_pagesize}'>"
+            f"output_pagesize: '{self.output_pagesize}', "
+            f"save_options: '{self.save_options}', "
+            f"subset: '{self.subset}', "
+            f"orientation: '{self.orientation}', "
+            f"pack: '{self.pack}', "
+            f"combine: '{self.combine}'>"
         )
 
+    def tile_plan(
+        self, current_layout: assembly.Layout, input_pagesize: assembly.PageSize
+    ) -> TilePlan:
+        """
+        :return: The output pages of a layout in the orientation of this output.
+        """
+        assert self.output_pagesize is not None
+        return TilePlan(current_layout, input_pagesize, self.output_pagesize, self.orientation)
+
+    def check_output_pagesize(self, input_properties: assembly.NobuboInput) -> None:
+        """
+        Checks before anything is assembled that the pages of every layout exist
+        and that an output page holds at least one of their pattern pages.
+        :param input_properties: The properties of the input pdf.
+        """
+        assert self.output_pagesize is not None
+        for layout in input_properties.layout:
+            assembly.check_page_range(layout, input_properties.number_of_pages)
+            self.tile_plan(layout, input_properties.layout_pagesize(layout))
+
     def create_output_files(
         self,
         temp_collage_paths: List[pathlib.Path],
         input_properties: assembly.NobuboInput,
+        jobs: int = 1,
     ) -> None:
-        for counter, collage_path in enumerate(temp_collage_paths):
+        """
+        Chops up every collage and writes the output files.
+        :param temp_collage_paths: The collages, one per overview.
+        :param input_properties: The properties of the input pdf.
+        :param jobs: How many worker processes share the output pages of a collage
+        with at least PARALLEL_MIN_SHEETS of them.
+        """
+        shared = self.shared_sheets(input_properties) if self.pack else None
+        combined = CombinedOutput() if self.combine else None
+        # the chunks of a parallel disassembly, and the outputs for the shared sheets
+        # and the combined pdf, are read until they are written
+        with contextlib.ExitStack() as stack:
+            for counter, collage_path in enumerate(temp_collage_paths):
+                layout = input_properties.layout[counter]
+                pagesize = input_properties.layout_pagesize(layout)
+                with profiling.stage("chop", counter + 1):
+                    sheets = len(self.tile_plan(layout, pagesize))
+                    if jobs > 1 and sheets >= PARALLEL_MIN_SHEETS:
+                        chopped_up_files = self._create_output_files_parallel(
+                            collage_path, pagesize, layout, jobs, stack
+                        )
+                    else:
+                        try:
+                            collage = stack.enter_context(pikepdf.Pdf.open(collage_path))
+                        except OSError as e:
+                            raise errors.UsageError(
+                                f"Could not open collage file for disassembly:\n{e}."
+                            )
+                        logger.debug("Chopping up collage")
+                        chopped_up_files = self.chop_collage(collage, pagesize, layout)
+                    logger.debug("Successfully chopped up the collage.\n")
+                self._write_output(chopped_up_files, counter, shared, combined)
+            self._finish_output(shared, combined)
+
+    def iter_sheets(
+        self, input_properties: assembly.NobuboInput, batch: int = 1, in_memory: bool = False
+    ) -> Generator[SheetBatch, None, None]:
+        """
+        Assembles and chops up one overview after the other and hands out every
+        batch of output pages as its own pdf as soon as it is created, so that printing
+        can start while the rest is still being produced. The collage is assembled
+        in memory with the pikepdf engine.
+        :param input_properties: The properties of the input pdf.
+        :param batch: How many output pages go into one pdf.
+        :param in_memory: Keep the pdfs as bytes instead of writing them to sheet_outputpath().
+        :return: The batches, in the order of the overviews and their output pages.
+        """
+        assert self.output_pagesize is not None
+        if self.pack or self.combine:
+            raise errors.UsageError(
+                "Output pages that are handed out as soon as they are ready "
+                "cannot be packed onto shared sheets or combined into one pdf."
+            )
+        self.check_output_pagesize(input_properties)
+        with contextlib.ExitStack() as stack:
             try:
-                collage = pikepdf.Pdf.open(collage_path)
+                source = stack.enter_context(pikepdf.open(input_properties.input_filepath))
             except OSError as e:
-                raise errors.UsageError(f"Could not open collage file for disassembly:\n{e}.")
-            new_outputpath = self.generate_new_outputpath(self.output_path, counter)
-            logger.debug("Chopping up collage")
-            chopped_up_files = self._create_output_files(
-                collage,
-                input_properties.pagesize,
-                input_properties.layout[counter],
-            )
-            logger.debug("Successfully chopped up the collage.\n")
-            self.write_chops(chopped_up_files, new_outputpath)
-            logger.info(f"Final pdf written to {new_outputpath}.\n")
+                raise errors.UsageError(f"Could not open input file for streaming:\n{e}.")
+            temp_output_dir = pathlib.Path(stack.enter_context(tempfile.TemporaryDirectory()))
+            for counter, layout in enumerate(input_properties.layout):
+                pagesize = input_properties.layout_pagesize(layout)
+                with profiling.stage("assemble", counter + 1):
+                    collage = input_properties.open_collage(
+                        source, layout, temp_output_dir / f"overview_{counter + 1}", stack
+                    )
+                tile_plan = self.tile_plan(layout, pagesize)
+                _log_saved_sheets(tile_plan)
+                pages = self._chop(collage, tile_plan, range(len(tile_plan)))
+                for start in range(0, len(tile_plan), batch):
+                    with profiling.stage("chop", counter + 1):
+                        output = pikepdf.new()
+                        for page in itertools.islice(pages, batch):
+                            output.pages.append(page)
+                    yield self._write_batch(output, counter, start, in_memory)
+
+    def _write_batch(
+        self, pdf: pikepdf.Pdf, counter: int, start: int, in_memory: bool
+    ) -> SheetBatch:
+        path = self.sheet_outputpath(counter, start)
+        sheet_batch = SheetBatch(counter + 1, start + 1, len(pdf.pages), path)
+        numbers = f"{start + 1}-{start + len(pdf.pages)}" if len(pdf.pages) > 1 else f"{start + 1}"
+        with profiling.stage("write", counter + 1):
+            if in_memory:
+                stream = io.BytesIO()
+                self.save_options.save(pdf, stream)
+                sheet_batch.data = stream.getvalue()
+                logger.info(f"Output pages {numbers} of overview {counter + 1} are ready.")
+            else:
+                try:
+                    self.save_options.save(pdf, path)
+                except OSError as e:
+                    raise errors.UsageError(
+                        f"An error occurred while writing the output file:\n{e}"
+                    )
+                logger.info(f"Output pages {numbers} of overview {counter + 1} written to {path}.")
+        return sheet_batch
+
+    def create_direct_output_files(self, input_properties: assembly.NobuboInput) -> None:
+        """
+        Creates the output files without assembling a collage first: every output page
+        is built from the pattern pages that lie on it.
+        :param input_properties: The properties of the input pdf.
+        """
+        shared = self.shared_sheets(input_properties) if self.pack else None
+        combined = CombinedOutput() if self.combine else None
+        try:
+            with pikepdf.open(input_properties.input_filepath) as source:
+                for counter, current_layout in enumerate(input_properties.layout):
+                    assembly.check_page_range(current_layout, input_properties.number_of_pages)
+                    logger.debug("Tiling pattern pages directly")
+                    with profiling.stage("tile", counter + 1):
+                        tiled_files = self.tile_overview(
+                            source,
+                            input_properties.layout_pagesize(current_layout),
+                            current_layout,
+                            input_properties.reverse_assembly,
+                        )
+                    self._write_output(tiled_files, counter, shared, combined)
+                self._finish_output(shared, combined)
+        except OSError as e:
+            raise errors.UsageError(f"Could not open input file for direct tiling:\n{e}.")
 
-    def write_chops(self, collage: pikepdf.Pdf, output_path: pathlib.Path) -> None:
+    def shared_sheets(
+        self, input_properties: assembly.NobuboInput
+    ) -> Optional[packing.SharedSheets]:
+        """
+        Pack the partly filled output pages of all overviews onto shared sheets.
+        :param input_properties: The properties of the input pdf.
+        :return: The shared sheets, None if they do not save any sheet.
+        """
+        assert self.output_pagesize is not None
+        pieces: List[packing.Piece] = []
+        for counter, layout in enumerate(input_properties.layout):
+            tile_plan = self.tile_plan(layout, input_properties.layout_pagesize(layout))
+            for index in tile_plan.partial:
+                llx, lly, urx, ury = tile_plan[index]
+                pieces.append(packing.Piece(counter, index, urx - llx, ury - lly))
+        shared = packing.SharedSheets(packing.pack(pieces, self.output_pagesize))
+        saved = len(shared.placements) - len(shared)
+        if saved <= 0:
+            logger.info("Packing the partly filled output pages saves no sheets.")
+            return None
+        logger.info(
+            f"Packing {len(shared.placements)} partly filled output pages "
+            f"onto {len(shared)} shared sheets saves {saved} sheets."
+        )
+        return shared
+
+    def written_paths(self, overviews: int) -> List[pathlib.Path]:
+        """
+        :param overviews: The number of overviews.
+        :return: The files that the output pages of the overviews are written to.
+        """
+        if self.combine:
+            return [self.output_path]
+        paths = [
+            self.generate_new_outputpath(self.output_path, counter) for counter in range(overviews)
+        ]
+        if self.pack:
+            # not every overview keeps pages of its own, and packing may save nothing
+            paths = [path for path in [*paths, self.shared_outputpath()] if path.exists()]
+        return paths
+
+    def sheet_outputpath(self, counter: int, start: int) -> pathlib.Path:
+        """
+        :param counter: The index of the overview.
+        :param start: The index of the first output page in the file.
+        :return: The file of a batch of output pages, e.g. pattern_1_sheet001.pdf.
+        """
+        return self.output_path.with_name(
+            f"{self.output_path.stem}_{counter + 1}_sheet{start + 1:03d}{self.output_path.suffix}"
+        )
+
+    def shared_outputpath(self) -> pathlib.Path:
+        return self.output_path.with_name(
+            f"{self.output_path.stem}_shared{self.output_path.suffix}"
+        )
+
+    def _write_output(
+        self,
+        pdf: pikepdf.Pdf,
+        counter: int,
+        shared: Optional[packing.SharedSheets],
+        combined: Optional[CombinedOutput],
+    ) -> None:
+        new_outputpath = self.generate_new_outputpath(self.output_path, counter)
+        if shared is not None:
+            shared.take(counter, pdf)
+            if not pdf.pages:
+                logger.info(f"All output pages of overview {counter + 1} are on shared sheets.")
+                return
+        if combined is not None:
+            combined.add(f"Overview {counter + 1}", pdf)
+            return
+        with profiling.stage("write", counter + 1):
+            self.write_chops(pdf, new_outputpath)
+        logger.info(f"Final pdf written to {new_outputpath}.\n")
+
+    def _finish_output(
+        self, shared: Optional[packing.SharedSheets], combined: Optional[CombinedOutput]
+    ) -> None:
+        # writes the shared sheets and the combined pdf, if there are any
+        if shared is not None:
+            if combined is not None:
+                combined.add("Shared sheets", shared.build())
+            else:
+                output_path = self.shared_outputpath()
+                with profiling.stage("write_shared"):
+                    self.write_chops(shared.build(), output_path)
+                logger.info(f"Shared sheets written to {output_path}.\n")
+        if combined is not None:
+            self._write_combined(combined)
+
+    def _write_combined(self, combined: CombinedOutput) -> None:
+        pdf = combined.finish()
+        with profiling.stage("write_combined"):
+            self.write_chops(pdf, self.output_path)
+        logger.info(
+            f"Final pdf with {len(combined.bookmarks)} parts written to {self.output_path}.\n"
+        )
+
+    def write_chops(self, collage: pikepdf.Pdf, output_path: Union[pathlib.Path, BinaryIO]) -> None:
+        """
+        Save a pdf with the save options of this output.
+        :param collage: The pdf, e.g. the output pages of chop_collage() or tile_overview().
+        :param output_path: A path or a binary stream, the pdf is saved straight to it.
+        """
         logger.info("Writing files...")
         try:
-            collage.save(output_path)
+            self.save_options.save(collage, output_path)
         except OSError as e:
             raise errors.UsageError(f"An error occurred while writing the output file:\n{e}")
 
+    def write_assembled_collages(self, input_properties: assembly.NobuboInput) -> None:
+        """
+        Assembles the collages of the pikepdf engine in memory and saves them straight
+        to the output files, without a temporary collage in between.
+        :param input_properties: The properties of the input pdf.
+        """
+        combined = CombinedOutput() if self.combine else None
+        try:
+            with pikepdf.open(input_properties.input_filepath) as source:
+                for counter, current_layout in enumerate(input_properties.layout):
+                    assembly.check_page_range(current_layout, input_properties.number_of_pages)
+                    logger.info(
+                        f"Assembling overview {counter + 1} of {len(input_properties.layout)}\n"
+                    )
+                    with profiling.stage("assemble", counter + 1):
+                        collage = input_properties.build_collage(source, current_layout)
+                    if combined is not None:
+                        combined.add(f"Overview {counter + 1}", collage)
+                        continue
+                    new_outputpath = self.generate_new_outputpath(self.output_path, counter)
+                    with profiling.stage("write_collage", counter + 1):
+                        self.write_chops(collage, new_outputpath)
+                    logger.info(f"Collage written to {new_outputpath}.")
+                if combined is not None:
+                    self._write_combined(combined)
+        except OSError as e:
+            raise errors.UsageError(f"Could not open input file for assembly:\n{e}.")
+
     def write_collage(
         self,
         temp_collage_paths: List[pathlib.Path],
     ) -> None:
+        """
+        Writes collages that were assembled into temporary files, e.g. by pdflatex.
+        :param temp_collage_paths: The collages, one per overview. They are moved
+        to the output files if they need not be saved again.
+        """
+        if self.combine:
+            combined = CombinedOutput()
+            try:
+                with contextlib.ExitStack() as stack:
+                    for counter, collage_path in enumerate(temp_collage_paths):
+                        collage = stack.enter_context(pikepdf.Pdf.open(collage_path))
+                        combined.add(f"Overview {counter + 1}", collage)
+                    self._write_combined(combined)
+            except OSError as e:
+                raise errors.UsageError(f"An error occurred while writing the collage:\n{e}")
+            return
         for counter, collage_path in enumerate(temp_collage_paths):
             new_outputpath = self.generate_new_outputpath(self.output_path, counter)
             try:
-                temp_collage = pikepdf.Pdf.open(collage_path)
-                temp_collage.save(new_outputpath)
+                with profiling.stage("write_collage", counter + 1):
+                    if self.save_options == SaveOptions():
+                        # the collage was saved with the default options already
+                        shutil.move(collage_path, new_outputpath)
+                    else:
+                        with pikepdf.Pdf.open(collage_path) as temp_collage:
+                            self.save_options.save(temp_collage, new_outputpath)
             except OSError as e:
                 raise errors.UsageError(f"An error occurred while writing the collage:\n{e}")
             logger.info(f"Collage written to {new_outputpath}.")
 
-    def _create_output_files(
+    def chop_collage(
         self,
         collage: pikepdf.Pdf,
         input_pagesize: assembly.PageSize,
         current_layout: assembly.Layout,
+        sheets: Optional[range] = None,
     ) -> pikepdf.Pdf:
         """
         Chops up the collage that consists of all the pattern pages to individual pages
@@ -129,41 +698,181 @@ class NobuboOutput:
         :param collage: One pdf page that contains all assembled pattern pages.
         :param input_pagesize: size of an input pdf page
         :param current_layout: the current layout of the input pdf
+        :param sheets: Only create these output pages, default: all of them.
         :return: The pdf with several pages, ready to write to disk.
         """
         logger.info("Using collage to create desired output layout")
         assert self.output_pagesize is not None
-        n_up_factor = self.nup_factors(input_pagesize, self.output_pagesize)
         # only two points are needed to be cropped,
         # lower left (x, y) and upper right (x, y)
-        lowerleft_factor = Factor(x=0, y=0)
-        upperright_factor = Factor(x=1, y=1)
-
+        tile_plan = self.tile_plan(current_layout, input_pagesize)
+        if sheets is None:
+            _log_saved_sheets(tile_plan)
         output = pikepdf.new()
+        for page in self._chop(
+            collage, tile_plan, sheets if sheets is not None else range(len(tile_plan))
+        ):
+            output.pages.append(page)
+        return output
+
+    def _chop(
+        self, collage: pikepdf.Pdf, tile_plan: TilePlan, sheets: Iterable[int]
+    ) -> Iterator[pikepdf.Page]:
+        """
+        Crops a copy of the collage page to every given output page, one at a time.
+        :param collage: One pdf page that contains all assembled pattern pages.
+        :param tile_plan: The output pages of the collage.
+        :param sheets: The indexes of the output pages in the tile plan.
+        :return: The output pages, not yet added to any pdf.
+        """
         # pdfstitcher made me aware of pikepdf and provided some hints
         # on how to use it, thanks!
         # https://github.com/cfcurtis/pdfstitcher
-
-        for i in range(0, self.pages_needed(current_layout, n_up_factor)):
+        groups = _content_groups(collage.pages[0]) if self.subset else []
+        resources = list(collage.pages[0].resources.items())
+        for index in sheets:
+            box = tile_plan[index]
             page = copy(collage.pages[0])
+            page.CropBox = list(box)
+            if self.subset:
+                _subset_content(collage, page, groups, box, resources)
+            yield page
 
-            lowerleft: Point = _calculate_lowerleft_point(
-                lowerleft_factor, n_up_factor, input_pagesize
-            )
-            upperright: Point = _calculate_upperright_point(
-                upperright_factor, n_up_factor, current_layout, input_pagesize
-            )
+    def _create_output_files_parallel(
+        self,
+        collage_path: pathlib.Path,
+        input_pagesize: assembly.PageSize,
+        current_layout: assembly.Layout,
+        jobs: int,
+        stack: contextlib.ExitStack,
+    ) -> pikepdf.Pdf:
+        """
+        Chops up the collage like chop_collage, but every worker process
+        creates a consecutive chunk of the output pages and saves it. The chunks
+        are merged in order, and the objects that every chunk copied from
+        the collage, e.g. the pattern pages and their fonts, are merged again.
+        :param collage_path: The collage.
+        :param input_pagesize: size of an input pdf page
+        :param current_layout: the current layout of the input pdf
+        :param jobs: The number of worker processes.
+        :param stack: Keeps the chunks open, pikepdf reads their streams when
+        the merged pdf is saved.
+        :return: The merged pdf, ready to write to disk.
+        """
+        tile_plan = self.tile_plan(current_layout, input_pagesize)
+        _log_saved_sheets(tile_plan)
+        sheets = len(tile_plan)
+        workers = min(jobs, sheets)
+        logger.info(f"Chopping up the collage into {sheets} pages with {workers} jobs")
+        chunk_dir = pathlib.Path(stack.enter_context(tempfile.TemporaryDirectory()))
+        bounds = [sheets * worker // workers for worker in range(workers + 1)]
+        chunks = [
+            (range(start, stop), chunk_dir / f"chunk_{number + 1}.pdf")
+            for number, (start, stop) in enumerate(zip(bounds, bounds[1:]))
+        ]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                profiling.submit(
+                    executor,
+                    "chop_chunk",
+                    None,
+                    self._chop_chunk,
+                    collage_path,
+                    input_pagesize,
+                    current_layout,
+                    chunk_sheets,
+                    chunk_path,
+                )
+                for chunk_sheets, chunk_path in chunks
+            ]
+            for (chunk_sheets, _), future in zip(chunks, futures):
+                try:
+                    profiling.result(future)
+                except (errors.Error, concurrent.futures.process.BrokenProcessPool) as e:
+                    executor.shutdown(cancel_futures=True)
+                    raise errors.UsageError(
+                        f"Output pages {chunk_sheets.start + 1} to {chunk_sheets.stop} "
+                        f"could not be created:\n{e}"
+                    )
 
-            # adjust multiplying factor
-            colsleft = _calculate_colsrows_left(
-                current_layout.columns, upperright_factor.x, n_up_factor.x
-            )
-            lowerleft_factor, upperright_factor = _adjust_factors(
-                lowerleft_factor, upperright_factor, colsleft
-            )
+        output = pikepdf.new()
+        with profiling.stage("merge_chunks"):
+            for _, chunk_path in chunks:
+                chunk = stack.enter_context(pikepdf.open(chunk_path))
+                output.pages.extend(chunk.pages)
+            merged = dedup.deduplicate(output)
+        logger.debug(f"Merged {len(chunks)} chunks, {merged} shared objects were duplicates")
+        return output
 
-            page.CropBox = [lowerleft.x, lowerleft.y, upperright.x, upperright.y]
-            output.pages.append(page)
+    def _chop_chunk(
+        self,
+        collage_path: pathlib.Path,
+        input_pagesize: assembly.PageSize,
+        current_layout: assembly.Layout,
+        sheets: range,
+        chunk_path: pathlib.Path,
+    ) -> pathlib.Path:
+        # runs in a worker process. The streams are written as they are, the final
+        # save compresses them in the same way as for a sequential disassembly.
+        try:
+            with pikepdf.Pdf.open(collage_path) as collage:
+                chunk = self.chop_collage(collage, input_pagesize, current_layout, sheets)
+                chunk.save(
+                    chunk_path,
+                    compress_streams=False,
+                    stream_decode_level=pikepdf.StreamDecodeLevel.none,
+                    object_stream_mode=pikepdf.ObjectStreamMode.disable,
+                )
+        except OSError as e:
+            raise errors.UsageError(f"Could not chop up the collage:\n{e}.")
+        return chunk_path
+
+    def tile_overview(
+        self,
+        source: pikepdf.Pdf,
+        input_pagesize: assembly.PageSize,
+        current_layout: assembly.Layout,
+        reverse_assembly: bool,
+    ) -> pikepdf.Pdf:
+        """
+        Builds the pages of the desired output size directly from the pattern pages,
+        using the same tiles as chop_collage would crop from the collage.
+        :param source: The input pdf.
+        :param input_pagesize: size of an input pdf page
+        :param current_layout: the current layout of the input pdf
+        :param reverse_assembly: whether the pattern is assembled from the bottom left
+        :return: The pdf with several pages, ready to write to disk.
+        """
+        logger.info("Using pattern pages to create desired output layout")
+        assert self.output_pagesize is not None
+        tile_plan = self.tile_plan(current_layout, input_pagesize)
+        _log_saved_sheets(tile_plan)
+        grid = assembly.page_grid(current_layout, reverse_assembly)
+        shared_pages = dedup.find_shared_pages(source, [number for number, _, _ in grid])
+        shared_pages.log()
+        formxs: Dict[int, pikepdf.Object] = {}
+
+        output = pikepdf.new()
+        for llx, lly, urx, ury in tile_plan:
+            output.add_blank_page(page_size=(urx - llx, ury - lly))
+            page = output.pages[-1]
+            content: List[bytes] = []
+            for page_number, column, row in grid:
+                # position of the pattern page relative to the lower left of the tile
+                cell = pikepdf.Rectangle(
+                    column * input_pagesize.width - llx,
+                    row * input_pagesize.height - lly,
+                    (column + 1) * input_pagesize.width - llx,
+                    (row + 1) * input_pagesize.height - lly,
+                )
+                # blank pages are left out, repeated pages drawn with the first one
+                first = shared_pages.representatives[page_number]
+                if first is None or not _overlaps(cell, urx - llx, ury - lly):
+                    continue
+                if first not in formxs:
+                    formxs[first] = output.copy_foreign(source.pages[first - 1].as_form_xobject())
+                content.append(assembly.place_form_xobject(page, formxs[first], cell))
+            page.obj.Contents = output.make_stream(b"\n".join(content))
 
         return output
 
@@ -197,71 +906,174 @@ class NobuboOutput:
         return output_path.parent / new_filename
 
 
-def _calculate_colsrows_left(layout_element: int, factor: int, nup_factor: int) -> int:
-    return layout_element - (factor * nup_factor)
+# operators that only change the graphics state, which the enclosing q ... Q restores
+_STATE_OPERATORS = {
+    "w", "J", "j", "M", "d", "ri", "i", "gs",
+    "CS", "cs", "SC", "SCN", "sc", "scn", "G", "g", "RG", "rg", "K", "k",
+}  # fmt: skip
+
+ContentGroup = Tuple[List[Any], Optional[pikepdf.Rectangle]]
 
 
-def _calculate_lowerleft_point(
-    lowerleft_factor: Factor, n_up_factor: Factor, pagesize: assembly.PageSize
-) -> Point:
-    return Point(
-        x=lowerleft_factor.x * n_up_factor.x * pagesize.width,
-        y=lowerleft_factor.y * n_up_factor.y * pagesize.height,
+def _content_groups(page: pikepdf.Page) -> List[ContentGroup]:
+    """
+    Split the content stream of a page into its top level q ... Q groups, such as
+    the ones that place the pattern pages on the collage, and calculate where
+    each group draws.
+    :param page: The collage page.
+    :return: A list of (instructions, area) in the order of the content stream.
+    The area is None if it is unknown, e.g. for instructions outside of groups.
+    """
+    xobjects = page.resources.get("/XObject", pikepdf.Dictionary())
+    groups: List[ContentGroup] = []
+    current: List[Any] = []
+    depth = 0
+    for instruction in pikepdf.parse_content_stream(page):
+        operator = str(instruction.operator)
+        if depth == 0 and operator != "q":
+            groups.append(([instruction], None))
+            continue
+        current.append(instruction)
+        if operator == "q":
+            depth += 1
+        elif operator == "Q":
+            depth -= 1
+            if depth == 0:
+                groups.append((current, _drawn_area(current, xobjects)))
+                current = []
+    if current:  # unbalanced q, kept as it is
+        groups.append((current, None))
+    return groups
+
+
+def _drawn_area(instructions: List[Any], xobjects: pikepdf.Object) -> Optional[pikepdf.Rectangle]:
+    """
+    :return: The bounding box of the XObjects that a group of instructions draws,
+    or None if the group draws anything else.
+    """
+    ctm = [pikepdf.Matrix()]
+    area: Optional[pikepdf.Rectangle] = None
+    for instruction in instructions:
+        operator = str(instruction.operator)
+        if operator == "q":
+            ctm.append(ctm[-1])
+        elif operator == "Q":
+            ctm.pop()
+        elif operator == "cm":
+            ctm[-1] = pikepdf.Matrix(*[float(value) for value in instruction.operands]) @ ctm[-1]
+        elif operator == "Do":
+            xobject = xobjects.get(str(instruction.operands[0]))
+            if xobject is None:
+                return None
+            drawn: pikepdf.Rectangle
+            if xobject.get("/Subtype") == pikepdf.Name.Form:
+                matrix = [float(value) for value in xobject.get("/Matrix", [1, 0, 0, 1, 0, 0])]
+                bbox = [float(value) for value in xobject.BBox]
+                drawn = (pikepdf.Matrix(*matrix) @ ctm[-1]).transform(pikepdf.Rectangle(*bbox))
+            elif xobject.get("/Subtype") == pikepdf.Name.Image:
+                drawn = ctm[-1].transform(pikepdf.Rectangle(0, 0, 1, 1))
+            else:
+                return None
+            area = drawn if area is None else _union(area, drawn)
+        elif operator not in _STATE_OPERATORS:
+            return None
+    return area
+
+
+def _subset_content(
+    collage: pikepdf.Pdf,
+    page: pikepdf.Page,
+    groups: List[ContentGroup],
+    box: Tuple[float, float, float, float],
+    resources: List[Tuple[str, pikepdf.Object]],
+) -> None:
+    """
+    Replace the content of a copy of the collage page with the groups that are
+    visible in its crop box, and drop the XObjects that are no longer drawn.
+    :param resources: The resources of the collage page, read once for all tiles.
+    """
+    llx, lly, urx, ury = box
+    kept = [
+        instruction
+        for instructions, area in groups
+        if area is None
+        or _overlaps(
+            pikepdf.Rectangle(
+                area.llx - llx,
+                area.lly - lly,
+                area.urx - llx,
+                area.ury - lly,
+            ),
+            urx - llx,
+            ury - lly,
+        )
+        for instruction in instructions
+    ]
+    drawn = {str(i.operands[0]) for i in kept if str(i.operator) == "Do"}
+    page_resources = pikepdf.Dictionary(dict(resources))
+    xobjects = page_resources.get("/XObject", pikepdf.Dictionary())
+    page_resources.XObject = pikepdf.Dictionary(
+        {name: xobjects[name] for name in drawn if name in xobjects}
+    )
+    page.obj.Resources = page_resources
+    page.obj.Contents = collage.make_stream(pikepdf.unparse_content_stream(kept))
+
+
+def _union(first: pikepdf.Rectangle, second: pikepdf.Rectangle) -> pikepdf.Rectangle:
+    return pikepdf.Rectangle(
+        min(first.llx, second.llx),
+        min(first.lly, second.lly),
+        max(first.urx, second.urx),
+        max(first.ury, second.ury),
+    )
+
+
+def _overlaps(cell: pikepdf.Rectangle, width: float, height: float) -> bool:
+    # pattern pages that only touch the border of a tile are not on it
+    tolerance = 0.01
+    return (
+        cell.llx < width - tolerance
+        and cell.urx > tolerance
+        and cell.lly < height - tolerance
+        and cell.ury > tolerance
     )
 
 
-def _calculate_upperright_point(
-    upperright_factor: Factor,
-    n_up_factor: Factor,
-    current_layout: assembly.Layout,
-    pagesize: assembly.PageSize,
-) -> Point:
-    upperright = Point(x=0, y=0)
-    # Manage ROWS: apply transformation to upper right, y-value
-    rowsleft = _calculate_colsrows_left(current_layout.rows, upperright_factor.y, n_up_factor.y)
-    if rowsleft < 0:  # end of pattern reached  (full amount of rows reached)
-        upperright.y = current_layout.rows * pagesize.height
-    else:
-        upperright.y = upperright_factor.y * n_up_factor.y * pagesize.height
-
-    # Manage COLS: apply transformation to upper right, x-value
-    colsleft = _calculate_colsrows_left(
-        current_layout.columns, upperright_factor.x, n_up_factor.x
-    )  # COLS
-    if colsleft > 0:  # still assembling the same horizontal line
-        upperright.x = upperright_factor.x * n_up_factor.x * pagesize.width
-
-    else:  # end of line reached, need to go 1 row up
-        if colsleft == 0:  # cols % n_up_factor == 0
-            upperright.x = upperright_factor.x * n_up_factor.x * pagesize.width
-        if colsleft < 0:  # remainder pages left for COLS
-            upperright.x = current_layout.columns * pagesize.width
-    return upperright
-
-
-def _adjust_factors(
-    lowerleft_factor: Factor, upperright_factor: Factor, colsleft: int
-) -> Tuple[Factor, Factor]:
-    if colsleft > 0:  # still assembling the same horizontal line
-        return _advance_horizontally(lowerleft_factor, upperright_factor)
-    else:  # end of line reached, need to go 1 row up
-        return _advance_vertically(lowerleft_factor, upperright_factor)
-
-
-def _advance_horizontally(
-    lowerleft_factor: Factor, upperright_factor: Factor
-) -> Tuple[Factor, Factor]:
-    lowerleft_factor.x += 1
-    upperright_factor.x += 1
-    return lowerleft_factor, upperright_factor
-
-
-def _advance_vertically(
-    lowerleft_factor: Factor, upperright_factor: Factor
-) -> Tuple[Factor, Factor]:
-    lowerleft_factor.x = 0
-    lowerleft_factor.y += 1
-
-    upperright_factor.x = 1
-    upperright_factor.y += 1
-    return lowerleft_factor, upperright_factor
+def _log_saved_sheets(tile_plan: TilePlan) -> None:
+    if tile_plan.saved_sheets:
+        logger.info(
+            f"Turning output pages saves {tile_plan.saved_sheets} "
+            f"of {tile_plan.given_sheets} sheets"
+        )
+
+
+def _uniform_sheets(layout: assembly.Layout, n_up_factor: Factor) -> int:
+    return math.ceil(layout.columns / n_up_factor.x) * math.ceil(layout.rows / n_up_factor.y)
+
+
+def _row_bands(
+    layout: assembly.Layout, options: List[Tuple[Factor, bool]]
+) -> List[Tuple[Factor, bool]]:
+    """
+    Choose the orientation of every row of output pages so that the fewest output
+    pages are needed. All output pages have the same area, so they also waste
+    the least paper. On a tie, the option that comes first is taken.
+    :param options: The n-up factors of the orientations that a pattern page fits in.
+    :return: The n-up factor and orientation of every row, from the bottom.
+    """
+    # fewest[row]: output pages needed from this row of pattern pages to the top
+    fewest = [0] * (layout.rows + 1)
+    choice = [0] * layout.rows
+    for row in range(layout.rows - 1, -1, -1):
+        sheets = [
+            fewest[min(row + factor.y, layout.rows)] + math.ceil(layout.columns / factor.x)
+            for factor, _ in options
+        ]
+        choice[row] = sheets.index(min(sheets))
+        fewest[row] = sheets[choice[row]]
+    bands: List[Tuple[Factor, bool]] = []
+    row = 0
+    while row < layout.rows:
+        bands.append(options[choice[row]])
+        row += options[choice[row]][0].y
+    return bands
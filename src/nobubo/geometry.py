@@ -0,0 +1,103 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Reads the size and rotation of every page of the input pdf in one pass.
+"""
+
+import collections
+import logging
+from array import array
+from typing import List, Tuple
+
+import pikepdf
+
+logger = logging.getLogger(__name__)
+
+# pages whose width or height differ by less than this many user space units
+# count as the same size, as such differences come from rounding in the pdf
+SIZE_TOLERANCE = 0.5
+
+
+class PageIndex:
+    """
+    Compact index of the page boxes and rotations of a pdf.
+
+    boxes: llx, lly, urx, ury of the crop box of every page, which is the media box
+    if the page has no crop box. Four values per page, page 1 first.
+    rotations: The /Rotate value of every page, normalized to 0, 90, 180 or 270.
+    """
+
+    def __init__(self, pdf: pikepdf.Pdf):
+        self.boxes = array("d")
+        self.rotations = array("H")
+        for page in pdf.pages:
+            # Rectangle reads the numbers in C++, far cheaper than converting each one
+            box = pikepdf.Rectangle(page.cropbox)
+            self.boxes.extend((box.llx, box.lly, box.urx, box.ury))
+            self.rotations.append(page.rotation % 360)
+
+    def __len__(self) -> int:
+        return len(self.rotations)
+
+    def __repr__(self) -> str:
+        return f"<class '{self.__class__.__name__}': pages: '{len(self)}'>"
+
+    def size(self, page_number: int) -> Tuple[float, float]:
+        """
+        :param page_number: The number of the page, starting at 1.
+        :return: Width and height of the page as it is displayed, i.e. swapped
+        if the page is rotated by 90 or 270 degrees.
+        """
+        if not 1 <= page_number <= len(self):
+            raise IndexError(f"The pdf has no page {page_number}.")
+        i = (page_number - 1) * 4
+        width = round(self.boxes[i + 2] - self.boxes[i], 2)
+        height = round(self.boxes[i + 3] - self.boxes[i + 1], 2)
+        if self.rotations[page_number - 1] in (90, 270):
+            return height, width
+        return width, height
+
+    def common_size(self, first_page: int, last_page: int) -> Tuple[float, float]:
+        """
+        Find the size that most pages of a page range have. On a tie,
+        the size that occurs first wins.
+        :param first_page: The first page of the range, starting at 1.
+        :param last_page: The last page of the range, inclusive.
+        :return: Width and height in user space units.
+        """
+        sizes = collections.Counter(
+            self.size(number) for number in range(first_page, last_page + 1)
+        )
+        return sizes.most_common(1)[0][0]
+
+    def differing_pages(
+        self, first_page: int, last_page: int, size: Tuple[float, float]
+    ) -> List[int]:
+        """
+        :return: The numbers of the pages in the range whose size differs from size.
+        """
+        width, height = size
+        differing: List[int] = []
+        for number in range(first_page, last_page + 1):
+            page_width, page_height = self.size(number)
+            if (
+                abs(page_width - width) >= SIZE_TOLERANCE
+                or abs(page_height - height) >= SIZE_TOLERANCE
+            ):
+                differing.append(number)
+        return differing
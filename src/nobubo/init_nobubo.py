@@ -1,64 +1,292 @@
+import concurrent.futures
+import dataclasses
 import logging
 import pathlib
 import re
-from typing import List, Tuple, Optional
+import tempfile
+from typing import Any, List, Tuple, Optional, Union
 
 import pikepdf
 
-from nobubo import errors
+from nobubo import cache, detection, errors, geometry, profiling
 from nobubo.assembly import NobuboInput, PageSize, Layout
-from nobubo.disassembly import NobuboOutput
+from nobubo.disassembly import ORIENTATIONS, SAVE_PRESETS, NobuboOutput, SaveOptions
 
 
 logger = logging.getLogger(__name__)
 
 
+OUTPUT_LAYOUT_PATTERN = re.compile(r"(a0)|(us)|(\d+[x]\d+)")
+
+
+def run_conversion(
+    nobubo_input: NobuboInput,
+    nobubo_output: Union[NobuboOutput, List[NobuboOutput]],
+    jobs: int = 1,
+    direct: bool = False,
+    collage_cache: Optional[cache.CollageCache] = None,
+) -> None:
+    """
+    Assembles the collages and writes the output files.
+    :param nobubo_input: The parsed input data.
+    :param nobubo_output: The parsed output data, or a list of them to create several
+    output layouts from the same collages.
+    :param jobs: How many overviews are assembled, and how many output layouts are
+    written, at the same time. With one output layout, how many worker processes
+    share the output pages of a large collage.
+    :param direct: Build the output pages directly from the pattern pages, without collage.
+    :param collage_cache: Optional cache for the assembled collages.
+    """
+    outputs = [nobubo_output] if isinstance(nobubo_output, NobuboOutput) else nobubo_output
+    for output in outputs:
+        if output.output_pagesize is not None:
+            output.check_output_pagesize(nobubo_input)
+    if direct and all(output.output_pagesize is not None for output in outputs):
+        _run_outputs(outputs, jobs, "create_direct_output_files", nobubo_input)
+        return
+    if (
+        len(outputs) == 1
+        and outputs[0].output_pagesize is None
+        and nobubo_input.engine == "pikepdf"
+        and collage_cache is None
+        and (jobs == 1 or len(nobubo_input.layout) == 1)
+    ):
+        # the collages need no temporary file, they are saved straight to the output
+        outputs[0].write_assembled_collages(nobubo_input)
+        return
+    with tempfile.TemporaryDirectory() as td:
+        temp_output_dir = pathlib.Path(td)
+        temp_collage_paths: List[pathlib.Path] = nobubo_input.assemble_collage(
+            temp_output_dir, jobs, collage_cache
+        )
+        logger.info(f"Successfully assembled collage from {nobubo_input.input_filepath}.\n")
+        if len(outputs) == 1 and outputs[0].output_pagesize is not None:
+            # the jobs share the output pages of large collages instead
+            outputs[0].create_output_files(temp_collage_paths, nobubo_input, jobs)
+        elif all(output.output_pagesize is not None for output in outputs):
+            _run_outputs(outputs, jobs, "create_output_files", temp_collage_paths, nobubo_input)
+        else:  # default: no output_layout specified, print collage pdf
+            for output in outputs:
+                output.write_collage(
+                    temp_collage_paths,
+                )
+
+
+def _run_outputs(outputs: List[NobuboOutput], jobs: int, method: str, *args: Any) -> None:
+    """
+    Call the same method of every output, in worker processes if jobs allows it.
+    """
+    if jobs == 1 or len(outputs) == 1:
+        for output in outputs:
+            getattr(output, method)(*args)
+        return
+    workers = min(jobs, len(outputs))
+    logger.info(f"Writing {len(outputs)} output layouts with {workers} jobs\n")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            profiling.submit(executor, "output_layout", None, getattr(output, method), *args)
+            for output in outputs
+        ]
+        for output, future in zip(outputs, futures):
+            try:
+                profiling.result(future)
+            except (errors.Error, concurrent.futures.process.BrokenProcessPool) as e:
+                executor.shutdown(cancel_futures=True)
+                raise errors.UsageError(f"{output.output_path} could not be written:\n{e}")
+
+
+def parse_cli_outputs(
+    output_layouts_cli: List[str],
+    print_margins: List[int],
+    output_path: str,
+    save_options: Optional[SaveOptions] = None,
+    subset: bool = False,
+    orientation: str = "given",
+    pack: bool = False,
+    combine: bool = False,
+) -> List[NobuboOutput]:
+    """
+    Parse several output layouts that are created from the same collages.
+    With more than one output layout, the output files are named after them,
+    e.g. pattern_a0_1.pdf and pattern_610x914_1.pdf.
+    :param output_layouts_cli: The output layouts, none for a collage.
+    :param print_margins: One print margin for all output layouts, or one per output layout.
+    :param output_path: Where the output should be saved.
+    :return: One output per output layout.
+    """
+    if len(print_margins) > 1 and len(print_margins) != len(output_layouts_cli):
+        raise errors.UsageError(
+            f"Got {len(print_margins)} print margins for {len(output_layouts_cli)} "
+            "output layouts. Give either one margin for all output layouts or one per layout."
+        )
+    margins: List[Optional[int]] = list(print_margins)
+    if len(margins) <= 1:
+        margins = [margins[0] if margins else None] * max(len(output_layouts_cli), 1)
+    if len(output_layouts_cli) <= 1:
+        output_layout = output_layouts_cli[0] if output_layouts_cli else None
+        return [
+            parse_cli_output_data(
+                output_layout,
+                margins[0],
+                output_path,
+                save_options,
+                subset,
+                orientation,
+                pack,
+                combine,
+            )
+        ]
+
+    path = pathlib.Path(output_path)
+    outputs: List[NobuboOutput] = []
+    for output_layout, print_margin in zip(output_layouts_cli, margins):
+        name = output_layout if not print_margin else f"{output_layout}_margin{print_margin}"
+        outputs.append(
+            parse_cli_output_data(
+                output_layout,
+                print_margin,
+                str(path.with_name(f"{path.stem}_{name}{path.suffix}")),
+                save_options,
+                subset,
+                orientation,
+                pack,
+                combine,
+            )
+        )
+    if len({output.output_path for output in outputs}) != len(outputs):
+        raise errors.UsageError("The same output layout and margin are given more than once.")
+    return outputs
+
+
 def parse_cli_input_data(
-    input_layout: List[Tuple[int, int, int]],
+    input_layout: Optional[List[Tuple[int, int, int]]],
     reverse_assembly: bool,
     input_path: str,
+    engine: str = "pikepdf",
+    tex_format: bool = True,
 ) -> NobuboInput:
+    """
+    Read the input pdf and the input layouts.
+    :param input_layout: First page, columns and rows of every overview.
+    None detects the layouts from the pages of the pdf.
+    """
     try:
-        with pikepdf.open(pathlib.Path(input_path)) as inputfile:
-            logger.info(
-                f"Received a pdf with {len(input_layout)} overview(s) "
-                f"and {len(inputfile.pages)} pages."
-            )
-            # first page (getPage(0)) may contain overview, so get second one
-            width, height = page_dimensions(inputfile.pages[1])
-
-            input_properties = NobuboInput(
-                input_filepath=pathlib.Path(input_path),
-                number_of_pages=len(inputfile.pages),
-                pagesize=PageSize(width=width, height=height),
-                layout=parse_input_layouts(input_layout),
-                reverse_assembly=reverse_assembly,
+        with profiling.stage("parse_input"), pikepdf.open(pathlib.Path(input_path)) as inputfile:
+            input_properties = parse_input_data(
+                input_layout,
+                reverse_assembly,
+                inputfile,
+                pathlib.Path(input_path),
+                engine,
+                tex_format,
             )
-            logger.debug(f"Parsed input properties: {input_properties}")
     except OSError as e:
         raise errors.UsageError(f"While reading the input pdf file, this error occurred:\n{e}")
     return input_properties
 
 
+def parse_input_data(
+    input_layout: Optional[List[Tuple[int, int, int]]],
+    reverse_assembly: bool,
+    inputfile: pikepdf.Pdf,
+    input_filepath: pathlib.Path,
+    engine: str = "pikepdf",
+    tex_format: bool = True,
+) -> NobuboInput:
+    """
+    Read the input layouts and page sizes of an opened input pdf.
+    :param input_layout: As for parse_cli_input_data.
+    :param inputfile: The opened input pdf.
+    :param input_filepath: Where the input pdf is stored, for the pdflatex engine.
+    """
+    page_index = geometry.PageIndex(inputfile)
+    if input_layout is None:
+        layouts = detection.best_layouts(inputfile, page_index)
+        if not layouts:
+            raise errors.UsageError(
+                "No pattern pages were found, please give the input layout with --il."
+            )
+    else:
+        layouts = parse_input_layouts(input_layout)
+    logger.info(f"Received a pdf with {len(layouts)} overview(s) and {len(inputfile.pages)} pages.")
+    input_properties = NobuboInput(
+        input_filepath=input_filepath,
+        number_of_pages=len(inputfile.pages),
+        pagesize=default_pagesize(page_index, layouts),
+        layout=layouts,
+        reverse_assembly=reverse_assembly,
+        engine=engine,
+        tex_format=tex_format,
+        page_index=page_index,
+    )
+    check_page_sizes(page_index, layouts)
+    logger.debug(f"Parsed input properties: {input_properties}")
+    return input_properties
+
+
 def parse_input_layouts(input_layout: List[Tuple[int, int, int]]) -> List[Layout]:
     return [Layout(first_page=data[0], columns=data[1], rows=data[2]) for data in input_layout]
 
 
 def parse_cli_output_data(
-    output_layout_cli: str,
-    print_margin: int,
+    output_layout_cli: Optional[str],
+    print_margin: Optional[int],
     output_path: str,
+    save_options: Optional[SaveOptions] = None,
+    subset: bool = False,
+    orientation: str = "given",
+    pack: bool = False,
+    combine: bool = False,
 ) -> NobuboOutput:
+    if orientation not in ORIENTATIONS:
+        raise errors.UsageError(
+            f"Unknown orientation {orientation}, use one of {', '.join(ORIENTATIONS)}."
+        )
     output_properties = NobuboOutput(
         output_path=pathlib.Path(output_path),
         output_pagesize=parse_output_layout(output_layout_cli, print_margin)
         if output_layout_cli
         else None,
+        save_options=save_options,
+        subset=subset,
+        orientation=orientation,
+        pack=pack,
+        combine=combine,
     )
     logger.debug(f"Parsed output properties: {output_properties}")
     return output_properties
 
 
+def parse_save_options(
+    preset: str = "default",
+    object_streams: Optional[str] = None,
+    compression_level: Optional[int] = None,
+    linearize: Optional[bool] = None,
+) -> SaveOptions:
+    """
+    Start from a preset and override the options that are given.
+    :param preset: One of SAVE_PRESETS.
+    :param object_streams: preserve, disable or generate.
+    :param compression_level: zlib level 0-9, recompresses all streams with it.
+    :param linearize: Write a linearized pdf ("fast web view").
+    :return: The options for saving the output pdfs.
+    """
+    if preset not in SAVE_PRESETS:
+        raise errors.UsageError(
+            f"Save preset {preset} does not exist, use one of {', '.join(SAVE_PRESETS)}."
+        )
+    options = dataclasses.replace(SAVE_PRESETS[preset])
+    if object_streams is not None:
+        options.object_streams = object_streams
+    if compression_level is not None:
+        options.compression_level = compression_level
+        options.compress_streams = True
+        options.recompress = True
+    if linearize is not None:
+        options.linearize = linearize
+    return options
+
+
 def parse_output_layout(output_layout_cli: str, print_margin: Optional[int] = None) -> PageSize:
     print_size: List[int] = []
     if output_layout_cli == "a0":
@@ -74,28 +302,50 @@ def parse_output_layout(output_layout_cli: str, print_margin: Optional[int] = No
         return to_userspaceunits(print_size)
 
 
-def page_dimensions(page: pikepdf.Page) -> Tuple[float, float]:
+def default_pagesize(page_index: geometry.PageIndex, layouts: List[Layout]) -> PageSize:
     """
-    Calculate the x, y value for the offset in default user space units
-    as defined in the pdf standard.
-    :param page: A PDF page.
-    :return: tuple with x, y value.
+    Find the size of a pattern page, used by layouts for which the index has no size.
+    :param page_index: The sizes of all pages of the pdf.
+    :param layouts: The layouts of the pdf.
+    :return: The common size of the first layout, or the size of the second page,
+    since the first page may contain the overview.
     """
-    if not hasattr(page, "cropbox"):
-        # page is of type Object, and either mediabox, cropbox or trimbox
-        # are all of type pikepdf.objects.Object
-        # they exist (or not) depending on the pdf itself
-        box: pikepdf.objects.Array = page.mediabox
+    if layouts and _in_range(layouts[0], len(page_index)):
+        width, height = page_index.common_size(*_page_range(layouts[0]))
     else:
-        box = page.cropbox
-    # pikepdf has some confusing types here
-    # type(box[2]) returns decimal.Decimal, but mypy/pikepdf insists it's of type Object
-    # the workaround is to convert it to a string,
-    # then to a float to calculate the offset
-    # since both Decimal and Object allow the stringification
-    width = float(str(box[2])) - float(str(box[0]))
-    height = float(str(box[3])) - float(str(box[1]))
-    return round(width, 2), round(height, 2)
+        width, height = page_index.size(min(2, len(page_index)))
+    return PageSize(width=width, height=height)
+
+
+def check_page_sizes(page_index: geometry.PageIndex, layouts: List[Layout]) -> None:
+    """
+    Warn about pattern pages whose size differs from the other pages of their layout,
+    as they do not line up with their neighbours on the collage.
+    """
+    for counter, layout in enumerate(layouts):
+        if not _in_range(layout, len(page_index)):
+            continue  # reported when the overview is assembled
+        first_page, last_page = _page_range(layout)
+        size = page_index.common_size(first_page, last_page)
+        differing = page_index.differing_pages(first_page, last_page, size)
+        if differing:
+            sizes = ", ".join(
+                f"{number} ({' x '.join(map(str, page_index.size(number)))})"
+                for number in differing
+            )
+            logger.warning(
+                f"Overview {counter + 1}: most pattern pages are {size[0]} x {size[1]} "
+                f"user space units, but these pages differ and will not line up: {sizes}"
+            )
+
+
+def _page_range(layout: Layout) -> Tuple[int, int]:
+    return layout.first_page, layout.first_page + layout.columns * layout.rows - 1
+
+
+def _in_range(layout: Layout, number_of_pages: int) -> bool:
+    first_page, last_page = _page_range(layout)
+    return first_page >= 1 and last_page <= number_of_pages
 
 
 def to_mm(output_layout: str) -> List[int]:
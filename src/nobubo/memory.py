@@ -0,0 +1,170 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Converts a pattern from bytes or a stream to output streams, without
+writing to the filesystem as long as the pattern is small enough.
+
+With the pikepdf engine, the collages are assembled and chopped up in memory.
+Patterns larger than the spill threshold, and the pdflatex engine, which needs
+files, use a temporary directory.
+"""
+
+import contextlib
+import io
+import logging
+import pathlib
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import BinaryIO, List, Optional, Tuple, Union
+
+import pikepdf
+
+from nobubo import assembly, errors, profiling, texformat
+from nobubo.disassembly import NobuboOutput
+from nobubo.init_nobubo import parse_input_data
+
+logger = logging.getLogger(__name__)
+
+# inputs larger than this are buffered, and outputs written, in temporary files
+SPILL_THRESHOLD = 64 * 1024 * 1024
+
+
+@dataclass
+class OutputStream:
+    """
+    One output pdf of an in-memory conversion.
+
+    name: The file name that the pdf gets when written to disk, e.g. pattern_a0_1.pdf.
+    data: The pdf, positioned at its start. In memory, or a temporary file
+    that is removed when it is closed.
+    """
+
+    name: str
+    overview: int
+    data: BinaryIO
+
+
+def convert_in_memory(
+    data: Union[bytes, BinaryIO],
+    input_layout: Optional[List[Tuple[int, int, int]]],
+    outputs: List[NobuboOutput],
+    reverse_assembly: bool = False,
+    engine: str = "pikepdf",
+    tex_format: bool = True,
+    direct: bool = False,
+    spill_threshold: int = SPILL_THRESHOLD,
+) -> List[OutputStream]:
+    """
+    Convert a pattern like run_conversion, but from and to streams.
+    :param data: The input pdf as bytes or a binary file object. A seekable file
+    object is read in place, others are buffered first.
+    :param input_layout: First page, columns and rows of every overview, None detects them.
+    :param outputs: The output layouts. Their output paths only name the streams.
+    :param reverse_assembly: Assemble from bottom left to top right.
+    :param engine: The engine that assembles the collage, one of assembly.ENGINES.
+    :param tex_format: pdflatex engine only: use the cached precompiled preamble.
+    :param direct: Build the output pages without assembling a collage first.
+    :param spill_threshold: Size in bytes above which the input is buffered,
+    and the outputs are written, in temporary files.
+    :return: One stream per output layout and overview, in the order of the outputs.
+    """
+    with contextlib.ExitStack() as stack:
+        source_stream, size, copied = _buffer(data, spill_threshold)
+        if copied:
+            stack.enter_context(contextlib.closing(source_stream))
+        spill = size > spill_threshold
+        try:
+            with profiling.stage("parse_input"):
+                source = stack.enter_context(pikepdf.open(source_stream))
+        except pikepdf.PdfError as e:
+            raise errors.UsageError(f"While reading the input pdf, this error occurred:\n{e}")
+
+        work_dir: Optional[pathlib.Path] = None
+        input_name = getattr(data, "name", None)  # the file descriptor for temporary files
+        input_filepath = pathlib.Path(input_name if isinstance(input_name, str) else "input.pdf")
+        if engine == "pdflatex":
+            # pdflatex reads and writes files only
+            work_dir = pathlib.Path(stack.enter_context(tempfile.TemporaryDirectory()))
+            if not input_filepath.is_file():
+                input_filepath = work_dir / "input.pdf"
+                source_stream.seek(0)
+                with input_filepath.open("wb") as f:
+                    shutil.copyfileobj(source_stream, f)
+        nobubo_input = parse_input_data(
+            input_layout, reverse_assembly, source, input_filepath, engine, tex_format
+        )
+        if work_dir is not None and tex_format:
+            with profiling.stage("tex_format"):
+                nobubo_input.tex_format_path = texformat.ensure_format()
+
+        streams: List[OutputStream] = []
+        try:
+            tiled = all(output.output_pagesize is not None for output in outputs)
+            for output in outputs:
+                if output.output_pagesize is not None:
+                    output.check_output_pagesize(nobubo_input)
+            for counter, layout in enumerate(nobubo_input.layout):
+                assembly.check_page_range(layout, nobubo_input.number_of_pages)
+                pagesize = nobubo_input.layout_pagesize(layout)
+                collage: Optional[pikepdf.Pdf] = None
+                if not (direct and tiled):
+                    with profiling.stage("assemble", counter + 1):
+                        workspace = work_dir / f"overview_{counter + 1}" if work_dir else None
+                        collage = nobubo_input.open_collage(source, layout, workspace, stack)
+                for output in outputs:
+                    with profiling.stage("chop" if collage is not None else "tile", counter + 1):
+                        if collage is None:
+                            pdf = output.tile_overview(source, pagesize, layout, reverse_assembly)
+                        elif output.output_pagesize is not None:
+                            pdf = output.chop_collage(collage, pagesize, layout)
+                        else:
+                            pdf = collage
+                    with profiling.stage("write", counter + 1):
+                        stream: BinaryIO = tempfile.TemporaryFile() if spill else io.BytesIO()
+                        output.write_chops(pdf, stream)
+                        stream.seek(0)
+                    name = output.generate_new_outputpath(output.output_path, counter).name
+                    streams.append(OutputStream(name=name, overview=counter + 1, data=stream))
+                    logger.info(f"Created {name}.")
+        except BaseException:
+            for output_stream in streams:
+                output_stream.data.close()
+            raise
+    return streams
+
+
+def _buffer(data: Union[bytes, BinaryIO], spill_threshold: int) -> Tuple[BinaryIO, int, bool]:
+    # pikepdf needs a seekable stream, unseekable ones are copied, to disk if large.
+    # Returns the stream, its size and whether it is a copy that is to be closed.
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return io.BytesIO(data), len(data), True
+    if data.seekable():
+        start = data.tell()
+        size = data.seek(0, io.SEEK_END) - start
+        data.seek(start)
+        return data, size, False
+    head = data.read(spill_threshold + 1)
+    if len(head) <= spill_threshold:
+        return io.BytesIO(head), len(head), True
+    spilled = tempfile.TemporaryFile()
+    spilled.write(head)
+    shutil.copyfileobj(data, spilled)
+    size = spilled.tell()
+    spilled.seek(0)
+    return spilled, size, True
@@ -0,0 +1,191 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Packs the partly filled output pages of several overviews onto shared sheets.
+
+The output pages in the last column and row of an overview are often mostly
+empty. Instead of printing each of them on its own sheet, they are placed
+next to each other on as few sheets as possible, and cut apart after printing.
+"""
+
+import logging
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+import pikepdf
+
+from nobubo import assembly
+
+logger = logging.getLogger(__name__)
+
+# pieces that are larger than a sheet by less than this still fit, in user space units
+TOLERANCE = 0.01
+
+
+@dataclass(frozen=True)
+class Piece:
+    """
+    A partly filled output page of an overview.
+
+    overview: The index of the overview.
+    sheet: The index of the output page in the tile plan of the overview.
+    """
+
+    overview: int
+    sheet: int
+    width: float
+    height: float
+
+
+@dataclass
+class Placement:
+    """
+    Where a piece is placed: on which shared sheet, and its lower left corner on it.
+    """
+
+    piece: Piece
+    sheet: int
+    x: float
+    y: float
+
+
+@dataclass
+class _Shelf:
+    y: float
+    height: float
+    width: float = 0.0
+
+
+@dataclass
+class _Sheet:
+    shelves: List[_Shelf] = field(default_factory=list)
+    height: float = 0.0
+
+
+def pack(pieces: List[Piece], sheet_size: assembly.PageSize) -> List[Placement]:
+    """
+    Place pieces on as few sheets as possible, without turning them. The pieces
+    are placed from the highest to the lowest, left to right on shelves that are
+    stacked from the bottom of a sheet, into the first sheet and shelf with room
+    for them (first fit decreasing height). The result only depends on the pieces
+    and their order.
+    :param pieces: The pieces, in the order of their overviews and output pages.
+    :param sheet_size: The size of a shared sheet in user space units.
+    :return: The placements of the pieces that fit on a sheet, the others are left out.
+    """
+    placements: List[Placement] = []
+    sheets: List[_Sheet] = []
+    fitting = [
+        piece
+        for piece in pieces
+        if piece.width <= sheet_size.width + TOLERANCE
+        and piece.height <= sheet_size.height + TOLERANCE
+    ]
+    # sorted() is stable, pieces of the same size keep their order
+    for piece in sorted(fitting, key=lambda piece: (-piece.height, -piece.width)):
+        placements.append(_place(piece, sheets, sheet_size))
+    placements.sort(key=lambda placement: (placement.sheet, placement.y, placement.x))
+    return placements
+
+
+def _place(piece: Piece, sheets: List[_Sheet], sheet_size: assembly.PageSize) -> Placement:
+    for number, sheet in enumerate(sheets):
+        for shelf in sheet.shelves:
+            if (
+                piece.height <= shelf.height + TOLERANCE
+                and shelf.width + piece.width <= sheet_size.width + TOLERANCE
+            ):
+                placement = Placement(piece, number, shelf.width, shelf.y)
+                shelf.width += piece.width
+                return placement
+        if sheet.height + piece.height <= sheet_size.height + TOLERANCE:
+            sheet.shelves.append(_Shelf(y=sheet.height, height=piece.height, width=piece.width))
+            sheet.height += piece.height
+            return Placement(piece, number, 0.0, sheet.shelves[-1].y)
+    sheets.append(_Sheet(shelves=[_Shelf(y=0.0, height=piece.height, width=piece.width)]))
+    sheets[-1].height = piece.height
+    return Placement(piece, len(sheets) - 1, 0.0, 0.0)
+
+
+class SharedSheets:
+    """
+    The shared sheets of a packing. The output pages of every overview are
+    handed over with take() before the output of the overview is written.
+    """
+
+    def __init__(self, placements: List[Placement]):
+        """
+        :param placements: The result of pack().
+        """
+        self.placements = placements
+        self.pdf = pikepdf.new()
+        self._forms: Dict[Piece, pikepdf.Object] = {}
+        # the copied pages read their streams from the outputs until the sheets are saved
+        self._sources: List[pikepdf.Pdf] = []
+
+    def __len__(self) -> int:
+        return max(placement.sheet for placement in self.placements) + 1 if self.placements else 0
+
+    def __repr__(self):
+        return (
+            f"<class '{self.__class__.__name__}': "
+            f"pieces: '{len(self.placements)}', "
+            f"sheets: '{len(self)}'>"
+        )
+
+    def take(self, overview: int, output: pikepdf.Pdf) -> None:
+        """
+        Move the packed output pages of an overview to the shared sheets.
+        :param overview: The index of the overview.
+        :param output: The output pages of the overview, the packed ones are removed.
+        """
+        pieces = [p.piece for p in self.placements if p.piece.overview == overview]
+        for piece in pieces:
+            self._forms[piece] = self.pdf.copy_foreign(output.pages[piece.sheet].as_form_xobject())
+        for piece in sorted(pieces, key=lambda piece: piece.sheet, reverse=True):
+            del output.pages[piece.sheet]
+        self._sources.append(output)
+
+    def build(self) -> pikepdf.Pdf:
+        """
+        Lay out the shared sheets once take() got the pages of every overview.
+        Every sheet is as large as the pieces on it.
+        :return: The pdf with the shared sheets.
+        """
+        for number in range(len(self)):
+            on_sheet = [p for p in self.placements if p.sheet == number]
+            width = max(p.x + p.piece.width for p in on_sheet)
+            height = max(p.y + p.piece.height for p in on_sheet)
+            self.pdf.add_blank_page(page_size=(width, height))
+            page = self.pdf.pages[-1]
+            content = [
+                assembly.place_form_xobject(
+                    page,
+                    self._forms[p.piece],
+                    pikepdf.Rectangle(p.x, p.y, p.x + p.piece.width, p.y + p.piece.height),
+                )
+                for p in on_sheet
+            ]
+            page.obj.Contents = self.pdf.make_stream(b"\n".join(content))
+            logger.info(
+                f"Shared sheet {number + 1}: "
+                + ", ".join(
+                    f"overview {p.piece.overview + 1} sheet {p.piece.sheet + 1}" for p in on_sheet
+                )
+            )
+        return self.pdf
@@ -0,0 +1,191 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Plans the output sheets of a conversion without assembling or writing anything.
+"""
+
+import json
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from nobubo import assembly
+from nobubo.disassembly import NobuboOutput
+
+# user space units per millimeter
+UNITS_PER_MM = 72 / 25.4
+
+# rough size of the page dictionary, content stream and crop box of one sheet
+SHEET_OVERHEAD_BYTES = 400
+
+
+@dataclass
+class OverviewPlan:
+    """
+    The output sheets of one overview.
+
+    output_path: The file that the sheets are written to, the same for all overviews
+    if they are combined, None if all sheets are packed onto shared sheets.
+
+    sheet_width, sheet_height: Size of an output sheet in user space units, without
+    print margin. Without output layout, the sheet is the whole collage.
+    crop_boxes: llx, lly, urx, ury of every sheet on the collage.
+    coverage: Percentage of the sheets' area that the pattern covers.
+    saved_sheets: How many sheets fewer are needed because sheets are turned.
+    turned_sheets: The numbers of the sheets whose crop box is turned by 90 degrees
+    against the output layout, starting at 1.
+    estimated_bytes: Rough size of the output file, from the share of the input pdf
+    that the pattern pages of the overview make up.
+    packed_sheets: The numbers of the sheets that are packed onto the shared sheets
+    in shared_path, starting at 1.
+    """
+
+    overview: int
+    output_path: Optional[str]
+    first_page: int
+    last_page: int
+    columns: int
+    rows: int
+    sheet_width: float
+    sheet_height: float
+    crop_boxes: List[Tuple[float, float, float, float]]
+    coverage: float
+    estimated_bytes: int
+    saved_sheets: int = 0
+    turned_sheets: List[int] = field(default_factory=list)
+    packed_sheets: List[int] = field(default_factory=list)
+    shared_path: Optional[str] = None
+
+    @property
+    def sheets(self) -> int:
+        return len(self.crop_boxes) - len(self.packed_sheets)
+
+
+def plan_conversion(
+    nobubo_input: assembly.NobuboInput, nobubo_output: NobuboOutput
+) -> List[OverviewPlan]:
+    """
+    Calculate the output sheets of every overview, as run_conversion would create them.
+    :param nobubo_input: The parsed input data.
+    :param nobubo_output: The parsed output data.
+    :return: One plan per overview, in the order of the overviews.
+    """
+    input_bytes = nobubo_input.input_filepath.stat().st_size
+    packed: Dict[int, Set[int]] = {}
+    if nobubo_output.pack and nobubo_output.output_pagesize is not None:
+        shared = nobubo_output.shared_sheets(nobubo_input)
+        for placement in shared.placements if shared is not None else []:
+            packed.setdefault(placement.piece.overview, set()).add(placement.piece.sheet)
+    # combined, the overviews and the shared sheets are written to one file
+    shared_path = (
+        nobubo_output.output_path if nobubo_output.combine else nobubo_output.shared_outputpath()
+    )
+    plans: List[OverviewPlan] = []
+    for counter, layout in enumerate(nobubo_input.layout):
+        assembly.check_page_range(layout, nobubo_input.number_of_pages)
+        pagesize = nobubo_input.layout_pagesize(layout)
+        collage_width = layout.columns * pagesize.width
+        collage_height = layout.rows * pagesize.height
+        saved_sheets = 0
+        turned_sheets: List[int] = []
+        if nobubo_output.output_pagesize is not None:
+            sheet = nobubo_output.output_pagesize
+            tile_plan = nobubo_output.tile_plan(layout, pagesize)
+            boxes = list(tile_plan)
+            saved_sheets = tile_plan.saved_sheets
+            turned_sheets = [index + 1 for index in tile_plan.turned]
+        else:
+            sheet = assembly.PageSize(width=collage_width, height=collage_height)
+            boxes = [(0.0, 0.0, collage_width, collage_height)]
+        pattern_pages = layout.columns * layout.rows
+        packed_sheets = sorted(packed.get(counter, set()))
+        plans.append(
+            OverviewPlan(
+                overview=counter + 1,
+                output_path=str(
+                    nobubo_output.output_path
+                    if nobubo_output.combine
+                    else nobubo_output.generate_new_outputpath(nobubo_output.output_path, counter)
+                )
+                if len(packed_sheets) < len(boxes)
+                else None,
+                first_page=layout.first_page,
+                last_page=layout.first_page + pattern_pages - 1,
+                columns=layout.columns,
+                rows=layout.rows,
+                sheet_width=round(sheet.width, 3),
+                sheet_height=round(sheet.height, 3),
+                crop_boxes=[
+                    (round(llx, 3), round(lly, 3), round(urx, 3), round(ury, 3))
+                    for llx, lly, urx, ury in boxes
+                ],
+                coverage=round(
+                    100
+                    * collage_width
+                    * collage_height
+                    / (len(boxes) * sheet.width * sheet.height),
+                    1,
+                ),
+                estimated_bytes=input_bytes * pattern_pages // nobubo_input.number_of_pages
+                + SHEET_OVERHEAD_BYTES * len(boxes),
+                saved_sheets=saved_sheets,
+                turned_sheets=turned_sheets,
+                packed_sheets=[index + 1 for index in packed_sheets],
+                shared_path=str(shared_path) if packed_sheets else None,
+            )
+        )
+    return plans
+
+
+def plans_as_json(plans: List[OverviewPlan]) -> str:
+    return json.dumps(
+        [{**asdict(plan), "sheets": plan.sheets} for plan in plans],
+        indent=2,
+    )
+
+
+def format_plan(plans: List[OverviewPlan]) -> str:
+    lines: List[str] = []
+    for plan in plans:
+        lines.append(
+            f"Overview {plan.overview}: {plan.columns} x {plan.rows} pattern pages "
+            f"(pages {plan.first_page}-{plan.last_page}) on {plan.sheets} sheet(s) of "
+            f"{_mm(plan.sheet_width)} x {_mm(plan.sheet_height)} mm, "
+            + (f"written to {plan.output_path}" if plan.output_path else "all on shared sheets")
+        )
+        for number, (llx, lly, urx, ury) in enumerate(plan.crop_boxes, start=1):
+            lines.append(
+                f"  sheet {number:>3}: {llx:>9.2f} {lly:>9.2f} {urx:>9.2f} {ury:>9.2f}  "
+                f"({_mm(urx - llx)} x {_mm(ury - lly)} mm)"
+                + (", turned" if number in plan.turned_sheets else "")
+                + (", on a shared sheet" if number in plan.packed_sheets else "")
+            )
+        lines.append(
+            f"  coverage: {plan.coverage:.1f}%, "
+            f"estimated size: {plan.estimated_bytes / 1024:.0f} kB"
+        )
+        if plan.saved_sheets:
+            lines.append(f"  turning sheets saves {plan.saved_sheets} sheet(s)")
+        if plan.packed_sheets:
+            lines.append(
+                f"  {len(plan.packed_sheets)} partly filled sheet(s) packed into {plan.shared_path}"
+            )
+    return "\n".join(lines)
+
+
+def _mm(units: float) -> int:
+    return round(units / UNITS_PER_MM)
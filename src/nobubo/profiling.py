@@ -0,0 +1,310 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Records wall time, CPU time and peak memory of the stages of a conversion.
+
+Usage as a library:
+
+    with profiling.Profiler() as profiler:
+        run_conversion(nobubo_input, nobubo_output)
+    report = profiler.report()
+
+Without an active profiler, profiling.stage() costs next to nothing.
+"""
+
+import concurrent.futures
+import contextlib
+import contextvars
+import datetime
+import importlib.metadata
+import json
+import os
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, TextIO, Tuple, TypeVar
+
+if sys.platform != "win32":
+    import resource
+
+_active: contextvars.ContextVar[Optional["Profiler"]] = contextvars.ContextVar(
+    "nobubo_profiler", default=None
+)
+
+T = TypeVar("T")
+
+
+@dataclass
+class StageRecord:
+    """
+    Measurements of one stage of a conversion.
+
+    overview: The number of the overview that the stage worked on, if any.
+    started_at: Unix time at which the stage started.
+    cpu_seconds: CPU time of the process running the stage.
+    child_cpu_seconds: CPU time of subprocesses that finished during the stage, e.g. pdflatex.
+    peak_traced_mb: Peak of the memory allocated by Python during the stage (tracemalloc).
+    Memory allocated by qpdf inside pikepdf is not included.
+    max_rss_mb: Maximum resident set size of the process up to the end of the stage.
+    """
+
+    stage: str
+    overview: Optional[int]
+    pid: int
+    started_at: float
+    wall_seconds: float
+    cpu_seconds: float
+    child_cpu_seconds: float
+    peak_traced_mb: Optional[float]
+    max_rss_mb: Optional[float]
+    ok: bool
+
+
+class Profiler:
+    """
+    Collects a StageRecord for every stage that runs while the profiler is active.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        trace_memory: bool = True,
+        on_stage: Optional[Callable[[StageRecord], None]] = None,
+    ):
+        """
+        :param enabled: If False, the profiler records nothing, so that callers
+        need not distinguish between profiling and not profiling.
+        :param trace_memory: Measure Python allocations with tracemalloc, which
+        slows down Python code somewhat.
+        :param on_stage: Called with every record as soon as its stage has finished.
+        """
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.on_stage = on_stage
+        self.records: List[StageRecord] = []
+        self.status = "ok"
+        self._start_wall = 0.0
+        self._start_cpu = 0.0
+        self._started_at = ""
+        self._wall_seconds = 0.0
+        self._cpu_seconds = 0.0
+        self._overviews: List[Optional[int]] = []
+        self._peaks: List[int] = []
+        self._started_tracing = False
+        self._token: Optional[contextvars.Token[Optional["Profiler"]]] = None
+
+    def __enter__(self) -> "Profiler":
+        if not self.enabled:
+            return self
+        self._started_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        self._token = _active.set(self)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        if not self.enabled:
+            return
+        if exc_info[0] is not None:
+            self.status = "failed"
+        self._wall_seconds = time.perf_counter() - self._start_wall
+        self._cpu_seconds = time.process_time() - self._start_cpu
+        if self._token is not None:
+            _active.reset(self._token)
+            self._token = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, name: str, overview: Optional[int] = None) -> Iterator[None]:
+        if overview is None and self._overviews:
+            overview = self._overviews[-1]  # nested stages belong to the same overview
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            # tracemalloc has only one peak, so it is handed on to the enclosing stage
+            _, peak = tracemalloc.get_traced_memory()
+            if self._peaks:
+                self._peaks[-1] = max(self._peaks[-1], peak)
+            tracemalloc.reset_peak()
+        self._overviews.append(overview)
+        self._peaks.append(0)
+        started_at = time.time()
+        started = time.perf_counter()
+        start_cpu = time.process_time()
+        start_child_cpu = _child_cpu_seconds()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            wall_seconds = time.perf_counter() - started
+            cpu_seconds = time.process_time() - start_cpu
+            child_cpu_seconds = _child_cpu_seconds() - start_child_cpu
+            self._overviews.pop()
+            peak = self._peaks.pop()
+            if tracing:
+                peak = max(peak, tracemalloc.get_traced_memory()[1])
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            record = StageRecord(
+                stage=name,
+                overview=overview,
+                pid=os.getpid(),
+                started_at=round(started_at, 3),
+                wall_seconds=round(wall_seconds, 4),
+                cpu_seconds=round(cpu_seconds, 4),
+                child_cpu_seconds=round(child_cpu_seconds, 4),
+                peak_traced_mb=_mb(peak) if tracing else None,
+                max_rss_mb=_max_rss_mb(),
+                ok=ok,
+            )
+            self.add(record)
+
+    def add(self, record: StageRecord) -> None:
+        self.records.append(record)
+        if self.on_stage is not None:
+            self.on_stage(record)
+
+    def report(self) -> Dict[str, Any]:
+        """
+        :return: The measurements as a json serializable dictionary,
+        with the stages in the order in which they finished.
+        """
+        return {
+            "nobubo_version": _version(),
+            "started_at": self._started_at,
+            "status": self.status,
+            "wall_seconds": round(self._wall_seconds, 4),
+            "cpu_seconds": round(self._cpu_seconds, 4),
+            "max_rss_mb": _max_rss_mb(),
+            "stages": [asdict(record) for record in self.records],
+        }
+
+    def write_report(self, file: TextIO) -> None:
+        json.dump(self.report(), file, indent=2)
+        file.write("\n")
+
+
+def active() -> Optional[Profiler]:
+    """
+    :return: The profiler of the current context, or None if nothing is profiled.
+    """
+    return _active.get()
+
+
+@contextlib.contextmanager
+def stage(name: str, overview: Optional[int] = None) -> Iterator[None]:
+    """
+    Measure the enclosed code as one stage, if a profiler is active.
+    :param name: The name of the stage in the report.
+    :param overview: The number of the overview, default: that of the enclosing stage.
+    """
+    profiler = _active.get()
+    if profiler is None:
+        yield
+        return
+    with profiler.stage(name, overview):
+        yield
+
+
+def run_profiled(
+    name: str, overview: Optional[int], function: Callable[..., T], *args: Any
+) -> Tuple[T, List[StageRecord]]:
+    """
+    Run a function as a stage in a worker process, where the profiler of the
+    parent process is not available. Hand the records to merge() in the parent.
+    :return: The result of the function and the records of the worker.
+    """
+    with Profiler() as profiler:
+        with profiler.stage(name, overview):
+            result = function(*args)
+    return result, profiler.records
+
+
+def submit(
+    executor: concurrent.futures.Executor,
+    name: str,
+    overview: Optional[int],
+    function: Callable[..., T],
+    *args: Any,
+) -> "concurrent.futures.Future[Any]":
+    """
+    Submit a function to a pool of worker processes. The profiler lives in this
+    process, so if one is active, the worker measures the function itself as a stage.
+    :param name: The name of the stage in the report.
+    :param overview: The number of the overview, or None.
+    :return: The future, whose result is taken with result().
+    """
+    if _active.get() is None:
+        return executor.submit(function, *args)
+    return executor.submit(run_profiled, name, overview, function, *args)
+
+
+def result(future: "concurrent.futures.Future[Any]") -> Any:
+    """
+    Wait for a function that was submitted with submit() while the same profiler,
+    or none, was active, and add the stages the worker measured to the profiler.
+    :return: The result of the function.
+    """
+    value = future.result()
+    if _active.get() is None:
+        return value
+    function_result, records = value
+    merge(records)
+    return function_result
+
+
+def merge(records: List[StageRecord]) -> None:
+    """
+    Add records of a worker process to the active profiler.
+    """
+    profiler = _active.get()
+    if profiler is not None:
+        for record in records:
+            profiler.add(record)
+
+
+def _child_cpu_seconds() -> float:
+    if sys.platform == "win32":
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _max_rss_mb() -> Optional[float]:
+    if sys.platform == "win32":
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def _mb(size: int) -> float:
+    return round(size / (1024 * 1024), 2)
+
+
+def _version() -> str:
+    try:
+        return importlib.metadata.version("nobubo")
+    except importlib.metadata.PackageNotFoundError:
+        return "unknown"
@@ -0,0 +1,288 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Long-running local service that converts uploaded patterns with a job queue.
+
+API:
+    POST /jobs?il=2,8,4&il=35,7,3&ol=a0&margin=10&reverse=true&engine=pikepdf&save=small
+        with the pdf as request body, il=auto detects the input layouts.
+        Returns the job status.
+    GET /jobs/<id>
+        Returns the job status with timing and the number of output files.
+    GET /jobs/<id>/result?file=N
+        Streams the N-th output pdf (default: 1) of a finished job.
+    DELETE /jobs/<id>
+        Removes a finished job and its files.
+"""
+
+import concurrent.futures
+import http.server
+import json
+import logging
+import pathlib
+import shutil
+import socketserver
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from nobubo import batch, errors
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ServiceJob:
+    """
+    A conversion job of the service.
+    """
+
+    job_id: str
+    directory: pathlib.Path
+    batch_job: batch.BatchJob
+    future: "concurrent.futures.Future[batch.BatchResult]"
+    queued_at: float
+
+    def status(self) -> Dict[str, Any]:
+        status: Dict[str, Any] = {"id": self.job_id, "queued_at": self.queued_at}
+        if self.future.running():
+            status["status"] = "running"
+        elif not self.future.done():
+            status["status"] = "queued"
+        else:
+            try:
+                result = self.future.result()
+                status.update(
+                    status="done" if result.status == "ok" else "failed",
+                    seconds=result.seconds,
+                    error=result.error,
+                    outputs=len(self.outputs()),
+                )
+            except Exception as e:  # the worker process died
+                status.update(status="failed", error=str(e) or e.__class__.__name__)
+        return status
+
+    def outputs(self) -> List[pathlib.Path]:
+        return sorted(
+            self.directory.glob("output_*.pdf"),
+            key=lambda path: int(path.stem.rsplit("_", 1)[1]),
+        )
+
+
+class JobQueue:
+    """
+    Queues conversion jobs and runs them on a pool of worker processes
+    that stay alive between jobs.
+    """
+
+    def __init__(self, work_dir: pathlib.Path, workers: int):
+        """
+        :param work_dir: The directory in which inputs and outputs of the jobs are kept.
+        :param workers: The number of jobs that run at the same time.
+        """
+        self.work_dir = work_dir
+        self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        self.jobs: Dict[str, ServiceJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, pdf: bytes, parameters: Dict[str, List[str]]) -> ServiceJob:
+        """
+        Store the uploaded pdf and queue its conversion.
+        :param pdf: The content of the input pdf.
+        :param parameters: The query parameters il, ol, margin, reverse, engine and save.
+        :return: The queued job.
+        """
+        job_id = uuid.uuid4().hex
+        directory = self.work_dir / job_id
+        row = {
+            "input": "input.pdf",
+            "output": "output.pdf",
+            "il": "; ".join(il.replace(",", " ") for il in parameters.get("il", [])),
+            "ol": _first(parameters, "ol"),
+            "margin": _first(parameters, "margin"),
+            "reverse": _first(parameters, "reverse") or False,
+            "engine": _first(parameters, "engine"),
+            "save": _first(parameters, "save"),
+        }
+        batch_job = batch.parse_job(row, 1, directory)
+        try:
+            directory.mkdir()
+            (directory / "input.pdf").write_bytes(pdf)
+        except OSError as e:
+            raise errors.UsageError(f"Could not store the uploaded pdf:\n{e}")
+        job = ServiceJob(
+            job_id=job_id,
+            directory=directory,
+            batch_job=batch_job,
+            future=self.executor.submit(batch.run_job, batch_job, 1),
+            queued_at=time.time(),
+        )
+        with self._lock:
+            self.jobs[job_id] = job
+        logger.info(f"Queued job {job_id}")
+        return job
+
+    def get(self, job_id: str) -> Optional[ServiceJob]:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def remove(self, job_id: str) -> bool:
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or not job.future.done():
+                return False
+            del self.jobs[job_id]
+        shutil.rmtree(job.directory, ignore_errors=True)
+        return True
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Translates the HTTP API into calls to the job queue.
+    """
+
+    server: "ServiceServer"
+
+    def do_POST(self):
+        path, parameters = self._parse_url()
+        if path != ["jobs"]:
+            return self._send_json(404, {"error": "Not found."})
+        length = int(self.headers.get("Content-Length") or 0)
+        if length == 0:
+            return self._send_json(400, {"error": "The request body must contain a pdf."})
+        if length > self.server.max_upload:
+            return self._send_json(413, {"error": "The uploaded pdf is too large."})
+        pdf = self.rfile.read(length)
+        try:
+            job = self.server.queue.submit(pdf, parameters)
+        except errors.UsageError as e:
+            return self._send_json(400, {"error": str(e)})
+        self._send_json(202, job.status())
+
+    def do_GET(self):
+        path, parameters = self._parse_url()
+        job = self.server.queue.get(path[1]) if len(path) in (2, 3) else None
+        if path[0] != "jobs" or job is None:
+            return self._send_json(404, {"error": "Not found."})
+        if len(path) == 2:
+            return self._send_json(200, job.status())
+        if path[2] != "result":
+            return self._send_json(404, {"error": "Not found."})
+        if not job.future.done():
+            return self._send_json(409, {"error": "The job has not finished yet."})
+        outputs = job.outputs()
+        try:
+            file_number = int(_first(parameters, "file") or 1)
+            if file_number < 1:
+                raise IndexError(file_number)
+            output = outputs[file_number - 1]
+        except (ValueError, IndexError):
+            return self._send_json(404, {"error": "The job has no such output file."})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Content-Length", str(output.stat().st_size))
+        self.end_headers()
+        with output.open("rb") as f:
+            shutil.copyfileobj(f, self.wfile)
+
+    def do_DELETE(self):
+        path, _ = self._parse_url()
+        if len(path) != 2 or path[0] != "jobs" or not self.server.queue.remove(path[1]):
+            return self._send_json(404, {"error": "No finished job with this id."})
+        self._send_json(200, {"id": path[1], "status": "deleted"})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _parse_url(self) -> Tuple[List[str], Dict[str, List[str]]]:
+        url = urlsplit(self.path)
+        return [part for part in url.path.split("/") if part] or [""], parse_qs(url.query)
+
+    def _send_json(self, code: int, body: Dict[str, Any]) -> None:
+        content = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class ServiceServer(socketserver.BaseServer):
+    """
+    Server that knows the job queue and the upload limit of the service.
+    """
+
+    queue: JobQueue
+    max_upload: int
+
+
+class HTTPService(ServiceServer, http.server.ThreadingHTTPServer):
+    pass
+
+
+class UnixSocketService(ServiceServer, socketserver.ThreadingUnixStreamServer):
+    pass
+
+
+def create_server(
+    queue: JobQueue,
+    max_upload: int,
+    host: str = "127.0.0.1",
+    port: int = 8090,
+    socket_path: Optional[pathlib.Path] = None,
+) -> ServiceServer:
+    """
+    Create the server of the service, listening either on a TCP port or a Unix socket.
+    :param queue: The job queue that runs the conversions.
+    :param max_upload: The maximum size of an uploaded pdf in bytes.
+    :param host: The host to listen on.
+    :param port: The TCP port to listen on, 0 chooses a free port.
+    :param socket_path: If given, listen on this Unix socket instead of a TCP port.
+    :return: The server, ready for serve_forever.
+    """
+    server: ServiceServer
+    try:
+        if socket_path is not None:
+            socket_path.unlink(missing_ok=True)
+            server = UnixSocketService(str(socket_path), RequestHandler)
+        else:
+            server = HTTPService((host, port), RequestHandler)
+    except OSError as e:
+        raise errors.UsageError(f"Could not start the service:\n{e}")
+    server.queue = queue
+    server.max_upload = max_upload
+    return server
+
+
+def server_address(server: ServiceServer) -> str:
+    address = server.server_address
+    if isinstance(address, tuple):
+        return f"http://{address[0]}:{address[1]}"
+    return str(address)
+
+
+def _first(parameters: Dict[str, List[str]], name: str) -> Optional[str]:
+    values = parameters.get(name)
+    return values[0] if values else None
@@ -0,0 +1,135 @@
+# Copyright 2023, Méline Sieber
+#
+# This file is part of Nobubo.
+#
+# Nobubo is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Nobubo is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with Nobubo.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Precompiled TeX format for the pdflatex engine.
+
+Only the paper size and the \\includepdfmerge line change between two runs of pdflatex,
+so the fixed preamble is dumped once into a format file and loaded with -fmt afterwards.
+"""
+
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+# the part of the tex file that is the same for every collage
+PREAMBLE = [
+    "\\documentclass[a4paper,]{article}\n",
+    "\\usepackage{geometry}\n",
+    "\\usepackage[utf8]{inputenc}\n",
+    "\\usepackage{pdfpages}\n",
+]
+
+# files whose change makes a rebuild of the format necessary
+TEX_DEPENDENCIES = ["pdflatex.fmt", "article.cls", "geometry.sty", "inputenc.sty", "pdfpages.sty"]
+
+
+def user_cache_dir() -> pathlib.Path:
+    """
+    :return: The platform's directory for user specific cache files, with a nobubo subdirectory.
+    """
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA") or str(pathlib.Path.home() / "AppData" / "Local")
+    elif sys.platform == "darwin":
+        base = str(pathlib.Path.home() / "Library" / "Caches")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or str(pathlib.Path.home() / ".cache")
+    return pathlib.Path(base) / "nobubo"
+
+
+def installation_fingerprint() -> Optional[str]:
+    """
+    Identify the TeX installation by the pdflatex binary and the files the preamble uses.
+    :return: A hash that changes whenever the TeX installation changes,
+    or None if pdflatex is not installed.
+    """
+    pdflatex = shutil.which("pdflatex")
+    if pdflatex is None:
+        return None
+    paths: List[str] = [os.path.realpath(pdflatex)]
+    try:
+        found = subprocess.run(
+            ["kpsewhich", "-engine=pdftex", *TEX_DEPENDENCIES],
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        paths.extend(line for line in found.stdout.splitlines() if line)
+    except OSError:
+        pass  # without kpsewhich, only the binary is checked
+    sha = hashlib.sha256("".join(PREAMBLE).encode())
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        sha.update(f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return sha.hexdigest()[:16]
+
+
+def ensure_format(cache_dir: Optional[pathlib.Path] = None) -> Optional[pathlib.Path]:
+    """
+    Build the format file with the fixed preamble, unless it has already been built
+    for the current TeX installation.
+    :param cache_dir: The directory in which the format is kept, default: user_cache_dir().
+    :return: The path to the format file, or None if it could not be built.
+    In that case, pdflatex has to load the whole preamble itself.
+    """
+    fingerprint = installation_fingerprint()
+    if fingerprint is None:
+        return None
+    cache_dir = cache_dir or user_cache_dir()
+    format_path = cache_dir / f"nobubo-{fingerprint}.fmt"
+    if format_path.exists():
+        return format_path
+
+    logger.info("Building the TeX format for pdflatex, this is only done once...")
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=cache_dir) as td:
+            source = pathlib.Path(td) / "nobubo.tex"
+            source.write_text("".join(PREAMBLE) + "\\dump\n")
+            subprocess.check_output(
+                [
+                    "pdflatex",
+                    "-ini",
+                    "-interaction=nonstopmode",
+                    "-jobname=nobubo",
+                    f"-output-directory={td}",
+                    "&pdflatex",
+                    str(source),
+                ],
+                stderr=subprocess.STDOUT,
+            )
+            # replace atomically, several processes might build the format at once
+            os.replace(pathlib.Path(td) / "nobubo.fmt", format_path)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.warning(f"Could not build the TeX format, using the full preamble:\n{e}")
+        return None
+
+    for outdated in cache_dir.glob("nobubo-*.fmt"):
+        if outdated != format_path:
+            outdated.unlink(missing_ok=True)
+    return format_path
@@ -0,0 +1,149 @@
+import asyncio
+import contextlib
+import io
+import shutil
+import sys
+import time
+
+import pikepdf
+import pytest
+
+from nobubo import api, errors
+from nobubo.assembly import Layout
+
+
+def test_convert(testdata, tmp_path):
+    result = asyncio.run(
+        api.convert(
+            testdata / "mockpattern_twooverviews_8x4_7x3.pdf",
+            tmp_path / "out.pdf",
+            [(2, 8, 4), (35, 7, 3)],
+            "a0",
+        )
+    )
+    assert result.layouts == [Layout(2, 8, 4), Layout(35, 7, 3)]
+    assert result.output_paths == [tmp_path / "out_1.pdf", tmp_path / "out_2.pdf"]
+    with pikepdf.open(result.output_paths[0]) as pdf:
+        assert len(pdf.pages) == 2
+
+
+def test_convert_sync_detects_layouts(testdata, tmp_path):
+    result = api.convert_sync(
+        testdata / "mockpattern_oneoverview_8x4.pdf",
+        tmp_path / "out.pdf",
+        output_layout=["a0", "us"],
+    )
+    assert result.layouts == [Layout(2, 8, 4)]
+    assert result.output_paths == [tmp_path / "out_a0_1.pdf", tmp_path / "out_us_1.pdf"]
+    assert all(path.exists() for path in result.output_paths)
+
+
+def test_errors_are_raised(testdata, tmp_path):
+    with pytest.raises(errors.UsageError, match="only has 33 pages"):
+        api.convert_sync(
+            testdata / "mockpattern_oneoverview_8x4.pdf", tmp_path / "out.pdf", [(2, 8, 5)]
+        )
+
+
+@pytest.mark.skipif(shutil.which("pdflatex") is not None, reason="pdflatex is installed")
+def test_missing_pdflatex(testdata, tmp_path):
+    with pytest.raises(errors.UsageError, match="pdflatex was not found"):
+        api.convert_sync(
+            testdata / "mockpattern_oneoverview_8x4.pdf",
+            tmp_path / "out.pdf",
+            [(2, 8, 4)],
+            engine="pdflatex",
+        )
+
+
+def test_cancel_kills_command():
+    async def cancel_sleeper():
+        task = asyncio.create_task(
+            api.run_command([sys.executable, "-c", "import time; time.sleep(30)"])
+        )
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    start = time.perf_counter()
+    asyncio.run(cancel_sleeper())
+    assert time.perf_counter() - start < 10
+
+
+def test_failing_command():
+    with pytest.raises(errors.UsageError, match="status 3"):
+        asyncio.run(api.run_command([sys.executable, "-c", "import sys; sys.exit(3)"]))
+    with pytest.raises(errors.UsageError, match="not found"):
+        asyncio.run(api.run_command(["nobubo-no-such-program"]))
+
+
+async def _collect(sheets):
+    return [sheet_batch async for sheet_batch in sheets]
+
+
+def test_stream_sheets(testdata, tmp_path):
+    batches = asyncio.run(
+        _collect(
+            api.stream_sheets(
+                testdata / "mockpattern_twooverviews_8x4_7x3.pdf",
+                tmp_path / "out.pdf",
+                [(2, 8, 4), (35, 7, 3)],
+                "211x298",
+                batch=3,
+            )
+        )
+    )
+    # 32 and 21 A4 pages
+    assert [(b.overview, b.first_sheet, b.sheets) for b in batches][:2] == [(1, 1, 3), (1, 4, 3)]
+    assert [b.sheets for b in batches if b.overview == 1][-1] == 2
+    assert sum(b.sheets for b in batches) == 53
+    assert batches[-1].path == tmp_path / "out_2_sheet019.pdf"
+
+    expected = api.convert_sync(
+        testdata / "mockpattern_twooverviews_8x4_7x3.pdf",
+        tmp_path / "expected.pdf",
+        [(2, 8, 4), (35, 7, 3)],
+        "211x298",
+    )
+    with pikepdf.open(expected.output_paths[0]) as pdf:
+        boxes = [list(page.cropbox) for page in pdf.pages]
+    with contextlib.ExitStack() as stack:
+        streamed = [
+            list(page.cropbox)
+            for sheet_batch in batches[:11]
+            for page in stack.enter_context(pikepdf.open(sheet_batch.path)).pages
+        ]
+    assert streamed == boxes
+
+
+def test_stream_sheets_in_memory(testdata, tmp_path):
+    batches = asyncio.run(
+        _collect(
+            api.stream_sheets(
+                testdata / "mockpattern_oneoverview_8x4.pdf",
+                tmp_path / "out.pdf",
+                batch=2,
+                in_memory=True,
+            )
+        )
+    )
+    assert [(b.first_sheet, b.sheets) for b in batches] == [(1, 2)]
+    assert batches[0].data is not None
+    assert not batches[0].path.exists()
+    with pikepdf.open(io.BytesIO(batches[0].data)) as pdf:
+        assert len(pdf.pages) == 2
+
+
+def test_convert_bytes(testdata):
+    streams = asyncio.run(
+        api.convert_bytes(
+            (testdata / "mockpattern_oneoverview_8x4.pdf").read_bytes(),
+            output_layout="a0",
+            name="jacket.pdf",
+            direct=True,
+        )
+    )
+    assert [stream.name for stream in streams] == ["jacket_1.pdf"]
+    with pikepdf.open(streams[0].data) as pdf:
+        assert len(pdf.pages) == 2
@@ -0,0 +1,86 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from nobubo import batch, errors
+from nobubo.cli import main
+
+
+def test_read_manifest_formats(tmp_path):
+    (tmp_path / "manifest.csv").write_text(
+        "input,il,ol,margin,reverse,output\npattern.pdf,2 8 4; 35 7 3,a0,10,true,out.pdf\n"
+    )
+    (tmp_path / "manifest.json").write_text(
+        json.dumps(
+            {
+                "jobs": [
+                    {
+                        "input": "pattern.pdf",
+                        "il": [[2, 8, 4], [35, 7, 3]],
+                        "ol": "a0",
+                        "margin": 10,
+                        "reverse": True,
+                        "output": "out.pdf",
+                    }
+                ]
+            }
+        )
+    )
+    (tmp_path / "manifest.toml").write_text(
+        "[[jobs]]\n"
+        'input = "pattern.pdf"\n'
+        'il = "2 8 4; 35 7 3"\n'
+        'ol = "a0"\n'
+        "margin = 10\n"
+        "reverse = true\n"
+        'output = "out.pdf"\n'
+    )
+    expected = batch.BatchJob(
+        input_path=str(tmp_path / "pattern.pdf"),
+        output_path=str(tmp_path / "out.pdf"),
+        input_layout=[(2, 8, 4), (35, 7, 3)],
+        output_layout="a0",
+        print_margin=10,
+        reverse_assembly=True,
+    )
+    for suffix in ["csv", "json", "toml"]:
+        assert batch.read_manifest(tmp_path / f"manifest.{suffix}") == [expected]
+
+
+def test_invalid_job_is_reported(tmp_path):
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text("input,il,ol,margin,reverse,output\npattern.pdf,2 8,a0,,,out.pdf\n")
+    with pytest.raises(errors.UsageError, match="Job 1"):
+        batch.read_manifest(manifest)
+
+
+def test_batch_keeps_going_after_failed_job(testdata, tmp_path, pdftester):
+    pattern = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    manifest = tmp_path / "manifest.csv"
+    manifest.write_text(
+        "input,il,ol,margin,reverse,output\n"
+        f"{pattern},2 8 4,a0,,false,first.pdf\n"
+        f"{tmp_path / 'missing.pdf'},2 8 4,a0,,false,missing.pdf\n"
+        f"{pattern},2 8 4; 35 7 3,,,true,second.pdf\n"
+    )
+    runner = CliRunner()
+    result = runner.invoke(
+        main,
+        ["batch", "--workers", "2", "--summary", str(tmp_path / "summary.json"), str(manifest)],
+    )
+    print(result.output)
+    assert result.exit_code == 1
+    assert "2 of 3 jobs succeeded." in result.output
+    assert pdftester.read() == ["first_1.pdf", "second_1.pdf", "second_2.pdf"]
+    assert pdftester.pages_order(tmp_path / "second_2.pdf") == ["15B", "7B"]
+
+    summary = json.loads((tmp_path / "summary.json").read_text())
+    assert [job["status"] for job in summary] == ["ok", "failed", "ok"]
+
+
+def test_auto_input_layout(tmp_path):
+    job = batch.parse_job(
+        {"input": "pattern.pdf", "il": "auto", "ol": "a0", "output": "out.pdf"}, 1, tmp_path
+    )
+    assert job.input_layout is None
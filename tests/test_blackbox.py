@@ -1,5 +1,14 @@
+import io
+import json
+import shutil
+
+import pikepdf
+import pytest
 from click.testing import CliRunner
+from pdfminer.high_level import extract_text
 
+from benchmarks import patterngen
+from nobubo import disassembly
 from nobubo.cli import main
 
 
@@ -14,7 +23,7 @@ def test_no_overview_normal_collage(testdata, tmp_path, pdftester):
 
     assert pdftester.pagecount("mock_1.pdf") == 1
 
-    assert pdftester.pagesize("mock_1.pdf") == [4744.61, 3354.98]
+    assert pdftester.pagesize("mock_1.pdf") == [4762.4, 3367.56]
 
     assert pdftester.pages_order(tmp_path / "mock_1.pdf") == ["1", "32"]
 
@@ -33,7 +42,7 @@ def test_no_overview_reverse_collage(testdata, tmp_path, pdftester):
 
     assert pdftester.pagecount("mock_1.pdf") == 1
 
-    assert pdftester.pagesize("mock_1.pdf") == [4744.61, 3354.98]
+    assert pdftester.pagesize("mock_1.pdf") == [4762.4, 3367.56]
 
     assert pdftester.pages_order(tmp_path / "mock_1.pdf") == ["25", "8"]
 
@@ -49,7 +58,7 @@ def test_one_overview_normal_collage(testdata, tmp_path, pdftester):
 
     assert pdftester.pagecount("mock_1.pdf") == 1
 
-    assert pdftester.pagesize("mock_1.pdf") == [4744.61, 3354.98]
+    assert pdftester.pagesize("mock_1.pdf") == [4762.4, 3367.56]
 
     assert pdftester.pages_order(tmp_path / "mock_1.pdf") == ["1", "32"]
 
@@ -68,7 +77,7 @@ def test_one_overview_reverse_collage(testdata, tmp_path, pdftester):
 
     assert pdftester.pagecount("mock_1.pdf") == 1
 
-    assert pdftester.pagesize("mock_1.pdf") == [4744.61, 3354.98]
+    assert pdftester.pagesize("mock_1.pdf") == [4762.4, 3367.56]
 
     assert pdftester.pages_order(tmp_path / "mock_1.pdf") == ["25", "8"]
 
@@ -99,8 +108,8 @@ def test_two_overviews_normal_collage(testdata, tmp_path, pdftester):
     assert pdftester.pagecount("mock_1.pdf") == 1
     assert pdftester.pagecount("mock_2.pdf") == 1
 
-    assert pdftester.pagesize("mock_1.pdf") == [4744.61, 3354.98]
-    assert pdftester.pagesize("mock_2.pdf") == [4151.53, 2516.23]
+    assert pdftester.pagesize("mock_1.pdf") == [4762.4, 3367.56]
+    assert pdftester.pagesize("mock_2.pdf") == [4167.1, 2525.67]
 
     assert pdftester.pages_order(tmp_path / "mock_1.pdf") == ["1A", "32A"]
     assert pdftester.pages_order(tmp_path / "mock_2.pdf") == ["1B", "21B"]
@@ -133,8 +142,8 @@ def test_two_overviews_reverse_collage(testdata, tmp_path, pdftester):
     assert pdftester.pagecount("mock_1.pdf") == 1
     assert pdftester.pagecount("mock_2.pdf") == 1
 
-    assert pdftester.pagesize("mock_1.pdf") == [4744.61, 3354.98]
-    assert pdftester.pagesize("mock_2.pdf") == [4151.53, 2516.23]
+    assert pdftester.pagesize("mock_1.pdf") == [4762.4, 3367.56]
+    assert pdftester.pagesize("mock_2.pdf") == [4167.1, 2525.67]
 
     assert pdftester.pages_order(tmp_path / "mock_1.pdf") == ["25A", "8A"]
     assert pdftester.pages_order(tmp_path / "mock_2.pdf") == ["15B", "7B"]
@@ -221,6 +230,33 @@ def test_one_overview_normal_custom(testdata, tmp_path, pdftester):
     assert pdftester.pages_order(tmp_path / "mock_1.pdf") == ["1", "32"]
 
 
+def test_one_overview_normal_custom_subset(testdata, tmp_path, pdftester):
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    output_filepath = tmp_path / "mock.pdf"
+    runner = CliRunner()
+    result = runner.invoke(
+        main,
+        [
+            "--il",
+            "2",
+            "8",
+            "4",
+            "--ol",
+            "920x1187",
+            "--subset",
+            str(filepath),
+            str(output_filepath),
+        ],
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    assert pdftester.read() == ["mock_1.pdf"]
+    assert pdftester.pagecount("mock_1.pdf") == 4
+    assert pdftester.pagesize("mock_1.pdf", 0) == [2381.2, 2525.67]
+    # the first output page shows the lower three rows, the last one the upper right
+    assert pdftester.pages_order(tmp_path / "mock_1.pdf") == ["9", "8"]
+
+
 def test_one_overview_normal_us(testdata, tmp_path, pdftester):
     filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
     output_filepath = tmp_path / "mock.pdf"
@@ -314,3 +350,342 @@ def test_two_overviews_reverse_a0(testdata, tmp_path, pdftester):
 
     assert pdftester.pages_order(tmp_path / "mock_1.pdf") == ["25A", "8A"]
     assert pdftester.pages_order(tmp_path / "mock_2.pdf") == ["15B", "7B"]
+
+
+@pytest.mark.skipif(shutil.which("pdflatex") is None, reason="pdflatex is not installed")
+@pytest.mark.parametrize("reverse", [[], ["--reverse"]])
+def test_engines_create_same_collage(testdata, tmp_path, pdftester, reverse):
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    runner = CliRunner()
+    for engine in ["pikepdf", "pdflatex"]:
+        result = runner.invoke(
+            main,
+            ["--il", "2", "8", "4", "--engine", engine]
+            + reverse
+            + [str(filepath), str(tmp_path / f"{engine}.pdf")],
+        )
+        print(result.output)
+        assert result.exit_code == 0
+    assert pdftester.read() == ["pdflatex_1.pdf", "pikepdf_1.pdf"]
+
+    assert pdftester.pagesize("pikepdf_1.pdf") == pdftester.pagesize("pdflatex_1.pdf")
+    assert pdftester.pages_order(tmp_path / "pikepdf_1.pdf") == pdftester.pages_order(
+        tmp_path / "pdflatex_1.pdf"
+    )
+
+
+def test_two_overviews_parallel_a0(testdata, tmp_path, pdftester):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    output_filepath = tmp_path / "mock.pdf"
+    runner = CliRunner()
+    result = runner.invoke(
+        main,
+        [
+            "--il",
+            "2",
+            "8",
+            "4",
+            "--il",
+            "35",
+            "7",
+            "3",
+            "--ol",
+            "a0",
+            "--jobs",
+            "2",
+            str(filepath),
+            str(output_filepath),
+        ],
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    assert pdftester.read() == ["mock_1.pdf", "mock_2.pdf"]
+
+    assert pdftester.pagesize("mock_1.pdf", 0) == [2381.2, 3367.56]
+    assert pdftester.pagesize("mock_2.pdf", 1) == [1785.9, 2525.67]
+
+    assert pdftester.pages_order(tmp_path / "mock_1.pdf") == ["1A", "32A"]
+    assert pdftester.pages_order(tmp_path / "mock_2.pdf") == ["1B", "21B"]
+
+
+def test_parallel_reports_failed_overview(testdata, tmp_path):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    runner = CliRunner()
+    result = runner.invoke(
+        main,
+        [
+            "--il",
+            "2",
+            "8",
+            "4",
+            "--il",
+            "50",
+            "7",
+            "3",
+            "--jobs",
+            "2",
+            str(filepath),
+            str(tmp_path / "mock.pdf"),
+        ],
+    )
+    assert result.exit_code == 1
+    assert "Overview 2 of 2 could not be assembled" in result.output
+
+
+@pytest.mark.parametrize("subset", [[], ["--subset"]])
+def test_parallel_chopping_equals_sequential(tmp_path, monkeypatch, caplog, subset):
+    monkeypatch.setattr(disassembly, "PARALLEL_MIN_SHEETS", 4)
+    caplog.set_level("INFO")
+    filepath = patterngen.generate_pattern(tmp_path / "pattern.pdf", 6, 4, overview=True)
+    saved = []
+    for jobs in ["1", "3"]:
+        output_filepath = tmp_path / f"jobs{jobs}.pdf"
+        result = CliRunner().invoke(
+            main,
+            ["--il", "2", "6", "4", "--ol", "211x298", "--margin", "0", "--jobs", jobs]
+            # both runs chop up the same collage
+            + ["--cache-dir", str(tmp_path / "cache")]
+            + subset
+            + [str(filepath), str(output_filepath)],
+        )
+        print(result.output)
+        assert result.exit_code == 0
+        with pikepdf.open(tmp_path / f"jobs{jobs}_1.pdf") as pdf:
+            assert len(pdf.pages) == 24
+            saved.append(io.BytesIO())
+            pdf.save(saved[-1], deterministic_id=True)
+    assert "Chopping up the collage into 24 pages with 3 jobs" in caplog.text
+    assert saved[0].getvalue() == saved[1].getvalue()
+
+
+@pytest.mark.parametrize(
+    "reverse, expected_order",
+    [([], [["1A", "32A"], ["1B", "21B"]]), (["--reverse"], [["25A", "8A"], ["15B", "7B"]])],
+)
+def test_two_overviews_direct_a0(testdata, tmp_path, pdftester, reverse, expected_order):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    output_filepath = tmp_path / "mock.pdf"
+    runner = CliRunner()
+    result = runner.invoke(
+        main,
+        ["--il", "2", "8", "4", "--il", "35", "7", "3", "--ol", "a0", "--direct"]
+        + reverse
+        + [str(filepath), str(output_filepath)],
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    assert pdftester.read() == ["mock_1.pdf", "mock_2.pdf"]
+
+    assert pdftester.pagecount("mock_1.pdf") == 2
+    assert pdftester.pagecount("mock_2.pdf") == 2
+
+    assert pdftester.pagesize("mock_1.pdf", 0) == [2381.2, 3367.56]
+    assert pdftester.pagesize("mock_1.pdf", 1) == [2381.2, 3367.56]
+    assert pdftester.pagesize("mock_2.pdf", 0) == [2381.2, 2525.67]
+    assert pdftester.pagesize("mock_2.pdf", 1) == [1785.9, 2525.67]
+
+    assert pdftester.pages_order(tmp_path / "mock_1.pdf") == expected_order[0]
+    assert pdftester.pages_order(tmp_path / "mock_2.pdf") == expected_order[1]
+
+
+def test_collage_cache_is_reused(testdata, tmp_path, pdftester):
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    cache_dir = tmp_path / "cache"
+    runner = CliRunner()
+    for name, output_layout in [("first", "a0"), ("second", "us")]:
+        result = runner.invoke(
+            main,
+            ["--il", "2", "8", "4", "--ol", output_layout, "--cache-dir", str(cache_dir)]
+            + [str(filepath), str(tmp_path / f"{name}.pdf")],
+        )
+        print(result.output)
+        assert result.exit_code == 0
+    assert len(list(cache_dir.glob("*.pdf"))) == 1
+    assert pdftester.read() == ["first_1.pdf", "second_1.pdf"]
+    assert pdftester.pages_order(tmp_path / "second_1.pdf") == ["1", "32"]
+
+
+def test_collage_larger_than_14400_units(tmp_path, pdftester):
+    # 25 A4 pages side by side are wider than the 200 inches pikepdf's add_blank_page allows
+    filepath = patterngen.generate_pattern(tmp_path / "wide.pdf", 25, 2, overview=True)
+    result = CliRunner().invoke(
+        main, ["--il", "2", "25", "2", str(filepath), str(tmp_path / "collage.pdf")]
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    assert pdftester.read() == ["collage_1.pdf", "wide.pdf"]
+    assert pdftester.pagesize("collage_1.pdf") == [14882.5, 1683.78]
+    assert pdftester.pagecount("wide.pdf") == 51
+
+
+@pytest.mark.parametrize("jobs", ["1", "2"])
+def test_profile_report(testdata, tmp_path, jobs):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    report_path = tmp_path / "profile.json"
+    result = CliRunner().invoke(
+        main,
+        ["--il", "2", "8", "4", "--il", "35", "7", "3", "--ol", "a0", "--jobs", jobs]
+        + ["--profile", str(report_path), str(filepath), str(tmp_path / "out.pdf")],
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    report = json.loads(report_path.read_text())
+    assert report["status"] == "ok"
+    stages = {(stage["stage"], stage["overview"]) for stage in report["stages"]}
+    assert stages == {("parse_input", None)} | {
+        (name, overview)
+        for name in ["assemble", "save_collage", "chop", "write"]
+        for overview in [1, 2]
+    }
+
+
+def test_save_preset_small_linearized(testdata, tmp_path):
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    result = CliRunner().invoke(
+        main,
+        ["--il", "2", "8", "4", "--ol", "a0", "--save-preset", "small", "--linearize"]
+        + [str(filepath), str(tmp_path / "small.pdf")],
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    with pikepdf.open(tmp_path / "small_1.pdf") as pdf:
+        assert pdf.is_linearized
+        assert len(pdf.pages) == 2
+        assert b"/ObjStm" in (tmp_path / "small_1.pdf").read_bytes()
+
+
+@pytest.mark.parametrize(
+    "subset, expected_pages",
+    [
+        (
+            "--subset",
+            [
+                "9-10-11-12-17-18-19-20-25-26-27-28",
+                "13-14-15-16-21-22-23-24-29-30-31-32",
+                "1-2-3-4",
+                "5-6-7-8",
+            ],
+        ),
+        ("--no-subset", ["-".join(str(number) for number in range(1, 33))] * 4),
+    ],
+)
+def test_output_pages_only_contain_visible_pattern_pages(
+    testdata, tmp_path, subset, expected_pages
+):
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    result = CliRunner().invoke(
+        main,
+        ["--il", "2", "8", "4", "--ol", "920x1187", subset]
+        + [str(filepath), str(tmp_path / "mock.pdf")],
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    pages = [
+        extract_text(tmp_path / "mock_1.pdf", page_numbers=[number]).strip("-\x0c")
+        for number in range(4)
+    ]
+    assert pages == expected_pages
+
+
+@pytest.mark.parametrize("jobs", ["1", "3"])
+def test_several_output_layouts(testdata, tmp_path, pdftester, jobs):
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    result = CliRunner().invoke(
+        main,
+        ["--il", "2", "8", "4", "--ol", "a0", "--ol", "us", "--ol", "610x914"]
+        + ["--margin", "0", "--margin", "0", "--margin", "10", "--jobs", jobs]
+        + [str(filepath), str(tmp_path / "mock.pdf")],
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    assert pdftester.read() == ["mock_610x914_margin10_1.pdf", "mock_a0_1.pdf", "mock_us_1.pdf"]
+    assert pdftester.pagecount("mock_a0_1.pdf") == 2
+    assert pdftester.pagesize("mock_a0_1.pdf") == [2381.2, 3367.56]
+    assert pdftester.pagecount("mock_us_1.pdf") == 2
+    assert pdftester.pagecount("mock_610x914_margin10_1.pdf") == 8
+    assert pdftester.pagesize("mock_610x914_margin10_1.pdf") == [1190.6, 2525.67]
+
+
+@pytest.mark.parametrize(
+    "arguments",
+    [
+        ["--ol", "a0", "--ol", "us", "--margin", "1", "--margin", "2", "--margin", "3"],
+        ["--ol", "a0", "--ol", "a0"],
+    ],
+)
+def test_several_output_layouts_invalid(testdata, tmp_path, arguments):
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    result = CliRunner().invoke(
+        main, ["--il", "2", "8", "4", *arguments, str(filepath), str(tmp_path / "mock.pdf")]
+    )
+    assert result.exit_code == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_stream_output_pages(testdata, tmp_path, pdftester):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    result = CliRunner().invoke(
+        main,
+        ["--il", "2", "8", "4", "--il", "35", "7", "3", "--ol", "a0", "--stream", "1"]
+        + [str(filepath), str(tmp_path / "mock.pdf")],
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    assert pdftester.read() == [
+        "mock_1_sheet001.pdf",
+        "mock_1_sheet002.pdf",
+        "mock_2_sheet001.pdf",
+        "mock_2_sheet002.pdf",
+    ]
+    assert pdftester.pagecount("mock_2_sheet002.pdf") == 1
+    assert pdftester.pagesize("mock_1_sheet001.pdf") == [2381.2, 3367.56]
+
+
+def test_combined_output_with_bookmarks(testdata, tmp_path):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    layouts = ["--il", "2", "8", "4", "--il", "35", "7", "3", "--ol", "a0"]
+    for combine, output_filepath in [([], "separate.pdf"), (["--combine"], "combined.pdf")]:
+        result = CliRunner().invoke(
+            main, layouts + combine + [str(filepath), str(tmp_path / output_filepath)]
+        )
+        print(result.output)
+        assert result.exit_code == 0
+
+    assert not (tmp_path / "combined_1.pdf").exists()
+    with pikepdf.open(tmp_path / "combined.pdf") as pdf:
+        assert len(pdf.pages) == 4
+        with pdf.open_outline() as outline:
+            titles = [item.title for item in outline.root]
+            destinations = [item.destination for item in outline.root]
+        starts = [
+            pdf.pages.index(pikepdf.Page(destination[0]))
+            for destination in destinations
+            if isinstance(destination, pikepdf.Array)
+        ]
+        assert titles == ["Overview 1", "Overview 2"]
+        assert starts == [0, 2]
+        fonts = {
+            font.objgen
+            for page in pdf.pages
+            for formx in page.resources.XObject.values()
+            for font in formx.Resources.get("/Font", {}).values()
+        }
+    # both overviews use the same font, each separate file has its own copy
+    assert len(fonts) == 1
+    separate_size = sum((tmp_path / f"separate_{n}.pdf").stat().st_size for n in (1, 2))
+    assert (tmp_path / "combined.pdf").stat().st_size < separate_size
+
+
+def test_combined_collage(testdata, tmp_path):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    result = CliRunner().invoke(
+        main,
+        ["--il", "2", "8", "4", "--il", "35", "7", "3", "--combine"]
+        + [str(filepath), str(tmp_path / "mock.pdf")],
+    )
+    print(result.output)
+    assert result.exit_code == 0
+    with pikepdf.open(tmp_path / "mock.pdf") as pdf:
+        assert len(pdf.pages) == 2
+        with pdf.open_outline() as outline:
+            assert [item.title for item in outline.root] == ["Overview 1", "Overview 2"]
@@ -0,0 +1,48 @@
+import os
+
+from nobubo import cache
+from nobubo.assembly import Layout
+
+
+LAYOUT = Layout(first_page=2, columns=8, rows=4)
+
+
+def test_key_depends_on_layout_direction_and_engine(tmp_path):
+    collage_cache = cache.CollageCache(tmp_path, max_size=1000)
+    normal = collage_cache.key("abc", LAYOUT, False, "pikepdf")
+    reverse = collage_cache.key("abc", LAYOUT, True, "pikepdf")
+    other = collage_cache.key("abc", Layout(first_page=2, columns=7, rows=3), False, "pikepdf")
+    pdflatex = collage_cache.key("abc", LAYOUT, False, "pdflatex")
+    assert len({normal, reverse, other, pdflatex}) == 4
+    assert normal.startswith(f"v{cache.CACHE_FORMAT}_")
+
+
+def test_get_and_put(tmp_path):
+    collage_cache = cache.CollageCache(tmp_path / "cache", max_size=1000)
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    assert collage_cache.get("key", workspace) is None
+
+    collage = tmp_path / "collage.pdf"
+    collage.write_bytes(b"collage")
+    collage_cache.put("key", collage)
+    cached = collage_cache.get("key", workspace)
+    assert cached is not None
+    assert cached.read_bytes() == b"collage"
+    assert (collage_cache.hits, collage_cache.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted(tmp_path):
+    collage_cache = cache.CollageCache(tmp_path / "cache", max_size=250)
+    collage = tmp_path / "collage.pdf"
+    collage.write_bytes(b"x" * 100)
+    for number, key in enumerate(["first", "second"]):
+        collage_cache.put(key, collage)
+        os.utime(tmp_path / "cache" / f"{key}.pdf", (number, number))
+    # using "first" makes "second" the least recently used collage
+    assert collage_cache.get("first", tmp_path) is not None
+    collage_cache.put("third", collage)
+    assert sorted(path.name for path in (tmp_path / "cache").glob("*.pdf")) == [
+        "first.pdf",
+        "third.pdf",
+    ]
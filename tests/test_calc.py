@@ -1,10 +1,13 @@
+import io
 import pathlib
+import threading
 
+import pikepdf
 import pytest
 
-from nobubo import init_nobubo
+from nobubo import assembly, detection, errors, init_nobubo
 from nobubo.assembly import Layout, PageSize
-from nobubo.disassembly import Factor, NobuboOutput
+from nobubo.disassembly import SAVE_PRESETS, Factor, NobuboOutput, SaveOptions, TilePlan
 
 
 INPUT_PAGE = PageSize(width=483.307, height=729.917)
@@ -73,6 +76,46 @@ class TestOutputCalculations:
         assert factor.y == expected_factor.y
 
 
+class TestAssemblyCalculations:
+    def test_page_grid_normal(self):
+        grid = assembly.page_grid(Layout(first_page=2, columns=3, rows=2), False)
+        assert grid == [(2, 0, 1), (3, 1, 1), (4, 2, 1), (5, 0, 0), (6, 1, 0), (7, 2, 0)]
+
+    def test_page_grid_reverse(self):
+        grid = assembly.page_grid(Layout(first_page=2, columns=3, rows=2), True)
+        assert grid == [(5, 0, 1), (6, 1, 1), (7, 2, 1), (2, 0, 0), (3, 1, 0), (4, 2, 0)]
+
+    def test_page_range_too_large(self):
+        with pytest.raises(errors.UsageError):
+            assembly.check_page_range(Layout(first_page=2, columns=8, rows=4), 32)
+
+    def test_page_range_starts_before_first_page(self):
+        with pytest.raises(errors.UsageError, match="numbered from 1"):
+            assembly.check_page_range(Layout(first_page=0, columns=8, rows=4), 40)
+
+    def test_pdflatex_reads_extracted_pages(self, testdata, tmp_path):
+        filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+        nobubo_input = init_nobubo.parse_cli_input_data(
+            [(35, 7, 3)], True, str(filepath), engine="pdflatex", tex_format=False
+        )
+        command, _ = nobubo_input.pdflatex_command(tmp_path, nobubo_input.layout[0])
+        tex = pathlib.Path(command[-1]).read_text()
+        (slim,) = tmp_path.glob("pages_*.pdf")
+        assert f"{{{slim},15-21,8-14,1-7 }}" in tex
+        with pikepdf.open(slim) as pdf:
+            assert len(pdf.pages) == 21
+            assert [chunk.text for chunk in detection.page_text(pdf.pages[0])] == ["1B", "-"]
+
+    def test_pdflatex_reads_input_covered_by_layout(self, testdata, tmp_path):
+        filepath = testdata / "mockpattern_nooverview_8x4.pdf"
+        nobubo_input = init_nobubo.parse_cli_input_data(
+            [(1, 8, 4)], False, str(filepath), engine="pdflatex", tex_format=False
+        )
+        command, _ = nobubo_input.pdflatex_command(tmp_path, nobubo_input.layout[0])
+        assert f"{{{filepath},1-32 }}" in pathlib.Path(command[-1]).read_text()
+        assert not list(tmp_path.glob("pages_*.pdf"))
+
+
 class TestCliHelpers:
     def test_conversion_to_mm(self):
         mm = init_nobubo.to_mm("920x1187")
@@ -95,3 +138,165 @@ class TestCliHelpers:
         assert init_nobubo.parse_output_layout("a0", 20) == PageSize(
             width=2270.551, height=3257.008
         )
+
+    def test_parse_save_options_overrides_preset(self):
+        options = init_nobubo.parse_save_options("fast", compression_level=6, linearize=True)
+        assert options == SaveOptions(
+            object_streams="disable",
+            compress_streams=True,
+            compression_level=6,
+            recompress=True,
+            linearize=True,
+        )
+        assert SAVE_PRESETS["fast"].linearize is False  # the preset itself is unchanged
+
+    def test_parse_save_options_unknown_preset(self):
+        with pytest.raises(errors.UsageError):
+            init_nobubo.parse_save_options("tiny")
+
+    def test_saves_that_compress_wait_for_each_other(self, monkeypatch):
+        inside, release = threading.Event(), threading.Event()
+        levels = []
+        original = SaveOptions._save
+
+        def save(options, pdf, output_path):
+            if options.compression_level == 9:
+                inside.set()
+                release.wait(5)
+            levels.append(options.compression_level)
+            original(options, pdf, output_path)
+
+        monkeypatch.setattr(SaveOptions, "_save", save)
+        small = threading.Thread(
+            target=SAVE_PRESETS["small"].save, args=(pikepdf.new(), io.BytesIO())
+        )
+        small.start()
+        assert inside.wait(5)
+        default = threading.Thread(
+            target=SAVE_PRESETS["default"].save, args=(pikepdf.new(), io.BytesIO())
+        )
+        default.start()
+        default.join(0.2)
+        # the default save would otherwise use compression level 9 as well
+        assert default.is_alive()
+        release.set()
+        small.join()
+        default.join()
+        assert levels == [9, None]
+
+
+def iterative_tile_points(layout, n_up_factor, pagesize):
+    """
+    The tiles as nobubo calculated them step by step before TilePlan,
+    kept as reference: the factors advance to the right until the end of
+    a row is reached, then continue at the left of the next row.
+    """
+    lowerleft_factor = Factor(x=0, y=0)
+    upperright_factor = Factor(x=1, y=1)
+    pages_needed = NobuboOutput(pathlib.Path(""), None).pages_needed(layout, n_up_factor)
+    tiles = []
+    for _ in range(pages_needed):
+        llx = lowerleft_factor.x * n_up_factor.x * pagesize.width
+        lly = lowerleft_factor.y * n_up_factor.y * pagesize.height
+        if layout.rows - upperright_factor.y * n_up_factor.y < 0:
+            ury = layout.rows * pagesize.height
+        else:
+            ury = upperright_factor.y * n_up_factor.y * pagesize.height
+        colsleft = layout.columns - upperright_factor.x * n_up_factor.x
+        if colsleft < 0:
+            urx = layout.columns * pagesize.width
+        else:
+            urx = upperright_factor.x * n_up_factor.x * pagesize.width
+        if colsleft > 0:
+            lowerleft_factor.x += 1
+            upperright_factor.x += 1
+        else:
+            lowerleft_factor = Factor(x=0, y=lowerleft_factor.y + 1)
+            upperright_factor = Factor(x=1, y=upperright_factor.y + 1)
+        tiles.append((llx, lly, urx, ury))
+    return tiles
+
+
+class TestTilePlan:
+    @pytest.mark.parametrize("n_up_x", range(1, 6))
+    @pytest.mark.parametrize("n_up_y", range(1, 6))
+    @pytest.mark.parametrize(
+        "pagesize", [INPUT_PAGE, PageSize(width=595.3, height=841.89), PageSize(612, 792)]
+    )
+    def test_same_tiles_as_iterative_calculation(self, n_up_x, n_up_y, pagesize):
+        # an output page that fits exactly n_up_x * n_up_y pattern pages, plus a bit
+        output_pagesize = PageSize(
+            width=pagesize.width * n_up_x + 10, height=pagesize.height * n_up_y + 10
+        )
+        for columns in range(1, 13):
+            for rows in range(1, 13):
+                layout = Layout(first_page=2, columns=columns, rows=rows)
+                plan = TilePlan(layout, pagesize, output_pagesize)
+                factor = Factor(x=n_up_x, y=n_up_y)
+                assert plan.bands == [(factor, False)] * plan.rows
+                assert list(plan) == iterative_tile_points(layout, factor, pagesize)
+
+    def test_boxes_are_a_flat_array(self):
+        plan = TilePlan(one_overview_uneven, PageSize(100, 200), PageSize(450, 450))
+        assert plan.rows == 2
+        assert plan.boxes.typecode == "d"
+        assert len(plan) == 6 and len(plan.boxes) == 24
+        assert plan[0] == (0.0, 0.0, 400.0, 400.0)
+        assert plan[2] == (800.0, 0.0, 900.0, 400.0)
+        assert plan[-1] == (800.0, 400.0, 900.0, 800.0)
+        with pytest.raises(IndexError):
+            plan[6]
+
+    def test_output_smaller_than_pattern_page(self):
+        with pytest.raises(errors.UsageError):
+            TilePlan(one_overview_even, PageSize(100, 200), PageSize(450, 150))
+
+    def test_output_smaller_than_pattern_page_fails_before_assembling(
+        self, testdata, tmp_path, monkeypatch
+    ):
+        def assemble(*args):
+            raise AssertionError("the collage was assembled")
+
+        monkeypatch.setattr(assembly.NobuboInput, "assemble_collage", assemble)
+        nobubo_input = init_nobubo.parse_cli_input_data(
+            [(2, 8, 4)], False, str(testdata / "mockpattern_oneoverview_8x4.pdf")
+        )
+        nobubo_output = init_nobubo.parse_cli_output_data(
+            "100x100", None, str(tmp_path / "out.pdf")
+        )
+        with pytest.raises(errors.UsageError, match="smaller than a pattern page"):
+            init_nobubo.run_conversion(nobubo_input, nobubo_output)
+
+    def test_turned_output_pages(self):
+        a4, a0 = PageSize(595.3, 841.89), PageSize(2383.937, 3370.394)
+        layout = Layout(first_page=1, columns=5, rows=2)
+        assert len(TilePlan(layout, a4, a0)) == 2
+        plan = TilePlan(layout, a4, a0, "best")
+        assert (len(plan), plan.saved_sheets) == (1, 1)
+        assert plan.bands == [(Factor(x=5, y=2), True)]
+        assert plan[0] == (0.0, 0.0, 5 * 595.3, 2 * 841.89)
+
+    def test_mixed_orientations_per_row(self):
+        a4, a0 = PageSize(595.3, 841.89), PageSize(2383.937, 3370.394)
+        layout = Layout(first_page=1, columns=10, rows=5)
+        assert len(TilePlan(layout, a4, a0, "best")) == 6
+        plan = TilePlan(layout, a4, a0, "mixed")
+        assert (len(plan), plan.saved_sheets) == (5, 1)
+        assert [turned for _, turned in plan.bands] == [False, True]
+        assert plan.turned == [3, 4]
+        assert plan[3] == (0.0, 4 * 841.89, 5 * 595.3, 5 * 841.89)
+        # every pattern page is on exactly one output page
+        area = sum((urx - llx) * (ury - lly) for llx, lly, urx, ury in plan)
+        assert area == pytest.approx(10 * 5 * 595.3 * 841.89)
+
+    def test_turning_is_only_used_if_it_saves_sheets(self):
+        layout = Layout(first_page=1, columns=6, rows=5)
+        a4, a0 = PageSize(595.3, 841.89), PageSize(2383.937, 3370.394)
+        for orientation in ("best", "mixed"):
+            plan = TilePlan(layout, a4, a0, orientation)
+            assert list(plan) == list(TilePlan(layout, a4, a0))
+            assert plan.saved_sheets == 0
+
+    def test_turned_output_page_fits_a_pattern_page(self):
+        plan = TilePlan(one_overview_even, PageSize(100, 200), PageSize(450, 150), "best")
+        assert plan.bands[0] == (Factor(x=1, y=2), True)
@@ -0,0 +1,51 @@
+import pikepdf
+
+from benchmarks import patterngen
+from nobubo import dedup
+from nobubo.init_nobubo import parse_cli_input_data
+
+
+def test_deduplicate_copies_of_the_same_page(tmp_path):
+    path = patterngen.generate_pattern(tmp_path / "pattern.pdf", 2, 1)
+    merged = pikepdf.new()
+    with pikepdf.open(path) as first, pikepdf.open(path) as second:
+        merged.pages.extend(first.pages)
+        merged.pages.extend(second.pages)
+        fonts = {page.resources.Font.F1.objgen for page in merged.pages}
+        assert len(fonts) == 2
+
+        # the font and the content streams of the two pages
+        assert dedup.deduplicate(merged) == 3
+        assert len({page.resources.Font.F1.objgen for page in merged.pages}) == 1
+        assert len({page.obj.Contents.objgen for page in merged.pages}) == 2
+
+
+def test_different_objects_are_kept(tmp_path):
+    pdf = pikepdf.new()
+    for text in (b"1", b"2"):
+        pdf.add_blank_page()
+        stream = pdf.make_stream(text)
+        pdf.pages[-1].Resources = pikepdf.Dictionary(XObject=pikepdf.Dictionary(X=stream))
+        pdf.pages[-1].Contents = pdf.make_stream(b"% " + text)
+    assert dedup.deduplicate(pdf) == 0
+
+
+def test_blank_and_repeated_pattern_pages(tmp_path, caplog):
+    path = patterngen.generate_pattern(tmp_path / "pattern.pdf", 3, 2)
+    with pikepdf.open(path, allow_overwriting_input=True) as pdf:
+        pdf.pages[3].Contents = pdf.make_stream(pdf.pages[0].Contents.read_bytes())
+        pdf.pages[5].Contents = pdf.make_stream(b"q 1 0 0 1 0 0 cm Q")
+        pdf.save(path)
+
+    with pikepdf.open(path) as pdf:
+        shared = dedup.find_shared_pages(pdf, range(1, 7))
+    assert shared.representatives == {1: 1, 2: 2, 3: 3, 4: 1, 5: 5, 6: None}
+    assert (shared.blank, shared.repeated) == (1, 1)
+
+    nobubo_input = parse_cli_input_data([(1, 3, 2)], False, str(path))
+    with caplog.at_level("INFO"), pikepdf.open(path) as source:
+        collage = nobubo_input.build_collage(source, nobubo_input.layout[0])
+        xobjects = collage.pages[0].resources.XObject
+        assert len(xobjects) == 5
+        assert len({xobject.objgen for xobject in xobjects.values()}) == 4
+    assert "1 blank pattern pages are left out, 1 repeat an earlier page" in caplog.text
@@ -0,0 +1,97 @@
+import json
+import logging
+
+import pikepdf
+from click.testing import CliRunner
+
+from benchmarks import patterngen
+from nobubo import detection, geometry
+from nobubo.assembly import Layout
+from nobubo.cli import main
+
+
+def detect(path):
+    with pikepdf.open(path) as pdf:
+        return detection.detect_layouts(pdf, geometry.PageIndex(pdf))
+
+
+def test_grid_from_overview_sheets(testdata):
+    suggestions = detect(testdata / "mockpattern_twooverviews_8x4_7x3.pdf")
+    assert [candidates[0].layout for candidates in suggestions] == [
+        Layout(first_page=2, columns=8, rows=4),
+        Layout(first_page=35, columns=7, rows=3),
+    ]
+    assert suggestions[0][0].reasons == ["page numbers on the overview sheet"]
+    assert suggestions[0][0].confidence > 0.5 > suggestions[0][1].confidence
+
+
+def test_grid_from_page_labels(tmp_path):
+    # the overview sheet of patterngen has no page numbers, but the pages are labeled A1 ... D6
+    path = patterngen.generate_pattern(tmp_path / "pattern.pdf", 6, 4, overview=True)
+    (candidates,) = detect(path)
+    assert candidates[0].layout == Layout(first_page=2, columns=6, rows=4)
+    assert candidates[0].reasons == ["grid labels on the pattern pages"]
+
+
+def test_guess_without_overview_is_flagged(testdata, caplog):
+    with caplog.at_level(logging.WARNING):
+        with pikepdf.open(testdata / "mockpattern_nooverview_8x4.pdf") as pdf:
+            layouts = detection.best_layouts(pdf, geometry.PageIndex(pdf))
+    assert layouts == [Layout(first_page=1, columns=8, rows=4)]
+    assert "are a guess" in caplog.text
+
+
+def test_rank_candidates():
+    candidates = detection.rank_candidates(3, 12, overview_grid=(3, 4), label_grid=None)
+    assert [(c.layout.columns, c.layout.rows) for c in candidates] == [
+        (3, 4),
+        (4, 3),
+        (6, 2),
+        (2, 6),
+        (12, 1),
+        (1, 12),
+    ]
+    assert candidates[0].confidence == 0.85
+
+
+def test_page_text_joins_separately_placed_glyphs(testdata):
+    with pikepdf.open(testdata / "mockpattern_twooverviews_8x4_7x3.pdf") as pdf:
+        assert [chunk.text for chunk in detection.page_text(pdf.pages[1])] == ["1A", "-"]
+
+
+def test_decoder_with_surrogate_pair_ranges():
+    pdf = pikepdf.new()
+    cmap = (
+        b"1 beginbfchar\n<01> <0041>\nendbfchar\n"
+        b"3 beginbfrange\n<41> <42> <D835DC00>\n<30> <39> <0030>\n<F0> <FF> <FFFE>\nendbfrange\n"
+    )
+    font = pikepdf.Dictionary(ToUnicode=pdf.make_stream(cmap))
+    decoder = detection._decoder(font)
+    assert detection._decode(b"\x01AB12", decoder) == "A\U0001d400\U0001d40112"
+    # the destination of the last range runs out of UTF-16 code units after two codes
+    assert [decoder.get(code) for code in (b"\xf0", b"\xf1", b"\xf2")] == ["\ufffe", "\uffff", None]
+
+
+def test_il_auto(testdata, tmp_path):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    result = CliRunner().invoke(
+        main,
+        ["--il", "auto", "--ol", "a0", "--plan", "--plan-format", "json"]
+        + [str(filepath), str(tmp_path / "out.pdf")],
+    )
+    assert result.exit_code == 0
+    plans = json.loads(result.stdout)
+    assert [(plan["first_page"], plan["columns"], plan["rows"]) for plan in plans] == [
+        (2, 8, 4),
+        (35, 7, 3),
+    ]
+
+
+def test_il_auto_and_explicit_layout(testdata, tmp_path):
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    result = CliRunner().invoke(
+        main,
+        ["--il", "auto", "--il", "2", "8", "4", str(filepath), str(tmp_path / "out.pdf")],
+    )
+    assert result.exit_code == 2
+    assert "either" in result.output
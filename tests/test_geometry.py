@@ -0,0 +1,81 @@
+import logging
+
+import pikepdf
+import pytest
+
+from benchmarks import patterngen
+from nobubo import geometry
+from nobubo.assembly import PageSize
+from nobubo.init_nobubo import parse_cli_input_data, parse_cli_output_data, run_conversion
+
+
+@pytest.fixture
+def mixed_pattern(tmp_path):
+    """
+    A 3x2 A4 pattern after an overview page, where page 4 is letter sized,
+    page 6 is cropped slightly and page 7 is rotated.
+    """
+    path = patterngen.generate_pattern(tmp_path / "mixed.pdf", 3, 2, overview=True)
+    with pikepdf.open(path, allow_overwriting_input=True) as pdf:
+        pdf.pages[3].MediaBox = [0, 0, *patterngen.LETTER]
+        pdf.pages[5].CropBox = [2, 2, 595.3, 841.89]
+        pdf.pages[6].MediaBox = [0, 0, 841.89, 595.3]
+        pdf.pages[6].Rotate = 90
+        pdf.save(path)
+    return path
+
+
+def test_index_sizes(mixed_pattern):
+    with pikepdf.open(mixed_pattern) as pdf:
+        index = geometry.PageIndex(pdf)
+    assert len(index) == 7
+    assert index.size(1) == (841.89, 595.3)  # landscape overview
+    assert index.size(2) == (595.3, 841.89)
+    assert index.size(4) == patterngen.LETTER
+    assert index.size(6) == (593.3, 839.89)
+    assert index.size(7) == (595.3, 841.89)  # rotated back to portrait
+    assert list(index.rotations) == [0, 0, 0, 0, 0, 0, 90]
+    with pytest.raises(IndexError):
+        index.size(8)
+
+
+def test_common_size_and_differing_pages(mixed_pattern):
+    with pikepdf.open(mixed_pattern) as pdf:
+        index = geometry.PageIndex(pdf)
+    assert index.common_size(2, 7) == (595.3, 841.89)
+    assert index.differing_pages(2, 7, (595.3, 841.89)) == [4, 6]
+    # a tie goes to the size that comes first
+    assert index.common_size(1, 2) == (841.89, 595.3)
+
+
+def test_inherited_rotation():
+    pdf = pikepdf.new()
+    pdf.add_blank_page(page_size=(100, 200))
+    pdf.Root.Pages.Rotate = -90
+    assert geometry.PageIndex(pdf).size(1) == (200, 100)
+
+
+def test_mixed_page_sizes_warn(mixed_pattern, caplog):
+    with caplog.at_level(logging.WARNING):
+        nobubo_input = parse_cli_input_data([(2, 3, 2)], False, str(mixed_pattern))
+    assert nobubo_input.layout_pagesize(nobubo_input.layout[0]) == PageSize(595.3, 841.89)
+    assert "4 (612.0 x 792.0), 6 (593.3 x 839.89)" in caplog.text
+
+
+def test_layouts_with_different_page_sizes(tmp_path):
+    a4 = patterngen.generate_pattern(tmp_path / "a4.pdf", 2, 2)
+    letter = patterngen.generate_pattern(tmp_path / "letter.pdf", 3, 1, page_size=patterngen.LETTER)
+    with pikepdf.open(a4, allow_overwriting_input=True) as pdf, pikepdf.open(letter) as other:
+        pdf.pages.extend(other.pages)
+        pdf.save(a4)
+
+    nobubo_input = parse_cli_input_data([(1, 2, 2), (5, 3, 1)], False, str(a4))
+    nobubo_output = parse_cli_output_data(None, None, str(tmp_path / "out.pdf"))
+    run_conversion(nobubo_input, nobubo_output)
+
+    with (
+        pikepdf.open(tmp_path / "out_1.pdf") as first,
+        pikepdf.open(tmp_path / "out_2.pdf") as second,
+    ):
+        assert [float(x) for x in first.pages[0].mediabox] == [0, 0, 1190.6, 1683.78]
+        assert [float(x) for x in second.pages[0].mediabox] == [0, 0, 1836, 792]
@@ -0,0 +1,93 @@
+import io
+import tempfile
+
+import pikepdf
+import pytest
+
+from nobubo import errors, memory
+from nobubo.init_nobubo import parse_cli_input_data, parse_cli_outputs, run_conversion
+
+
+class Unseekable(io.RawIOBase):
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self._data.readinto(buffer)
+
+
+@pytest.fixture
+def pattern(testdata):
+    return (testdata / "mockpattern_twooverviews_8x4_7x3.pdf").read_bytes()
+
+
+def test_without_filesystem(pattern, monkeypatch):
+    def no_files(*args, **kwargs):
+        raise AssertionError("the filesystem was used")
+
+    monkeypatch.setattr(tempfile, "TemporaryFile", no_files)
+    monkeypatch.setattr(tempfile, "TemporaryDirectory", no_files)
+    outputs = parse_cli_outputs(["a0", "us"], [], "pattern.pdf")
+    streams = memory.convert_in_memory(pattern, [(2, 8, 4), (35, 7, 3)], outputs)
+
+    assert [(stream.name, stream.overview) for stream in streams] == [
+        ("pattern_a0_1.pdf", 1),
+        ("pattern_us_1.pdf", 1),
+        ("pattern_a0_2.pdf", 2),
+        ("pattern_us_2.pdf", 2),
+    ]
+    assert all(isinstance(stream.data, io.BytesIO) for stream in streams)
+    with pikepdf.open(streams[0].data) as pdf:
+        # same sheets as test_two_overviews_normal_a0
+        assert len(pdf.pages) == 2
+
+
+def test_same_output_as_files(pattern, testdata, tmp_path):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    output_path = str(tmp_path / "pattern.pdf")
+    run_conversion(
+        parse_cli_input_data([(2, 8, 4)], True, str(filepath)),
+        parse_cli_outputs(["us"], [], output_path),
+    )
+    (stream,) = memory.convert_in_memory(
+        pattern, [(2, 8, 4)], parse_cli_outputs(["us"], [], output_path), reverse_assembly=True
+    )
+    (tmp_path / "memory.pdf").write_bytes(stream.data.read())
+    with (
+        pikepdf.open(tmp_path / "pattern_1.pdf") as files,
+        pikepdf.open(tmp_path / "memory.pdf") as in_memory,
+    ):
+        assert [page.cropbox for page in files.pages] == [page.cropbox for page in in_memory.pages]
+
+
+def test_collages_are_saved_straight_to_the_output(testdata, tmp_path, monkeypatch):
+    def no_files(*args, **kwargs):
+        raise AssertionError("a temporary collage was written")
+
+    monkeypatch.setattr(tempfile, "TemporaryDirectory", no_files)
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    run_conversion(
+        parse_cli_input_data([(2, 8, 4), (35, 7, 3)], False, str(filepath)),
+        parse_cli_outputs([], [], str(tmp_path / "collage.pdf")),
+    )
+    with pikepdf.open(tmp_path / "collage_2.pdf") as pdf:
+        assert len(pdf.pages) == 1
+
+
+def test_large_unseekable_input_spills(pattern):
+    outputs = parse_cli_outputs([], [], "pattern.pdf")
+    (stream,) = memory.convert_in_memory(
+        io.BufferedReader(Unseekable(pattern)), [(35, 7, 3)], outputs, spill_threshold=1024
+    )
+    assert not isinstance(stream.data, io.BytesIO)
+    with pikepdf.open(stream.data) as pdf:
+        assert [float(x) for x in pdf.pages[0].mediabox] == [0, 0, 4167.1, 2525.67]
+    stream.data.close()
+
+
+def test_invalid_input():
+    with pytest.raises(errors.UsageError, match="input pdf"):
+        memory.convert_in_memory(b"no pdf", [(2, 8, 4)], parse_cli_outputs([], [], "out.pdf"))
@@ -0,0 +1,49 @@
+import pikepdf
+
+from benchmarks import patterngen
+from nobubo import packing
+from nobubo.assembly import PageSize
+from nobubo.init_nobubo import parse_cli_input_data, parse_cli_output_data, run_conversion
+
+A4 = PageSize(595.3, 841.89)
+A0 = PageSize(2383.937, 3370.394)
+
+
+def piece(overview, sheet, columns, rows):
+    return packing.Piece(overview, sheet, columns * A4.width, rows * A4.height)
+
+
+def test_pack_fills_shelves():
+    pieces = [piece(0, 1, 2, 4), piece(0, 2, 4, 1), piece(0, 3, 2, 1), piece(1, 0, 4, 3)]
+    placements = packing.pack(pieces, A0)
+    assert [(p.piece.sheet, p.sheet, p.x, p.y) for p in placements] == [
+        (1, 0, 0.0, 0.0),
+        (3, 0, 2 * A4.width, 0.0),
+        (0, 1, 0.0, 0.0),
+        (2, 1, 0.0, 3 * A4.height),
+    ]
+    assert packing.pack(list(pieces), A0) == placements
+
+
+def test_pieces_larger_than_a_sheet_are_left_out():
+    placements = packing.pack([piece(0, 0, 5, 1), piece(0, 1, 1, 1)], A0)
+    assert [p.piece.sheet for p in placements] == [1]
+
+
+def test_pack_overviews(tmp_path):
+    path = patterngen.generate_pattern(tmp_path / "pattern.pdf", 6, 5)
+    with pikepdf.open(path, allow_overwriting_input=True) as pdf:
+        with pikepdf.open(patterngen.generate_pattern(tmp_path / "small.pdf", 5, 3)) as small:
+            pdf.pages.extend(small.pages)
+            pdf.save(path)
+    nobubo_input = parse_cli_input_data([(1, 6, 5), (31, 5, 3)], False, str(path))
+    nobubo_output = parse_cli_output_data("a0", None, str(tmp_path / "out.pdf"), pack=True)
+    run_conversion(nobubo_input, nobubo_output)
+
+    # 6 sheets without packing
+    with pikepdf.open(tmp_path / "out_1.pdf") as first:
+        assert len(first.pages) == 1
+    assert not (tmp_path / "out_2.pdf").exists()
+    with pikepdf.open(tmp_path / "out_shared.pdf") as shared:
+        assert len(shared.pages) == 3
+        assert [float(x) for x in shared.pages[2].mediabox] == [0, 0, 2 * 595.3, 841.89]
@@ -0,0 +1,91 @@
+import json
+
+import pikepdf
+from click.testing import CliRunner
+
+from benchmarks import patterngen
+from nobubo import plan
+from nobubo.cli import main
+from nobubo.init_nobubo import parse_cli_input_data, parse_cli_output_data
+
+
+def test_plan_a0(testdata, tmp_path):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    nobubo_input = parse_cli_input_data([(2, 8, 4), (35, 7, 3)], False, str(filepath))
+    nobubo_output = parse_cli_output_data("a0", None, str(tmp_path / "out.pdf"))
+    plans = plan.plan_conversion(nobubo_input, nobubo_output)
+
+    # same sheets as test_two_overviews_normal_a0
+    assert [overview.sheets for overview in plans] == [2, 2]
+    assert plans[1].crop_boxes == [(0.0, 0.0, 2381.2, 2525.67), (2381.2, 0.0, 4167.1, 2525.67)]
+    assert (plans[1].first_page, plans[1].last_page) == (35, 55)
+    # 21 pattern pages on two A0 sheets
+    assert plans[1].coverage == round(100 * 21 * 595.3 * 841.89 / (2 * 2383.937 * 3370.394), 1)
+    assert not (tmp_path / "out_1.pdf").exists()
+
+
+def test_plan_collage_covers_everything(testdata, tmp_path):
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    nobubo_input = parse_cli_input_data([(2, 8, 4)], False, str(filepath))
+    nobubo_output = parse_cli_output_data(None, None, str(tmp_path / "out.pdf"))
+    (collage,) = plan.plan_conversion(nobubo_input, nobubo_output)
+    assert collage.crop_boxes == [(0.0, 0.0, 4762.4, 3367.56)]
+    assert collage.coverage == 100.0
+
+
+def test_plan_cli_writes_no_files(testdata, tmp_path):
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    result = CliRunner().invoke(
+        main,
+        ["--il", "2", "8", "4", "--ol", "a0", "--plan", "--plan-format", "json"]
+        + [str(filepath), str(tmp_path / "out.pdf")],
+    )
+    assert result.exit_code == 0
+    plans = json.loads(result.stdout)
+    assert plans[0]["sheets"] == 2
+    assert plans[0]["estimated_bytes"] > 0
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_plan_reports_turned_sheets(tmp_path):
+    filepath = patterngen.generate_pattern(tmp_path / "pattern.pdf", 5, 2)
+    nobubo_input = parse_cli_input_data([(1, 5, 2)], False, str(filepath))
+    nobubo_output = parse_cli_output_data(
+        "a0", None, str(tmp_path / "out.pdf"), orientation="mixed"
+    )
+    (overview,) = plan.plan_conversion(nobubo_input, nobubo_output)
+    assert (overview.sheets, overview.saved_sheets) == (1, 1)
+    assert overview.turned_sheets == [1]
+    text = plan.format_plan([overview])
+    assert "sheet   1:" in text and "mm), turned" in text
+    assert "turning sheets saves 1 sheet(s)" in text
+
+
+def test_plan_packed_sheets(tmp_path):
+    path = patterngen.generate_pattern(tmp_path / "pattern.pdf", 6, 5)
+    with pikepdf.open(path, allow_overwriting_input=True) as pdf:
+        with pikepdf.open(patterngen.generate_pattern(tmp_path / "small.pdf", 5, 3)) as small:
+            pdf.pages.extend(small.pages)
+            pdf.save(path)
+    nobubo_input = parse_cli_input_data([(1, 6, 5), (31, 5, 3)], False, str(path))
+    nobubo_output = parse_cli_output_data("a0", None, str(tmp_path / "out.pdf"), pack=True)
+    first, second = plan.plan_conversion(nobubo_input, nobubo_output)
+
+    # the same files as test_pack_overviews writes
+    assert (first.sheets, first.packed_sheets) == (1, [2, 3, 4])
+    assert first.shared_path == str(tmp_path / "out_shared.pdf")
+    assert (second.sheets, second.output_path) == (0, None)
+    text = plan.format_plan([first, second])
+    assert "3 partly filled sheet(s) packed into" in text
+    assert "all on shared sheets" in text
+
+
+def test_plan_combined_output(testdata, tmp_path):
+    filepath = testdata / "mockpattern_twooverviews_8x4_7x3.pdf"
+    nobubo_input = parse_cli_input_data([(2, 8, 4), (35, 7, 3)], False, str(filepath))
+    for output_layout in ("a0", None):
+        nobubo_output = parse_cli_output_data(
+            output_layout, None, str(tmp_path / "out.pdf"), combine=True
+        )
+        plans = plan.plan_conversion(nobubo_input, nobubo_output)
+        assert [overview.output_path for overview in plans] == [str(tmp_path / "out.pdf")] * 2
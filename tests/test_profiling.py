@@ -0,0 +1,68 @@
+import concurrent.futures
+import json
+from typing import List
+
+import pytest
+
+from nobubo import profiling
+
+
+def test_stages_are_recorded_with_overview_of_enclosing_stage():
+    with profiling.Profiler() as profiler:
+        with profiling.stage("assemble", 2):
+            with profiling.stage("save_collage"):
+                data = [bytes(1024) for _ in range(1024)]
+        with profiling.stage("write"):
+            pass
+    del data
+    assert [(r.stage, r.overview) for r in profiler.records] == [
+        ("save_collage", 2),
+        ("assemble", 2),
+        ("write", None),
+    ]
+    save, assemble, _ = profiler.records
+    assert save.peak_traced_mb is not None and save.peak_traced_mb >= 1
+    assert assemble.peak_traced_mb is not None and assemble.peak_traced_mb >= 1
+    assert assemble.wall_seconds >= save.wall_seconds
+    assert profiling.active() is None
+
+
+def test_failed_stage_is_recorded():
+    with pytest.raises(ValueError):
+        with profiling.Profiler() as profiler:
+            with profiling.stage("parse_input"):
+                raise ValueError("broken pdf")
+    assert profiler.status == "failed"
+    assert [(r.stage, r.ok) for r in profiler.records] == [("parse_input", False)]
+
+
+def test_disabled_profiler_records_nothing():
+    with profiling.Profiler(enabled=False) as profiler:
+        assert profiling.active() is None
+        with profiling.stage("parse_input"):
+            pass
+    assert profiler.records == []
+
+
+def test_report_is_json(tmp_path):
+    finished: List[profiling.StageRecord] = []
+    with profiling.Profiler(trace_memory=False, on_stage=finished.append) as profiler:
+        with profiling.stage("chop", 1):
+            pass
+    assert finished == profiler.records
+    report_path = tmp_path / "report.json"
+    with report_path.open("w") as f:
+        profiler.write_report(f)
+    report = json.loads(report_path.read_text())
+    assert report["status"] == "ok"
+    assert report["stages"][0]["stage"] == "chop"
+    assert report["stages"][0]["peak_traced_mb"] is None
+
+
+def test_submitted_work_is_merged_into_active_profiler():
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+        with profiling.Profiler(trace_memory=False) as profiler:
+            future = profiling.submit(executor, "chop_chunk", 3, sum, [1, 2])
+            assert profiling.result(future) == 3
+        assert [(r.stage, r.overview) for r in profiler.records] == [("chop_chunk", 3)]
+        assert profiling.result(profiling.submit(executor, "chop_chunk", 3, sum, [1, 2])) == 3
@@ -0,0 +1,59 @@
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Optional, Tuple
+
+import pytest
+
+from nobubo import service
+
+
+@pytest.fixture
+def server_url(tmp_path):
+    queue = service.JobQueue(tmp_path, workers=1)
+    server = service.create_server(queue, max_upload=10 * 1024 * 1024, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield service.server_address(server)
+    server.shutdown()
+    server.server_close()
+    queue.shutdown()
+
+
+def request(url: str, data: Optional[bytes] = None, method: str = "GET") -> Tuple[int, str, bytes]:
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, method=method)) as r:
+        return r.status, r.headers["Content-Type"], r.read()
+
+
+def test_convert_uploaded_pdf(testdata, server_url, tmp_path, pdftester):
+    pdf = (testdata / "mockpattern_twooverviews_8x4_7x3.pdf").read_bytes()
+    code, _, body = request(
+        f"{server_url}/jobs?il=2,8,4&il=35,7,3&ol=a0&reverse=true", data=pdf, method="POST"
+    )
+    assert code == 202
+    job_id = json.loads(body)["id"]
+
+    for _ in range(100):
+        status = json.loads(request(f"{server_url}/jobs/{job_id}")[2])
+        if status["status"] not in ("queued", "running"):
+            break
+        time.sleep(0.1)
+    assert status["status"] == "done"
+    assert status["outputs"] == 2
+
+    code, content_type, body = request(f"{server_url}/jobs/{job_id}/result?file=2")
+    assert content_type == "application/pdf"
+    (tmp_path / "result.pdf").write_bytes(body)
+    assert pdftester.read() == ["result.pdf"]
+    assert pdftester.pagecount("result.pdf") == 2
+    assert pdftester.pages_order(tmp_path / "result.pdf") == ["15B", "7B"]
+
+    assert request(f"{server_url}/jobs/{job_id}", method="DELETE")[0] == 200
+
+
+def test_invalid_parameters_are_rejected(server_url):
+    with pytest.raises(urllib.error.HTTPError) as e:
+        request(f"{server_url}/jobs?il=2,8&ol=a0", data=b"%PDF", method="POST")
+    assert e.value.code == 400
@@ -0,0 +1,50 @@
+import pathlib
+import shutil
+
+import pikepdf
+import pytest
+
+from nobubo import texformat
+from nobubo.init_nobubo import parse_cli_input_data
+
+
+def test_no_format_without_pdflatex(monkeypatch, tmp_path):
+    monkeypatch.setattr(texformat.shutil, "which", lambda name: None)
+    assert texformat.installation_fingerprint() is None
+    assert texformat.ensure_format(tmp_path) is None
+
+
+def test_existing_format_is_reused(monkeypatch, tmp_path):
+    monkeypatch.setattr(texformat, "installation_fingerprint", lambda: "abc")
+    (tmp_path / "nobubo-abc.fmt").write_bytes(b"format")
+    assert texformat.ensure_format(tmp_path) == tmp_path / "nobubo-abc.fmt"
+
+
+def test_user_cache_dir_follows_xdg(monkeypatch, tmp_path):
+    monkeypatch.setattr(texformat.sys, "platform", "linux")
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path))
+    assert texformat.user_cache_dir() == pathlib.Path(tmp_path) / "nobubo"
+
+
+@pytest.mark.skipif(shutil.which("pdflatex") is None, reason="pdflatex is not installed")
+def test_collage_with_format(testdata, tmp_path, pdftester):
+    format_path = texformat.ensure_format(tmp_path / "cache")
+    assert format_path is not None and format_path.exists()
+
+    filepath = testdata / "mockpattern_oneoverview_8x4.pdf"
+    nobubo_input = parse_cli_input_data([(2, 8, 4)], False, str(filepath), "pdflatex")
+    layout = nobubo_input.layout[0]
+    collages = {}
+    for name, tex_format_path in [("preamble", None), ("format", format_path)]:
+        nobubo_input.tex_format_path = tex_format_path
+        workspace = tmp_path / name
+        workspace.mkdir()
+        command, _ = nobubo_input.pdflatex_command(workspace, layout)
+        assert (f"-fmt={format_path}" in command) == (tex_format_path is not None)
+        collages[name] = nobubo_input.assemble_with_pdflatex(workspace, layout)
+
+    # \geometry{} after the dumped preamble sets the size of the collage
+    with pikepdf.open(collages["format"]) as pdf:
+        box = [float(value) for value in pdf.pages[0].mediabox]
+    assert box == pytest.approx([0, 0, 8 * 595.3, 4 * 841.89], abs=0.1)
+    assert pdftester.pages_order(collages["format"]) == pdftester.pages_order(collages["preamble"])